@@ -11,6 +11,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
 from python.glauber.DataStructs.BitArrayMat import BitArrayMat
+from python.glauber.DataStructs.SnapshotArchive import SnapshotReader, ARCHIVE_FILE
+from python.glauber.DataStructs.SnapshotCube import CubeReader, CUBE_FILE
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 
@@ -21,13 +23,29 @@ values = [0,1]
 labels = {0:'-1', 1:'+1'}
     
 
+def load_bitmap(dir, iter, n_outer):
+    """the bitmap of iteration iter, from the cube of the run, from its file or from the archive of the run"""
+    path = dir + f"/iter-{iter}.bmp"
+    if os.path.exists(os.path.join(dir, CUBE_FILE)):
+        reader = CubeReader(os.path.join(dir, CUBE_FILE))
+        if iter in reader.positions:
+            # a view into the memory map, nothing is read before it is unpacked
+            return reader.get(iter)
+    if not os.path.exists(path) and os.path.exists(os.path.join(dir, ARCHIVE_FILE)):
+        reader = SnapshotReader(os.path.join(dir, ARCHIVE_FILE))
+        if iter not in reader.positions:
+            raise FileNotFoundError(path)
+        return reader.get(iter)
+    matrix = BitArrayMat(n_outer, n_outer)
+    matrix.load_from_file(path)
+    return matrix
+
+
 def plot_bitmap(dir, iter, save = True):
     with (open(f"{dir}/params.json")) as f:
         params = json.load(f)
         
-    matrix = BitArrayMat(params['n_outer'], params['n_outer'])
-    matrix.load_from_file(dir + f"/iter-{iter}.bmp")
-    np_mat = matrix.to_numpy()
+    np_mat = load_bitmap(dir, iter, params['n_outer']).to_numpy()
     
     im = plt.matshow(np_mat, cmap="bwr", vmin=0, vmax=1)
     
@@ -55,10 +73,8 @@ def plot_three_bitmaps(dir_stem, rep, iters, save = True, title = True):
         with (open(f"{dir}/params.json")) as f:
             params = json.load(f)
             
-        matrix = BitArrayMat(params['n_outer'], params['n_outer'])
         try:
-            matrix.load_from_file(dir + f"/iter-{iter}.bmp")
-            np_mat = matrix.to_numpy()
+            np_mat = load_bitmap(dir, iter, params['n_outer']).to_numpy()
         except FileNotFoundError:
             UserWarning(f"This file does not exist: {dir + f'/iter-{iter}.bmp'}")
             np_mat = np.full((params['n_outer'], params['n_outer']), np.nan)        
@@ -89,13 +105,15 @@ def plot_three_bitmaps(dir_stem, rep, iters, save = True, title = True):
 def plot_all_bitmaps_in_dir(dir):
     content = os.listdir(dir)
 
-    iters = [x for x in content if x.endswith('.bmp')]
+    iters = [int(x.split('.')[0].split('-')[1]) for x in content if x.endswith('.bmp')]
+    if ARCHIVE_FILE in content:
+        iters = sorted(set(iters) | set(SnapshotReader(os.path.join(dir, ARCHIVE_FILE)).iterations()))
+    if CUBE_FILE in content:
+        iters = sorted(set(iters) | set(CubeReader(os.path.join(dir, CUBE_FILE)).iterations()))
     futures = []
     
     with ProcessPoolExecutor(max_workers=6) as executor:
         for i in iters:
-            i = i.split('.')[0].split('-')[1]
-            i = int(i)
             ft = executor.submit(plot_bitmap, dir, i)
             futures.append(ft)
 
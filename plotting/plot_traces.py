@@ -8,6 +8,7 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from python.glauber.DataStructs.BitArrayMat import BitArrayMat
+from python.glauber.DataStructs.EventTrace import EventTrace
 
 
 def plot_trace(dir, data):
@@ -44,6 +45,10 @@ def get_data(dir):
     data.update(result)
     data.update(params)
 
+    # newer runs store the trace as events next to the result dict
+    if "trace_file" in data.keys():
+        data["vector"] = EventTrace.load(dir + '/' + data["trace_file"]).dense(data["t"])
+
     return data
 
 
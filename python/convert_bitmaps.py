@@ -0,0 +1,100 @@
+from glauber.DataStructs.BitArrayMat import BitArrayMat
+from glauber.DataStructs.SnapshotArchive import SnapshotArchive, SnapshotReader, ARCHIVE_FILE, KEYFRAME_EVERY
+from glauber.DataStructs.SnapshotCube import SnapshotCube, CubeReader, CUBE_FILE
+import argparse
+import json
+import os
+import sys
+
+parser = argparse.ArgumentParser(description="Converts the iter-<i>.bmp files of finished runs into one snapshot "
+                                 "archive per bitmap_results directory, or lays them out in a cube for analysis")
+
+parser.add_argument("--stem", help="directory to search for bitmap_results directories, e.g. thesis_results")
+parser.add_argument("--keyframe_every", help="store every this many snapshots whole", default=KEYFRAME_EVERY)
+parser.add_argument("--delete", help="if set, delete the bitmaps once the archive is checked against them",
+                    action="store_true")
+parser.add_argument("--cube", help="if set, write a snapshot cube from the bitmaps or the archive instead, the "
+                    "bitmaps are kept", action="store_true")
+
+
+def convert_dir(dir, keyframe_every=KEYFRAME_EVERY, delete=False) -> bool:
+    """Writes the bitmaps in dir to an archive in dir and checks every snapshot in it against its bitmap.
+    Returns False if there was nothing to convert"""
+    files = os.listdir(dir)
+    bitmaps = sorted((int(x.split('-')[1].split('.')[0]), x) for x in files if x.endswith('.bmp'))
+    if len(bitmaps) == 0 or ARCHIVE_FILE in files or "params.json" not in files:
+        return False
+
+    with open(os.path.join(dir, "params.json"), "r") as f:
+        n_outer = json.load(f)["n_outer"]
+
+    path = os.path.join(dir, ARCHIVE_FILE)
+    archive = SnapshotArchive(path, n_outer, n_outer, keyframe_every=int(keyframe_every))
+    for iteration, file in bitmaps:
+        matrix = BitArrayMat(n_outer, n_outer)
+        matrix.load_from_file(os.path.join(dir, file))
+        archive.append_matrix(iteration, matrix)
+
+    reader = SnapshotReader(path)
+    for iteration, file in bitmaps:
+        matrix = BitArrayMat(n_outer, n_outer)
+        matrix.load_from_file(os.path.join(dir, file))
+        if reader.get(iteration).bits() != matrix.bits():
+            os.remove(path)
+            raise RuntimeError(f"Snapshot {iteration} in {path} differs from {file}, removed the archive")
+
+    size = sum(os.path.getsize(os.path.join(dir, file)) for _, file in bitmaps)
+    print(f"{dir}: {len(bitmaps)} bitmaps, {size} bytes -> {os.path.getsize(path)} bytes")
+
+    if delete:
+        for _, file in bitmaps:
+            os.remove(os.path.join(dir, file))
+    return True
+
+
+def cube_dir(dir) -> bool:
+    """Writes all snapshots in dir, from the bitmaps or else from the archive, to a cube in dir.
+    Returns False if there was nothing to write"""
+    files = os.listdir(dir)
+    if CUBE_FILE in files or "params.json" not in files:
+        return False
+
+    with open(os.path.join(dir, "params.json"), "r") as f:
+        n_outer = json.load(f)["n_outer"]
+
+    bitmaps = sorted((int(x.split('-')[1].split('.')[0]), x) for x in files if x.endswith('.bmp'))
+    if len(bitmaps) > 0:
+        def snapshots():
+            for iteration, file in bitmaps:
+                matrix = BitArrayMat(n_outer, n_outer)
+                matrix.load_from_file(os.path.join(dir, file))
+                yield iteration, matrix
+    elif ARCHIVE_FILE in files:
+        snapshots = SnapshotReader(os.path.join(dir, ARCHIVE_FILE)).__iter__
+    else:
+        return False
+
+    path = os.path.join(dir, CUBE_FILE)
+    cube = SnapshotCube(path, n_outer, n_outer)
+    for iteration, matrix in snapshots():
+        cube.append_matrix(iteration, matrix)
+    print(f"{dir}: {len(CubeReader(path))} snapshots -> {os.path.getsize(path)} bytes")
+    return True
+
+
+def main_fn(args=None):
+    args = parser.parse_args(args)
+    converted = 0
+    for root, dirs, files in os.walk(args.stem, followlinks=True):
+        if os.path.basename(root) != "bitmap_results":
+            continue
+        if args.cube:
+            converted += cube_dir(root)
+        else:
+            converted += convert_dir(root, args.keyframe_every, args.delete)
+    print(f"converted {converted} directories")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_fn())
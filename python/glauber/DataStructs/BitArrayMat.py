@@ -5,6 +5,17 @@ import numpy as np
 def _fast_index(self, r, c):
     return r * self.ncol + c
 
+def _halo_index(self, r, c):
+    # rows and columns -1 and n are the ghost cells
+    return (r + 1) * self.stride + c + 1
+
+def _aligned_index(self, r, c):
+    # rows start on a word boundary, see AlignedBitArrayMat
+    return r * self.stride + c
+
+def _aligned_wraparound_index(self, r, c):
+    return (r % self.nrow) * self.stride + c % self.ncol
+
 def _wraparound_index(self, r, c):
 
     if r < 0:
@@ -21,6 +32,135 @@ def _wraparound_index(self, r, c):
 
     return r * self.ncol + c
 
+
+def pack_bits(spins: np.ndarray) -> ba:
+    """bitarray of the spins (0 and 1, any shape) in row-major order, packed by np.packbits instead of one
+    python object per bit"""
+    bits = ba(endian="big")
+    bits.frombytes(np.packbits(spins).tobytes())
+    del bits[spins.size:]
+    return bits
+
+
+# offset table of the four neighbors (above, below, left, right) in rows and in columns
+NEIGHBOR_ROWS = np.array([-1, 1, 0, 0], dtype=np.int64)
+NEIGHBOR_COLS = np.array([0, 0, -1, 1], dtype=np.int64)
+
+
+def read_bits(packed: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """uint8 array of the bits at positions of the packed (big endian) bytes, of the same shape as positions"""
+    return (packed[positions >> 3] >> (7 - (positions & 7)).astype(np.uint8)) & 1
+
+
+def write_bits(packed: np.ndarray, positions: np.ndarray, values) -> None:
+    """sets the bits at positions of the packed (big endian) bytes to values, 0 or 1. Positions that share a byte
+    are fine, the bytes are changed unbuffered"""
+    positions = np.asarray(positions, dtype=np.int64).ravel()
+    values = np.broadcast_to(np.asarray(values, dtype=np.uint8), positions.shape)
+    masks = (np.uint8(0x80) >> (positions & 7).astype(np.uint8)).astype(np.uint8)
+    np.bitwise_and.at(packed, positions >> 3, ~masks)
+    np.bitwise_or.at(packed, positions >> 3, masks * (values & 1))
+
+
+def neighbor_sum_field(spins: np.ndarray, wrap: bool) -> np.ndarray:
+    """sum of the four neighbors of every vertex of the (nrow, ncol) array spins, built from shifted views of the
+    whole lattice. If wrap is not set, the vertices outside of the lattice count as 0"""
+    nb_sum = np.zeros_like(spins)
+    nb_sum[1:, :] += spins[:-1, :]
+    nb_sum[:-1, :] += spins[1:, :]
+    nb_sum[:, 1:] += spins[:, :-1]
+    nb_sum[:, :-1] += spins[:, 1:]
+
+    if wrap:
+        nb_sum[0, :] += spins[-1, :]
+        nb_sum[-1, :] += spins[0, :]
+        nb_sum[:, 0] += spins[:, -1]
+        nb_sum[:, -1] += spins[:, 0]
+    return nb_sum
+
+
+# rows of row_words are padded to whole words of this many bits
+WORD_BITS = 64
+
+
+def n_words(ncol) -> int:
+    return (ncol + WORD_BITS - 1) // WORD_BITS
+
+
+def column_mask(ncol) -> np.ndarray:
+    """(n_words,) uint64 words with the bits of the columns 0, ..., ncol - 1 set and those of the padding not"""
+    bits = np.zeros(n_words(ncol) * WORD_BITS, dtype=np.uint8)
+    bits[:ncol] = 1
+    return np.packbits(bits).view(">u8").astype(np.uint64)
+
+
+def words_from_rows(row_bytes: np.ndarray) -> np.ndarray:
+    """(nrow, n_words) uint64 words of the (nrow, k) packed bytes of the rows, padded with zeros"""
+    padded = np.zeros((row_bytes.shape[0], (row_bytes.shape[1] + 7) // 8 * 8), dtype=np.uint8)
+    padded[:, :row_bytes.shape[1]] = row_bytes
+    return padded.view(">u8").astype(np.uint64)
+
+
+def row_words(spins: np.ndarray) -> np.ndarray:
+    """(nrow, n_words) uint64 array of the (nrow, ncol) array spins. Column c of a row is bit 63 - c % 64 of its
+    word c // 64, i.e. the columns run from the highest bit of the first word down, and the padding is 0"""
+    return words_from_rows(np.packbits(spins, axis=1))
+
+
+def unpack_words(words: np.ndarray, ncol) -> np.ndarray:
+    """Boolean (nrow, ncol) array of the bits of the columns in the (nrow, n_words) words, see row_words"""
+    bits = np.unpackbits(words.astype(">u8").view(np.uint8), axis=1, count=ncol)
+    return bits.view(np.bool_)
+
+
+def shifted_words(words: np.ndarray, ncol, wrap: bool) -> tuple:
+    """the words of the neighbors above, below, left and right: bit c of row r of left is the spin of (r, c - 1),
+    and so on. On a square, the vertices outside of the lattice are 0. The padding of left and right is not"""
+    up = np.zeros_like(words)
+    up[1:] = words[:-1]
+    down = np.zeros_like(words)
+    down[:-1] = words[1:]
+    # a column moves across a word boundary with the carry from the word next to it
+    left = words >> 1
+    left[:, 1:] |= words[:, :-1] << 63
+    right = words << 1
+    right[:, :-1] |= words[:, 1:] >> 63
+
+    if wrap:
+        up[0] = words[-1]
+        down[-1] = words[0]
+        last_word, last_bit = divmod(ncol - 1, WORD_BITS)
+        left[:, 0] |= ((words[:, last_word] >> (63 - last_bit)) & 1) << 63
+        right[:, last_word] |= (words[:, 0] >> 63) << (63 - last_bit)
+    return up, down, left, right
+
+
+def neighbor_count_planes(words: np.ndarray, ncol, wrap: bool) -> tuple:
+    """bit-sliced sum of the four neighbors of every vertex: (ones, twos, fours) words with the bits of the sum at
+    the positions of the vertices, see row_words. Two half adders and a full adder on whole words, so every
+    operation adds up 64 vertices"""
+    up, down, left, right = shifted_words(words, ncol, wrap)
+    sum_ud = up ^ down
+    carry_ud = up & down
+    sum_lr = left ^ right
+    carry_lr = left & right
+
+    ones = sum_ud ^ sum_lr
+    carry = sum_ud & sum_lr
+    half = carry_ud ^ carry_lr
+    twos = half ^ carry
+    fours = (carry_ud & carry_lr) | (half & carry)
+    return ones, twos, fours
+
+
+def neighbor_masks(words: np.ndarray, ncol, wrap: bool) -> tuple:
+    """(at_least_3, at_most_1, exactly_2) words of the vertices with at least three, at most one and exactly
+    two +1 neighbors, see neighbor_count_planes. The padding is 0 in all of them"""
+    ones, twos, fours = neighbor_count_planes(words, ncol, wrap)
+    mask = column_mask(ncol)
+    return (fours | (twos & ones)) & mask, ~(twos | fours) & mask, twos & ~ones & mask
+
+
 class BitArrayMat:
     """Wrapper for Bitarray to allow 2D indexing"""
 
@@ -30,7 +170,7 @@ class BitArrayMat:
         self.size = nrow * ncol
         if list is not None:
             assert nrow * ncol == len(list)
-            self.arr = ba(list)
+            self.arr = pack_bits(np.asarray(list, dtype=np.uint8))
         else:
             self.arr = ba(self.size)
 
@@ -41,6 +181,28 @@ class BitArrayMat:
             self.idx = _fast_index
             self.wraparound_indices = False
 
+    @classmethod
+    def from_numpy(cls, spins: np.ndarray, wraparound_indices=False):
+        """matrix of the (nrow, ncol) array of 0 and 1 spins"""
+        return cls.from_bits(spins.shape[0], spins.shape[1], pack_bits(spins), wraparound_indices=wraparound_indices)
+
+    @classmethod
+    def from_bits(cls, nrow, ncol, bits: ba, wraparound_indices=False):
+        """matrix of the bits in row-major order, like bits() returns them. Takes bits over without copying"""
+        matrix = cls.__new__(cls)
+        matrix.nrow = nrow
+        matrix.ncol = ncol
+        matrix.size = nrow * ncol
+        matrix.arr = bits
+        matrix.set_wraparound(wraparound_indices)
+        return matrix
+
+    @classmethod
+    def from_buffer(cls, nrow, ncol, buffer, wraparound_indices=False):
+        """matrix on top of the packed bits in buffer (big endian, row-major), without copying them. The bitarray
+        covers the whole buffer, i.e. also the padding bits of the last byte, and is read-only if the buffer is"""
+        return cls.from_bits(nrow, ncol, ba(buffer=buffer, endian="big"), wraparound_indices=wraparound_indices)
+
     def set_wraparound(self, wrap):
         if wrap:
             self.idx = _wraparound_index
@@ -67,13 +229,77 @@ class BitArrayMat:
 
     def count(self, i):
         assert i == 0 or i == 1
-        return self.arr.count(i)
+        return self.bits().count(i)
+
+    def bits(self):
+        """the bits of the matrix in row-major order"""
+        return self.arr
+
+    def set_bits(self, spins: np.ndarray) -> None:
+        """fills the matrix from a (nrow, ncol) array of 0 and 1"""
+        self.arr = pack_bits(spins)
+
+    def packed_view(self) -> np.ndarray:
+        """uint8 view of the buffer of the bits, without copying them. Writes to it change the matrix"""
+        return np.frombuffer(self.arr, dtype=np.uint8)
+
+    def flat(self, r, c):
+        """position of the vertex (r, c) in bits()"""
+        return self.idx(self, r, c)
+
+    def positions(self, flat_ids) -> np.ndarray:
+        """positions of the vertices with flat ids flat_ids (row-major, see flat) in the buffer of the bits"""
+        return np.asarray(flat_ids, dtype=np.int64)
+
+    def neighbor_ids(self, flat_ids) -> np.ndarray:
+        """flat ids of the neighbors above, below, left and right of the vertices flat_ids, in a new last axis of
+        length four. On a torus they wrap around, on a square a neighbor outside of the lattice is -1"""
+        rows, cols = np.divmod(np.asarray(flat_ids, dtype=np.int64)[..., None], self.ncol)
+        rows = rows + NEIGHBOR_ROWS
+        cols = cols + NEIGHBOR_COLS
+        if self.wraparound_indices:
+            return rows % self.nrow * self.ncol + cols % self.ncol
+        inside = (rows >= 0) & (rows < self.nrow) & (cols >= 0) & (cols < self.ncol)
+        return np.where(inside, rows * self.ncol + cols, -1)
+
+    def gather(self, flat_ids) -> np.ndarray:
+        """uint8 array of the spins of the vertices flat_ids, read from the packed bits in one go"""
+        return read_bits(self.packed_view(), self.positions(flat_ids))
+
+    def scatter(self, flat_ids, values) -> None:
+        """sets the spins of the vertices flat_ids to values, an array of 0 and 1 or one of them for all. If a
+        vertex comes up more than once, it has to get the same value every time"""
+        write_bits(self.packed_view(), self.positions(flat_ids), values)
+
+    def neighbor_sum(self, flat_ids) -> np.ndarray:
+        """sum of the four neighbors of each of the vertices flat_ids, on a square those outside count as 0"""
+        neighbors = self.neighbor_ids(flat_ids)
+        spins = read_bits(self.packed_view(), self.positions(np.maximum(neighbors, 0)))
+        if not self.wraparound_indices:
+            spins &= (neighbors >= 0)
+        return spins.sum(axis=-1, dtype=np.uint8)
+
+    def neighbor_sum_field(self) -> np.ndarray:
+        """(nrow, ncol) uint8 array of the sum of the four neighbors of every vertex"""
+        return neighbor_sum_field(self.to_numpy(), self.wraparound_indices)
+
+    def row_words(self) -> np.ndarray:
+        """(nrow, n_words) uint64 words of the rows, padded to whole words, see row_words. If the rows fill whole
+        bytes, they are taken from the buffer without unpacking them"""
+        if self.ncol % 8 == 0:
+            return words_from_rows(self.packed_view()[:self.size // 8].reshape((self.nrow, self.ncol // 8)))
+        return row_words(self.to_numpy())
+
+    def neighbor_masks(self) -> tuple:
+        """(at_least_3, at_most_1, exactly_2) words of the whole lattice, see neighbor_masks"""
+        return neighbor_masks(self.row_words(), self.ncol, self.wraparound_indices)
     
     def __str__(self) -> str:
         result = ""
+        bits = self.bits()
 
         for row in range(self.nrow):
-            result += self.arr[row*self.ncol:(row+1)*self.ncol].to01()
+            result += bits[row*self.ncol:(row+1)*self.ncol].to01()
             result += "\n"
 
         return result
@@ -82,9 +308,10 @@ class BitArrayMat:
         # x, y is row, col
         x, y = index
         result = ""
+        bits = self.bits()
 
         for row in range(self.nrow):
-            row_str = self.arr[row*self.ncol:(row+1)*self.ncol].to01()
+            row_str = bits[row*self.ncol:(row+1)*self.ncol].to01()
             if row == x:
                 result += row_str[:y] + "*" + row_str[y+1:]
             else:
@@ -105,15 +332,204 @@ class BitArrayMat:
             self.arr.tofile(f)
 
     def load_from_file(self, path):
-        self.arr = ba()
         with open(path, "rb") as f:
-            self.arr.fromfile(f)
+            self.load_bytes(f.read())
+
+    def load_bytes(self, data):
+        """fills the matrix from the bytes that export_to_file writes"""
+        self.arr = ba()
+        self.arr.frombytes(data)
         self.arr = self.arr[:self.nrow * self.ncol].copy()
 
     def to_numpy(self):
-        try:
-            bits = np.array(self.arr.tolist())
-        except MemoryError as e:
-            print(e)
-        non_pad = bits[:self.ncol * self.nrow]
-        return non_pad.reshape((self.nrow, self.ncol))
\ No newline at end of file
+        """unpacks the bits into a (nrow, ncol) uint8 array"""
+        bits = np.unpackbits(self.packed_view(), count=self.nrow * self.ncol)
+        return bits.reshape((self.nrow, self.ncol))
+
+
+class HaloBitArrayMat(BitArrayMat):
+    """Torus stored with a ring of ghost cells around it. The ghost cells mirror the opposite edges, so
+    reading a neighbor of a vertex on the lattice is plain offset arithmetic instead of the branches and
+    modulo of _wraparound_index. Reads are valid for rows and columns -1, ..., n. Writes wrap the vertex
+    onto the lattice and also update its ghost copies if it is on an edge, or all three if it is in a corner.
+    Files and to_numpy() are the plain matrix without the ghost cells, the same as for BitArrayMat, while
+    packed_view() is the whole buffer, ghost cells included, laid out as in _halo_index"""
+
+    def __init__(self, nrow, ncol, list=None, wraparound_indices=True) -> None:
+        self.nrow = nrow
+        self.ncol = ncol
+        self.size = nrow * ncol
+        self.stride = ncol + 2
+        self.idx = _halo_index
+        self.wraparound_indices = True
+        # offset table of the neighbors in the buffer, the ghost cells make it the same for every vertex
+        self.offsets = np.array([-self.stride, self.stride, -1, 1], dtype=np.int64)
+
+        if list is not None:
+            assert nrow * ncol == len(list)
+            self.set_bits(np.asarray(list, dtype=np.uint8).reshape((nrow, ncol)))
+        else:
+            self.arr = ba((nrow + 2) * self.stride, endian="big")
+            self.arr.setall(0)
+
+    @classmethod
+    def from_numpy(cls, spins: np.ndarray, wraparound_indices=True):
+        matrix = cls(spins.shape[0], spins.shape[1])
+        matrix.set_bits(spins)
+        return matrix
+
+    @classmethod
+    def from_bits(cls, nrow, ncol, bits: ba, wraparound_indices=True):
+        # the ghost cells need the rows apart, so the bits are unpacked once
+        return cls.from_numpy(BitArrayMat.from_bits(nrow, ncol, bits).to_numpy())
+
+    def set_bits(self, spins: np.ndarray) -> None:
+        """fills the matrix and the ghost cells from a (nrow, ncol) array of 0 and 1"""
+        self.arr = pack_bits(np.pad(spins, 1, mode="wrap"))
+
+    def set_wraparound(self, wrap):
+        if not wrap:
+            raise ValueError("A HaloBitArrayMat always wraps around")
+
+    def __setitem__(self, key, value):
+        r = key[0] % self.nrow
+        c = key[1] % self.ncol
+        self.arr[(r + 1) * self.stride + c + 1] = value
+
+        # ghost copies on the opposite sides
+        ghost_r = self.nrow + 1 if r == 0 else 0 if r == self.nrow - 1 else None
+        ghost_c = self.ncol + 1 if c == 0 else 0 if c == self.ncol - 1 else None
+        if ghost_r is not None:
+            self.arr[ghost_r * self.stride + c + 1] = value
+        if ghost_c is not None:
+            self.arr[(r + 1) * self.stride + ghost_c] = value
+            if ghost_r is not None:
+                self.arr[ghost_r * self.stride + ghost_c] = value
+
+    def flat(self, r, c):
+        return (r % self.nrow) * self.ncol + c % self.ncol
+
+    def neighbor_sum_at(self, r, c):
+        """sum of the four neighbors of the vertex (r, c), read straight from the buffer"""
+        k = (r % self.nrow + 1) * self.stride + c % self.ncol + 1
+        arr = self.arr
+        return arr[k - 1] + arr[k + 1] + arr[k - self.stride] + arr[k + self.stride]
+
+    def positions(self, flat_ids) -> np.ndarray:
+        rows, cols = np.divmod(np.asarray(flat_ids, dtype=np.int64), self.ncol)
+        return (rows + 1) * self.stride + cols + 1
+
+    def scatter(self, flat_ids, values) -> None:
+        """sets the spins like BitArrayMat.scatter, and those of the ghost copies of vertices on the edges"""
+        rows, cols = np.divmod(np.asarray(flat_ids, dtype=np.int64).ravel(), self.ncol)
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint8).ravel(), rows.shape)
+        # the rows and columns of all copies: a vertex in row 0 is also in row nrow, one in row nrow - 1 also in
+        # row -1, the same for the columns
+        ghost_rows = np.where(rows == 0, self.nrow, np.where(rows == self.nrow - 1, -1, rows))
+        ghost_cols = np.where(cols == 0, self.ncol, np.where(cols == self.ncol - 1, -1, cols))
+        all_rows = np.concatenate((rows, ghost_rows, rows, ghost_rows))
+        all_cols = np.concatenate((cols, cols, ghost_cols, ghost_cols))
+        write_bits(self.packed_view(), (all_rows + 1) * self.stride + all_cols + 1, np.tile(values, 4))
+
+    def neighbor_sum(self, flat_ids) -> np.ndarray:
+        """sum of the four neighbors of each of the vertices flat_ids, at the same offsets for every vertex"""
+        positions = self.positions(flat_ids)[..., None] + self.offsets
+        return read_bits(self.packed_view(), positions).sum(axis=-1, dtype=np.uint8)
+
+    def neighbor_sum_field(self) -> np.ndarray:
+        padded = self.padded_numpy()
+        return (padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]).astype(np.uint8)
+
+    def row_words(self) -> np.ndarray:
+        return row_words(self.to_numpy())
+
+    def padded_numpy(self):
+        """(nrow + 2, ncol + 2) uint8 array of the spins with the ghost cells around them"""
+        bits = np.unpackbits(self.packed_view(), count=(self.nrow + 2) * self.stride)
+        return bits.reshape((self.nrow + 2, self.stride))
+
+    def to_numpy(self):
+        return self.padded_numpy()[1:-1, 1:-1].copy()
+
+    def bits(self):
+        return pack_bits(self.to_numpy())
+
+    def export_to_file(self, path):
+        with open(path, "wb") as f:
+            self.bits().tofile(f)
+
+    def load_bytes(self, data):
+        matrix = BitArrayMat(self.nrow, self.ncol)
+        matrix.load_bytes(data)
+        self.set_bits(matrix.to_numpy())
+
+
+class AlignedBitArrayMat(BitArrayMat):
+    """Matrix whose rows start on a word boundary: a row takes n_words(ncol) words of WORD_BITS bits in the buffer
+    and the padding after the last column is always 0. row_words() is then the buffer itself, for the bit-sliced
+    operations on the whole lattice, see neighbor_masks. Files and to_numpy() are the plain matrix without the
+    padding, the same as for BitArrayMat. flat ids are those of the plain matrix"""
+
+    def __init__(self, nrow, ncol, list=None, wraparound_indices=False) -> None:
+        self.nrow = nrow
+        self.ncol = ncol
+        self.size = nrow * ncol
+        self.stride = n_words(ncol) * WORD_BITS
+        self.set_wraparound(wraparound_indices)
+
+        if list is not None:
+            assert nrow * ncol == len(list)
+            self.set_bits(np.asarray(list, dtype=np.uint8).reshape((nrow, ncol)))
+        else:
+            self.arr = ba(nrow * self.stride, endian="big")
+            self.arr.setall(0)
+
+    @classmethod
+    def from_numpy(cls, spins: np.ndarray, wraparound_indices=False):
+        matrix = cls(spins.shape[0], spins.shape[1], wraparound_indices=wraparound_indices)
+        matrix.set_bits(spins)
+        return matrix
+
+    @classmethod
+    def from_bits(cls, nrow, ncol, bits: ba, wraparound_indices=False):
+        # the rows have to be moved apart, so the bits are unpacked once
+        return cls.from_numpy(BitArrayMat.from_bits(nrow, ncol, bits).to_numpy(),
+                              wraparound_indices=wraparound_indices)
+
+    def set_wraparound(self, wrap):
+        self.idx = _aligned_wraparound_index if wrap else _aligned_index
+        self.wraparound_indices = bool(wrap)
+
+    def set_bits(self, spins: np.ndarray) -> None:
+        """fills the matrix from a (nrow, ncol) array of 0 and 1, with the padding 0"""
+        self.arr = ba(endian="big")
+        self.arr.frombytes(row_words(spins).astype(">u8").tobytes())
+
+    def flat(self, r, c):
+        if self.wraparound_indices:
+            return (r % self.nrow) * self.ncol + c % self.ncol
+        return r * self.ncol + c
+
+    def positions(self, flat_ids) -> np.ndarray:
+        rows, cols = np.divmod(np.asarray(flat_ids, dtype=np.int64), self.ncol)
+        return rows * self.stride + cols
+
+    def row_words(self) -> np.ndarray:
+        """the buffer as (nrow, n_words) words, copied into native byte order"""
+        return self.packed_view().view(">u8").reshape((self.nrow, -1)).astype(np.uint64)
+
+    def to_numpy(self):
+        bits = np.unpackbits(self.packed_view(), count=self.nrow * self.stride)
+        return bits.reshape((self.nrow, self.stride))[:, :self.ncol].copy()
+
+    def bits(self):
+        return pack_bits(self.to_numpy())
+
+    def export_to_file(self, path):
+        with open(path, "wb") as f:
+            self.bits().tofile(f)
+
+    def load_bytes(self, data):
+        matrix = BitArrayMat(self.nrow, self.ncol)
+        matrix.load_bytes(data)
+        self.set_bits(matrix.to_numpy())
@@ -0,0 +1,118 @@
+from array import array
+import numpy as np
+
+
+class EventTrace(object):
+    """Lossless trace of the number of +1 vertices in the interior. The count only changes by one when a
+    vertex in the interior flips, so instead of one float per iteration only the iterations at which it
+    changed are stored, together with the sign of the change. The dense trace (share of +1 after every
+    iteration, -1 after the last one that ran) or any window of it is reconstructed on demand."""
+
+    def __init__(self, target, initial) -> None:
+        # number of +1 vertices if all interior vertices are +1
+        self.target = target
+        # number of +1 vertices before the first iteration
+        self.initial = initial
+        # number of iterations that ran, i.e. the trace has values for iterations 0, ..., length - 1
+        self.length = 0
+        self.steps = array("q")
+        self.signs = array("b")
+
+    def record(self, i, sign) -> None:
+        """the count changed by sign (+1 or -1) in iteration i"""
+        self.steps.append(i)
+        self.signs.append(sign)
+
+    def extend(self, steps: np.ndarray, signs: np.ndarray) -> None:
+        """records many events at once, steps must be increasing and after the recorded ones"""
+        self.steps.frombytes(np.ascontiguousarray(steps, dtype=np.int64).tobytes())
+        self.signs.frombytes(np.ascontiguousarray(signs, dtype=np.int8).tobytes())
+
+    def truncate(self, length) -> None:
+        """drops everything from iteration length on"""
+        n_events = int(np.searchsorted(self.step_array(), length))
+        del self.steps[n_events:]
+        del self.signs[n_events:]
+        self.length = min(self.length, length)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def n_events(self):
+        return len(self.steps)
+
+    def step_array(self) -> np.ndarray:
+        return np.frombuffer(self.steps, dtype=np.int64) if len(self.steps) else np.zeros(0, dtype=np.int64)
+
+    def sign_array(self) -> np.ndarray:
+        return np.frombuffer(self.signs, dtype=np.int8) if len(self.signs) else np.zeros(0, dtype=np.int8)
+
+    def counts(self, start=0, stop=None) -> np.ndarray:
+        """number of +1 vertices in the interior after each of the iterations start, ..., stop - 1"""
+        if stop is None:
+            stop = self.length
+        steps = self.step_array()
+        signs = self.sign_array()
+
+        first, last = np.searchsorted(steps, (start, stop))
+        before = self.initial + int(signs[:first].sum(dtype=np.int64))
+
+        deltas = np.zeros(max(stop - start, 0), dtype=np.int64)
+        deltas[steps[first:last] - start] = signs[first:last]
+        return before + np.cumsum(deltas)
+
+    def window(self, start, stop) -> np.ndarray:
+        """share of +1 vertices after each of the iterations start, ..., stop - 1 and -1 for iterations that did
+        not run, like the entries start:stop of the old dense vector"""
+        shares = np.full(stop - start, -1.0)
+        ran = min(stop, self.length)
+        if ran > start:
+            shares[:ran - start] = self.counts(start, ran) / self.target
+        return shares
+
+    def dense(self, t=None) -> np.ndarray:
+        """the whole trace as share of +1 vertices, padded with -1 up to t iterations"""
+        return self.window(0, self.length if t is None else t)
+
+    def to_arrays(self, length=None) -> dict:
+        """the arrays that save() writes. With length, the trace is cut off there, like truncate(length)"""
+        if length is None:
+            length = self.length
+        n_events = int(np.searchsorted(self.step_array(), length))
+        return {"steps": self.step_array()[:n_events], "signs": self.sign_array()[:n_events],
+                "header": np.array([self.target, self.initial, min(self.length, length)], dtype=np.int64)}
+
+    @classmethod
+    def from_arrays(cls, steps, signs, header):
+        target, initial, length = np.asarray(header).tolist()
+        trace = cls(target, initial)
+        trace.extend(steps, signs)
+        trace.length = length
+        return trace
+
+    def save(self, path) -> None:
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls.from_arrays(data["steps"], data["signs"], data["header"])
+
+    @classmethod
+    def from_dense(cls, vector, target):
+        """converts an old dense vector of shares (-1 after the last iteration) into an EventTrace"""
+        vector = np.asarray(vector)
+        ran = np.flatnonzero(vector != -1)
+        length = int(ran[-1]) + 1 if ran.size else 0
+
+        # continued runs left single -1 gaps where they were resumed, these take the value before the gap
+        positions = np.where(vector[:length] != -1, np.arange(length), 0)
+        np.maximum.accumulate(positions, out=positions)
+        counts = np.rint(vector[positions] * target).astype(np.int64)
+        trace = cls(target, int(counts[0]) if length else 0)
+        changed = np.flatnonzero(np.diff(counts)) + 1
+        trace.extend(changed, np.sign(counts[changed] - counts[changed - 1]))
+        trace.length = length
+        return trace
@@ -1,11 +1,16 @@
-import random
-
-
 class ListDict(object):
     def __init__(self, n_row, n_col):
         self.item_to_position = {}
         self.items = []
 
+    @classmethod
+    def from_items(cls, n_row, n_col, items):
+        """builds the ListDict from distinct items in one go"""
+        list_dict = cls(n_row, n_col)
+        list_dict.items = list(items)
+        list_dict.item_to_position = dict(zip(list_dict.items, range(len(list_dict.items))))
+        return list_dict
+
     def add(self, item):
         if item in self.item_to_position:
             return
@@ -23,9 +28,11 @@ class ListDict(object):
             self.items[position] = last_item
             self.item_to_position[last_item] = position
 
-    
-    def choose_random_item(self):
-        return random.choice(self.items)    
+
+    def choose_random_item(self, uniform):
+        """the item at the position that uniform (in [0, 1)) falls on, a uniformly random item for a uniform draw"""
+        # the product can round up to the length for uniforms just below 1
+        return self.items[min(int(uniform * len(self.items)), len(self.items) - 1)]
 
     def __contains__(self, item):
         return item in self.item_to_position
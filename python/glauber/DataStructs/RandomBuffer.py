@@ -0,0 +1,47 @@
+import numpy as np
+
+
+CHUNK_SIZE = 2**14
+
+
+class RandomBuffer(object):
+    """Coins and uniforms for the python loop. Single draws from a numpy Generator cost about a microsecond
+    each, so they are drawn in chunks of chunk_size and handed out one by one from python lists. The state
+    of the buffer is the state of the generator and the draws that were not handed out yet, see get_state"""
+
+    def __init__(self, rng: np.random.Generator, chunk_size=CHUNK_SIZE) -> None:
+        self.rng = rng
+        self.chunk_size = chunk_size
+        self.coins = []
+        self.coin_pos = 0
+        self.uniforms = []
+        self.uniform_pos = 0
+
+    def coin(self) -> int:
+        """0 or 1 with probability 1/2"""
+        if self.coin_pos == len(self.coins):
+            self.coins = self.rng.integers(0, 2, size=self.chunk_size, dtype=np.uint8).tolist()
+            self.coin_pos = 0
+        self.coin_pos += 1
+        return self.coins[self.coin_pos - 1]
+
+    def uniform(self) -> float:
+        """uniform on [0, 1)"""
+        if self.uniform_pos == len(self.uniforms):
+            self.uniforms = self.rng.random(self.chunk_size).tolist()
+            self.uniform_pos = 0
+        self.uniform_pos += 1
+        return self.uniforms[self.uniform_pos - 1]
+
+    def get_state(self) -> dict:
+        """json serializable state of the generator and of the draws that are left"""
+        return {"bit_generator": self.rng.bit_generator.state,
+                "coins": self.coins[self.coin_pos:],
+                "uniforms": self.uniforms[self.uniform_pos:]}
+
+    def set_state(self, state: dict) -> None:
+        self.rng.bit_generator.state = state["bit_generator"]
+        self.coins = list(state["coins"])
+        self.coin_pos = 0
+        self.uniforms = list(state["uniforms"])
+        self.uniform_pos = 0
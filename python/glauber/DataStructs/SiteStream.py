@@ -0,0 +1,44 @@
+import numpy as np
+
+
+CHUNK_SIZE = 2**16
+
+
+class SiteStream(object):
+    """Uniformly random vertices as flat ids (row * n_outer + col), one for every iteration, with rows and
+    columns in range(low, high). The ids are generated lazily in chunks of chunk_size, so the memory does
+    not grow with the number of iterations. Chunk k is drawn from its own generator, spawned from
+    seed_sequence with key k, so every iteration can be looked up without drawing the chunks before it
+    and the stream only depends on the seed."""
+
+    def __init__(self, seed_sequence: np.random.SeedSequence, n_outer, low, high, length,
+                 chunk_size=CHUNK_SIZE) -> None:
+        self.seed_sequence = seed_sequence
+        self.n_outer = n_outer
+        self.low = low
+        self.width = high - low
+        self.length = length
+        self.chunk_size = chunk_size
+        # the smallest dtype that holds all flat ids
+        self.dtype = np.uint32 if n_outer**2 <= 2**32 else np.uint64
+
+        self.chunk_index = None
+        self.chunk = None
+
+    def get_chunk(self, k) -> np.ndarray:
+        """flat ids for the iterations k * chunk_size, ..., (k + 1) * chunk_size - 1"""
+        if k != self.chunk_index:
+            seed_sequence = np.random.SeedSequence(self.seed_sequence.entropy,
+                                                   spawn_key=self.seed_sequence.spawn_key + (k,))
+            size = min(self.chunk_size, self.length - k * self.chunk_size)
+            draws = np.random.default_rng(seed_sequence).integers(0, self.width**2, size=size, dtype=self.dtype)
+            rows, cols = np.divmod(draws, self.dtype(self.width))
+            self.chunk = (rows + self.dtype(self.low)) * self.dtype(self.n_outer) + cols + self.dtype(self.low)
+            self.chunk_index = k
+        return self.chunk
+
+    def __getitem__(self, i):
+        return self.get_chunk(i // self.chunk_size)[i % self.chunk_size]
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,146 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from .BitArrayMat import BitArrayMat
+
+
+# the snapshots of a run in its bitmap dir, instead of one iter-<i>.bmp per checkpoint
+ARCHIVE_FILE = "snapshots.arc"
+MAGIC = b"GLBSNAP1"
+HEADER = struct.Struct("<8sII")       # magic, nrow, ncol
+RECORD = struct.Struct("<qBI")        # iteration, kind, length of the compressed payload
+KEYFRAME = 0
+DELTA = 1
+KEYFRAME_EVERY = 32
+
+
+def is_archive(path) -> bool:
+    return path is not None and str(path).endswith(".arc")
+
+
+class SnapshotArchive(object):
+    """Append-only file with the snapshots of one run. Every keyframe_every-th snapshot is stored whole (a
+    keyframe), the others as the XOR with the snapshot before them. Late in a run only a few vertices change
+    between snapshots, so the deltas are almost all zero and compress to next to nothing with zlib.
+
+    A snapshot is the bytes of BitArrayMat.bits(), like export_to_file writes them. A record that was cut off
+    by a kill is dropped when the archive is opened again, and the first snapshot after that is a keyframe.
+    See SnapshotReader to read it"""
+
+    def __init__(self, path, nrow, ncol, keyframe_every=KEYFRAME_EVERY) -> None:
+        self.path = path
+        self.nrow = nrow
+        self.ncol = ncol
+        self.keyframe_every = keyframe_every
+        self.previous = None
+        self.since_keyframe = 0
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = SnapshotReader(path)
+            if (reader.nrow, reader.ncol) != (nrow, ncol):
+                raise ValueError(f"Archive {path} holds {reader.nrow}x{reader.ncol} lattices, not {nrow}x{ncol}")
+            with open(path, "r+b") as f:
+                f.truncate(reader.end)
+        else:
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, nrow, ncol))
+
+    def append(self, iteration, data: bytes) -> None:
+        """appends the snapshot data of iteration"""
+        if self.previous is None or self.since_keyframe >= self.keyframe_every - 1:
+            kind, payload = KEYFRAME, data
+            self.since_keyframe = 0
+        else:
+            kind = DELTA
+            payload = np.bitwise_xor(np.frombuffer(data, dtype=np.uint8),
+                                     np.frombuffer(self.previous, dtype=np.uint8)).tobytes()
+            self.since_keyframe += 1
+        payload = zlib.compress(payload)
+
+        with open(self.path, "ab") as f:
+            f.write(RECORD.pack(iteration, kind, len(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.previous = data
+
+    def append_matrix(self, iteration, matrix: BitArrayMat) -> None:
+        self.append(iteration, matrix.bits().tobytes())
+
+
+class SnapshotReader(object):
+    """Random access to the snapshots of a SnapshotArchive. Opening only reads the record headers, a snapshot
+    is decoded from the keyframe before it"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        # (iteration, kind, offset of the payload, length of the payload) of every complete record
+        self.records = []
+
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            magic, self.nrow, self.ncol = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a snapshot archive")
+            offset = HEADER.size
+            while offset + RECORD.size <= size:
+                f.seek(offset)
+                iteration, kind, length = RECORD.unpack(f.read(RECORD.size))
+                if offset + RECORD.size + length > size:
+                    break
+                self.records.append((iteration, kind, offset + RECORD.size, length))
+                offset += RECORD.size + length
+        # where the complete records end, anything after it was cut off
+        self.end = offset
+
+        # a snapshot that was stored twice, like the last one of a run, is read from its last record
+        self.positions = {record[0]: position for position, record in enumerate(self.records)}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def iterations(self) -> list:
+        return sorted(self.positions)
+
+    def read_payload(self, f, position) -> bytes:
+        _, _, offset, length = self.records[position]
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def get_bytes(self, iteration) -> bytes:
+        position = self.positions[iteration]
+        keyframe = position
+        while self.records[keyframe][1] != KEYFRAME:
+            keyframe -= 1
+
+        with open(self.path, "rb") as f:
+            data = np.frombuffer(self.read_payload(f, keyframe), dtype=np.uint8).copy()
+            for delta in range(keyframe + 1, position + 1):
+                data ^= np.frombuffer(self.read_payload(f, delta), dtype=np.uint8)
+        return data.tobytes()
+
+    def get(self, iteration, wraparound_indices=False) -> BitArrayMat:
+        """the lattice after iteration"""
+        matrix = BitArrayMat(self.nrow, self.ncol, wraparound_indices=wraparound_indices)
+        matrix.load_bytes(self.get_bytes(iteration))
+        return matrix
+
+    def last(self) -> tuple:
+        """(iteration, lattice) of the latest snapshot"""
+        iteration = self.iterations()[-1]
+        return iteration, self.get(iteration)
+
+    def __iter__(self):
+        """(iteration, lattice) of all snapshots in order, decoding every record once"""
+        data = None
+        with open(self.path, "rb") as f:
+            for position, (iteration, kind, _, _) in enumerate(self.records):
+                payload = np.frombuffer(self.read_payload(f, position), dtype=np.uint8)
+                data = payload.copy() if kind == KEYFRAME else data ^ payload
+                if self.positions[iteration] == position:
+                    matrix = BitArrayMat(self.nrow, self.ncol)
+                    matrix.load_bytes(data.tobytes())
+                    yield iteration, matrix
@@ -0,0 +1,121 @@
+import os
+import struct
+
+import numpy as np
+
+from .BitArrayMat import BitArrayMat
+
+
+# all snapshots of a run in one file for analysis, see SnapshotCube
+CUBE_FILE = "snapshots.cube"
+MAGIC = b"GLBCUBE1"
+HEADER = struct.Struct("<8sIIQ")      # magic, nrow, ncol, stride
+HEADER_SIZE = 64
+WORD = 8
+
+
+def is_cube(path) -> bool:
+    return path is not None and str(path).endswith(".cube")
+
+
+def cube_layout(nrow, ncol) -> tuple:
+    """(bytes of the packed bits of a snapshot, bytes of a slot). A slot is the iteration as int64 and the bits,
+    padded to whole words, so every slot and the bits in it start on a word boundary"""
+    n_bytes = (nrow * ncol + 7) // 8
+    return n_bytes, WORD + (n_bytes + WORD - 1) // WORD * WORD
+
+
+class SnapshotCube(object):
+    """Append-only file with the snapshots of one run at a fixed stride: a header of HEADER_SIZE bytes and then one
+    slot per snapshot, see cube_layout. Unlike a SnapshotArchive nothing is compressed, so the file is as large as
+    the bitmaps, but any snapshot or any range of them is a view into the memory map, see CubeReader.
+
+    A slot that was cut off by a kill is dropped when the cube is opened again"""
+
+    def __init__(self, path, nrow, ncol) -> None:
+        self.path = path
+        self.nrow = nrow
+        self.ncol = ncol
+        self.n_bytes, self.stride = cube_layout(nrow, ncol)
+
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            with open(path, "r+b") as f:
+                magic, file_nrow, file_ncol, _ = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC or (file_nrow, file_ncol) != (nrow, ncol):
+                    raise ValueError(f"{path} is not a cube of {nrow}x{ncol} lattices")
+                n_slots = (os.path.getsize(path) - HEADER_SIZE) // self.stride
+                f.truncate(HEADER_SIZE + n_slots * self.stride)
+        else:
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, nrow, ncol, self.stride).ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, iteration, data: bytes) -> None:
+        """appends the snapshot data of iteration, the bytes of BitArrayMat.bits()"""
+        slot = bytearray(self.stride)
+        slot[:WORD] = struct.pack("<q", iteration)
+        slot[WORD:WORD + self.n_bytes] = data[:self.n_bytes]
+        with open(self.path, "ab") as f:
+            f.write(slot)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append_matrix(self, iteration, matrix: BitArrayMat) -> None:
+        self.append(iteration, matrix.bits().tobytes())
+
+
+class CubeReader(object):
+    """Memory map of a SnapshotCube. The snapshots come as views into the map, nothing is read or copied until
+    it is used. Snapshots are in the order they were stored, an iteration that was stored twice, like the last
+    one of a run, is looked up in its last slot. The earlier slot of such an iteration is left out everywhere,
+    also in stack() and spins(), so they have one snapshot per iteration like iterations()"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            magic, self.nrow, self.ncol, self.stride = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot cube")
+        self.n_bytes, _ = cube_layout(self.nrow, self.ncol)
+
+        n_slots = (os.path.getsize(path) - HEADER_SIZE) // self.stride
+        if n_slots > 0:
+            self.map = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(n_slots, self.stride))
+        else:
+            self.map = np.zeros((0, self.stride), dtype=np.uint8)
+        # (n_slots,) int64 and (n_slots, n_bytes) uint8 views of the slots
+        self.slot_iterations = self.map[:, :WORD].view(np.int64)[:, 0]
+        self.packed = self.map[:, WORD:WORD + self.n_bytes]
+        self.positions = {iteration: position for position, iteration in enumerate(self.slot_iterations.tolist())}
+        # the slots that are not superseded by a later slot of the same iteration, in order
+        self.kept = np.array(sorted(self.positions.values()), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def iterations(self) -> list:
+        return sorted(self.positions)
+
+    def get_packed(self, iteration) -> np.ndarray:
+        """(n_bytes,) view of the packed bits of iteration"""
+        return self.packed[self.positions[iteration]]
+
+    def get(self, iteration, wraparound_indices=False) -> BitArrayMat:
+        """read-only BitArrayMat on top of the map"""
+        return BitArrayMat.from_buffer(self.nrow, self.ncol, self.get_packed(iteration),
+                                       wraparound_indices=wraparound_indices)
+
+    def stack(self, start=None, stop=None) -> np.ndarray:
+        """(k, n_bytes) packed bits of the snapshots with start <= iteration < stop, one per iteration. A view into
+        the map, unless an iteration in the range was stored twice, then the slots that are kept are copied"""
+        first = 0 if start is None else int(np.searchsorted(self.slot_iterations, start))
+        last = len(self.slot_iterations) if stop is None else int(np.searchsorted(self.slot_iterations, stop))
+        slots = self.kept[(self.kept >= first) & (self.kept < last)]
+        if len(slots) == last - first:
+            return self.packed[first:last]
+        return self.packed[slots]
+
+    def spins(self, start=None, stop=None) -> np.ndarray:
+        """(k, nrow, ncol) array of 0 and 1 of the snapshots in stack(start, stop), unpacked into memory"""
+        packed = self.stack(start, stop)
+        bits = np.unpackbits(packed, axis=1, count=self.nrow * self.ncol)
+        return bits.reshape((len(packed), self.nrow, self.ncol))
@@ -0,0 +1,69 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def sparse_add(items, positions, length, item):
+    """adds item to the set stored in items[:length] and returns the new length"""
+    if positions[item] >= 0:
+        return length
+    items[length] = item
+    positions[item] = length
+    return length + 1
+
+
+@njit(cache=True)
+def sparse_remove(items, positions, length, item):
+    """removes item from the set stored in items[:length] and returns the new length"""
+    position = positions[item]
+    if position < 0:
+        return length
+    last_item = items[length - 1]
+    items[position] = last_item
+    positions[last_item] = position
+    positions[item] = -1
+    return length - 1
+
+
+class SparseSet(object):
+    """Set of flat site ids in [0, size) with O(1) add, remove and random choice. The items are
+    stored densely in items[:length] and positions[item] is the position of item in items, or -1
+    if item is not in the set. Same swap-with-last removal as ListDict, but on integer arrays
+    so that the compiled kernels can work on it directly."""
+
+    def __init__(self, size):
+        self.items = np.empty(size, dtype=np.int64)
+        self.positions = np.full(size, -1, dtype=np.int64)
+        self.length = 0
+
+    @classmethod
+    def from_items(cls, size, items):
+        """builds the set from an array of distinct items in one go"""
+        sparse_set = cls(size)
+        sparse_set.length = len(items)
+        sparse_set.items[:sparse_set.length] = items
+        sparse_set.positions[items] = np.arange(sparse_set.length)
+        return sparse_set
+
+    def add(self, item):
+        self.length = sparse_add(self.items, self.positions, self.length, item)
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+    def remove(self, item):
+        self.length = sparse_remove(self.items, self.positions, self.length, item)
+
+    def choose_random_item(self, u):
+        """returns the item at position floor(u * len(self)) for a uniform u in [0, 1)"""
+        return self.items[min(int(u * self.length), self.length - 1)]
+
+    def __contains__(self, item):
+        return self.positions[item] >= 0
+
+    def __iter__(self):
+        return iter(self.items[:self.length].tolist())
+
+    def __len__(self):
+        return self.length
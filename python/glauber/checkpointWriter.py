@@ -0,0 +1,97 @@
+import queue
+import threading
+import time
+
+
+class CheckpointWriter(object):
+    """Writes checkpoints off the update loop. A job is a function without arguments that writes a snapshot,
+    i.e. a copy of the state taken when it was submitted, so the loop can go on changing the state right away.
+    With max_pending set, the jobs are done in submission order by a background thread and at most max_pending
+    of them wait to be written; submit only blocks when the queue is full. With max_pending None, every job is
+    done right away in the calling thread, like before.
+
+    The metrics tell how much the loop waited for the disk, see metrics()"""
+
+    def __init__(self, max_pending=None) -> None:
+        if max_pending is not None and max_pending < 1:
+            # a queue of size 0 has no bound, so the loop would never wait for the disk
+            raise ValueError(f"max_pending has to be at least 1, not {max_pending}")
+        self.max_pending = max_pending
+        self.queue = None
+        self.thread = None
+        # the first error of the background thread, raised in the loop at the next submit or close
+        self.error = None
+
+        self.n_jobs = 0
+        self.n_blocked = 0
+        self.wait_seconds = 0.0
+        self.write_seconds = 0.0
+        self.peak_pending = 0
+
+    def start(self) -> None:
+        self.queue = queue.Queue(maxsize=self.max_pending)
+        self.thread = threading.Thread(target=self.work, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def work(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            if self.error is None:
+                try:
+                    self.run_job(job)
+                except BaseException as e:
+                    self.error = e
+
+    def run_job(self, job) -> None:
+        start = time.perf_counter()
+        job()
+        self.write_seconds += time.perf_counter() - start
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, job) -> None:
+        self.n_jobs += 1
+        if self.max_pending is None:
+            # the loop waits for the whole write
+            start = time.perf_counter()
+            self.run_job(job)
+            self.wait_seconds += time.perf_counter() - start
+            return
+
+        self.raise_error()
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            # backpressure, the disk can not keep up with the checkpoints
+            self.n_blocked += 1
+            start = time.perf_counter()
+            self.queue.put(job)
+            self.wait_seconds += time.perf_counter() - start
+        self.peak_pending = max(self.peak_pending, self.queue.qsize())
+
+    def close(self) -> None:
+        """waits until all jobs are written and stops the background thread"""
+        if self.thread is not None:
+            start = time.perf_counter()
+            self.queue.put(None)
+            self.thread.join()
+            self.wait_seconds += time.perf_counter() - start
+            self.thread = None
+            self.queue = None
+        self.raise_error()
+
+    def metrics(self) -> dict:
+        """number of checkpoints, how often and how long the loop waited for the writer (with max_pending None,
+        for every write), the time spent writing and the most checkpoints that were waiting at once"""
+        return {"jobs": self.n_jobs,
+                "blocked": self.n_blocked,
+                "wait_seconds": self.wait_seconds,
+                "write_seconds": self.write_seconds,
+                "peak_pending": self.peak_pending}
@@ -15,49 +15,124 @@ import bitarray
 class GlauberSimDynIndices(GlauberSimBitArray):
 
     def __init__(self, purge_interval = None, *args, **kwargs) -> None:
+        """If purge_interval is set, the indices are kept with lazy deletion: neighbors are added without
+        checking them, vertices that can not flip anymore are rejected when they are drawn and all of them
+        are purged at once every purge_interval iterations"""
         super().__init__(*args, **kwargs)
         self.logger.info(f"Initializing {type(self).__name__} with parameters: {kwargs}." + 
                      f" Running on PID {os.getpid()}")
         self.purge_interval = purge_interval
 
+        # statistics of the lazy deletion
+        self.n_draws = 0
+        self.n_rejects = 0
+
     
     def setup_indices(self) -> None:
-        self.indices = ListDict(self.n_outer, self.n_outer)
-
-        for i in range(1, self.n_outer - 1):
-            for j in range(1, self.n_outer - 1):
-                nb_sum = (
-                    self.matrix[i - 1, j]
-                    + self.matrix[i + 1, j]
-                    + self.matrix[i, j - 1]
-                    + self.matrix[i, j + 1]
-                )
+        # row-major order, same as looping over the rows and then the columns
+        self.indices = self.build_indices(np.flatnonzero(self.active_mask()))
 
-                # if more than half of neighbors are different, can flip
-                if nb_sum > 2 and self.matrix[i, j] == 0:
-                    self.indices.add((i, j))
-                elif nb_sum < 2 and self.matrix[i, j] == 1:
-                    self.indices.add((i, j))
+    def build_indices(self, sites: np.ndarray):
+        """the indices holding the flat ids sites, in this order"""
+        return ListDict.from_items(self.n_outer, self.n_outer, sites.tolist())
 
-                # if there is a tie, can also flip.
-                elif nb_sum == 2:
-                    self.indices.add((i, j))    
+    def index_items(self) -> np.ndarray:
+        """the flat ids in the indices, in their order, see build_indices"""
+        return np.array(self.indices.items, dtype=np.int64)
 
     # implement all abstract methods from GlauberSi   
     
     def get_index(self, i) -> tuple:
-        """get_index returns the index at position for the ith update"""
-        return self.indices.choose_random_item()
+        """get_index returns the index at position for the ith update. The indices hold the flat ids of the
+        vertices, see site_id"""
+        if self.purge_interval is None:
+            return divmod(self.indices.choose_random_item(self.draws.uniform()), self.n_outer)
+
+        if i % self.purge_interval == 0:
+            self.purge_indices()
+
+        # draw until a vertex that can flip comes up, so the stale ones do not use up iterations
+        while len(self.indices) > 0:
+            site = self.indices.choose_random_item(self.draws.uniform())
+            index = divmod(site, self.n_outer)
+            self.n_draws += 1
+            if self.is_active(index):
+                return index
+            self.n_rejects += 1
+            self.indices.remove(site)
+        return None
+
+    def is_active(self, index: tuple) -> bool:
+        """True if the vertex at index can flip, i.e. it is tied or disagrees with the majority of its neighbors"""
+        if self.counts is not None:
+            return self.can_flip(self.site_id(index))
+        nb_sum = self.compute_neighbor_sum(index)
+        if nb_sum == 2:
+            return True
+        spin = self.matrix[index[0], index[1]]
+        return (nb_sum > 2 and spin == 0) or (nb_sum < 2 and spin == 1)
+
+    def purge_indices(self) -> None:
+        """removes all vertices that can not flip from the indices at once, with one batch of reads, see
+        active_sites"""
+        if len(self.indices) == 0:
+            return
+        sites = np.array(self.indices.items, dtype=np.int64)
+        keep = self.active_sites(sites)
+        self.logger.debug(f"Purging {len(keep) - keep.sum()} of {len(keep)} indices")
+        self.indices = self.build_indices(sites[keep])
+
+    def neighbor_sites(self, index: tuple) -> list:
+        """flat ids of the neighbors of index that can ever flip, i.e. all but the boundary"""
+        neighbors = (
+                        (index[0] + 1, index[1]),
+                        (index[0], index[1] + 1),
+                        (index[0] - 1, index[1]),
+                        (index[0], index[1] - 1),
+                        )
+        return [self.site_id(nb) for nb in neighbors
+                if 0 < nb[0] < self.n_outer - 1 and 0 < nb[1] < self.n_outer - 1]
+
+    def checkpoint_state(self) -> dict:
+        state = super().checkpoint_state()
+        # the order of the items matters, it decides which vertex a uniform picks
+        state.update({"indices": self.index_items(), "draws": [self.n_draws, self.n_rejects]})
+        return state
+
+    def restore_checkpoint_state(self, state: dict) -> int:
+        if state["indices"] is not None:
+            self.indices = self.build_indices(state["indices"])
+        self.n_draws, self.n_rejects = state["draws"]
+        return super().restore_checkpoint_state(state)
+
+    def extra_results(self) -> dict:
+        results = super().extra_results()
+        if self.purge_interval is not None:
+            results["reject_rate"] = self.n_rejects / self.n_draws if self.n_draws else 0.0
+        return results
 
     
+    def add_counted_neighbors(self, index: tuple) -> None:
+        """add_dyn_neighbors_to_indices with the neighbor count field, in the same order"""
+        for site in self.neighbor_sites(index):
+            if self.can_flip(site):
+                self.indices.add(site)
+
     def remove_vertex_from_indices(self, index: tuple) -> None:
         """removes the given index from the indices to be updated"""
-        self.indices.remove(index)
+        self.indices.remove(self.site_id(index))
  
     def add_dyn_neighbors_to_indices(self, index: tuple) -> None:
         """adds the dynamic (i.e., not fixated) neighbors of the given index to the indices to be updated
-        TODO: An alternative idea would be to always add all neighbors, but to periodically remove fixated ones, purge after a certain number has been requested, etc.
         """
+        if self.purge_interval is not None:
+            # lazy deletion, see get_index
+            self.indices.extend(self.neighbor_sites(index))
+            return
+        if self.counts is not None:
+            self.add_counted_neighbors(index)
+            return
+
         neighbors = (
                         (index[0] + 1, index[1]),
                         (index[0], index[1] + 1),
@@ -78,9 +153,9 @@ class GlauberSimDynIndices(GlauberSimBitArray):
 
                 # if more than half of neighbors are different, can flip
                 if nb_sum > 2 and self.matrix[x, y] == 0:
-                    self.indices.add(neighbor)
+                    self.indices.add(x * self.n_outer + y)
                 elif nb_sum < 2 and self.matrix[x, y] == 1:
-                    self.indices.add(neighbor)
+                    self.indices.add(x * self.n_outer + y)
                 # if there is a tie, can also flip.
                 elif nb_sum == 2:
-                    self.indices.add(neighbor)  
\ No newline at end of file
+                    self.indices.add(x * self.n_outer + y)  
\ No newline at end of file
@@ -11,6 +11,7 @@ from bitarray import bitarray as ba
 import bitarray
 
 from .DataStructs.BitArrayMat import BitArrayMat
+from .DataStructs.SiteStream import SiteStream
 from .glauberSimBitarray import GlauberSimBitArray
 
 
@@ -26,13 +27,13 @@ class GlauberSimulatorFixIndices(GlauberSimBitArray):
                      f" Running on PID {os.getpid()}")
 
     def setup_indices(self) -> None:
-        # list of indices we want to look at -> all except boundary points
+        # stream of the indices we want to look at -> all except boundary points
         # remember that self.t is the number of iterations
         # Hence may not have index zero or the last elements
-        self.indices = np.random.randint(1, self.n_outer - 1, size=2 * self.t).reshape((self.t, 2))
+        self.indices = SiteStream(self.site_seed_sequence, self.n_outer, 1, self.n_outer - 1, self.t)
 
     def get_index(self, i) -> tuple:
-        return self.indices[i]
+        return divmod(int(self.indices[i]), self.n_outer)
 
     def remove_vertex_from_indices(self, index: tuple) -> None:   
         pass
@@ -0,0 +1,204 @@
+import numpy as np
+import os
+from numba import njit
+
+from .glauberSim import LOGGING_STEP
+from .glauberNumba import NumbaEngine, STATUS_STOP, STATUS_COINS, STATUS_EVENTS
+from .glauberReplicas import GlauberReplicas, neighbor_tables
+
+
+# one replica per bit of a word
+MAX_REPLICAS = 64
+
+# number of shared sites and of coin words drawn at once
+SITE_CHUNK = 2**16
+COIN_CHUNK = 2**16
+# number of (iteration, replica, sign) events the kernel can record before it has to return
+EVENT_CHUNK = 2**16
+
+STATUS_DONE = 7     # every replica reached fixation
+
+
+@njit(cache=True)
+def majority_words(a, b, c, d, coins):
+    """Zero temperature update of 64 replicas at once. a, b, c and d hold the four neighbors of the site
+    in every bit, the result has a 1 where at least three neighbors are 1 and the bit of coins where
+    exactly two are. The sum of the neighbors is built with bit-sliced half adders"""
+    x1 = a ^ b
+    c1 = a & b
+    x2 = c ^ d
+    c2 = c & d
+    # sum = s0 + 2 * s1 + 4 * s2
+    s0 = x1 ^ x2
+    s1 = c1 ^ c2 ^ (x1 & x2)
+    s2 = c1 & c2
+    at_least_3 = s2 | (s1 & s0)
+    exactly_2 = s1 & ~s0
+    return at_least_3 | (exactly_2 & coins), exactly_2
+
+
+@njit(cache=True)
+def multi_spin_kernel(words, up, down, left, right, interior, sites, offset, coins, coin_pos, start, stop,
+                      running, n_ones, lower, upper, event_steps, event_replicas, event_signs, n_replicas):
+    """Runs the iterations start, ..., stop - 1 on all replicas, where sites[i - offset] is the flat id of the
+    site updated in iteration i in every replica. Only the bits in running are updated, a replica is
+    removed from running when it reaches fixation. The changes of the counts in n_ones are written to the
+    event buffers. Returns (next iteration, status, coin_pos, running, n_events)"""
+    n_events = 0
+    one = np.uint64(1)
+    for i in range(start, stop):
+        if coin_pos == coins.shape[0]:
+            return i, STATUS_COINS, coin_pos, running, n_events
+        if n_events + n_replicas > event_steps.shape[0]:
+            return i, STATUS_EVENTS, coin_pos, running, n_events
+
+        site = sites[i - offset]
+        new, tied = majority_words(words[up[site]], words[down[site]], words[left[site]], words[right[site]],
+                                   coins[coin_pos])
+        # a coin word is only used up if some replica had a tie
+        if tied & running:
+            coin_pos += 1
+
+        old = words[site]
+        new = (new & running) | (old & ~running)
+        words[site] = new
+
+        changed = old ^ new
+        if changed and interior[site]:
+            for k in range(n_replicas):
+                bit = one << np.uint64(k)
+                if changed & bit:
+                    sign = 1 if new & bit else -1
+                    n_ones[k] += sign
+                    event_steps[n_events] = i
+                    event_replicas[n_events] = k
+                    event_signs[n_events] = sign
+                    n_events += 1
+                    if n_ones[k] >= upper or n_ones[k] <= lower:
+                        running = running & ~bit
+
+            if running == 0:
+                return i + 1, STATUS_DONE, coin_pos, running, n_events
+
+    return stop, STATUS_STOP, coin_pos, running, n_events
+
+
+class GlauberMultiSpin(NumbaEngine, GlauberReplicas):
+    """Multi-spin coded fixed index dynamics. Up to 64 replicas are stored in the bits of one uint64 per
+    site and updated at once with bitwise arithmetic in a numba kernel. All replicas share the site that is
+    updated in an iteration, but have their own coins for ties, which is one random bit per replica.
+    Takes the same arguments as GlauberReplicas, the results directories have to be passed by keyword"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.n_replicas > MAX_REPLICAS:
+            raise ValueError(f"At most {MAX_REPLICAS} replicas fit into one word, got {self.n_replicas}")
+        self.words = None
+        self.event_replicas = None
+
+    def setup_spins(self) -> None:
+        super().setup_spins()
+        # bit k of a word is the spin of replica k
+        shifts = np.arange(self.n_replicas, dtype=np.uint64)[:, None]
+        self.words = np.bitwise_or.reduce(self.spins.astype(np.uint64) << shifts, axis=0)
+        self.spins = None
+
+    def replica_spins(self, replica) -> np.ndarray:
+        """flat uint8 spins of one replica"""
+        return ((self.words >> np.uint64(replica)) & np.uint64(1)).astype(np.uint8)
+
+    def sum_ones(self) -> np.ndarray:
+        interior = self.words[self.interior_mask]
+        return np.array([((interior >> np.uint64(k)) & np.uint64(1)).sum(dtype=np.int64)
+                         for k in range(self.n_replicas)])
+
+    def save_bitmap(self, replica, iter: int) -> None:
+        path = f"{self.results_dirs[replica]}/bitmap_results/iter-{iter}.bmp"
+        np.packbits(self.replica_spins(replica)).tofile(path)
+
+    def refill_coins(self) -> None:
+        self.coins = self.rng.bit_generator.random_raw(COIN_CHUNK)
+        self.coin_pos = 0
+
+    def draw_sites(self, size) -> np.ndarray:
+        """flat ids of the sites updated in the next size iterations, shared by all replicas"""
+        low, high = self.site_range()
+        width = high - low
+        rows, cols = np.divmod(self.rng.integers(0, width**2, size=size), width)
+        return (rows + low) * self.n_outer + cols + low
+
+    def run_iterations(self, target: int, verbose: bool = False) -> tuple:
+        kernel = self.kernel(multi_spin_kernel)
+        self.logger.info(f"Running {'compiled' if self.compiled else 'reference'} multi-spin kernel "
+                         f"on PID {os.getpid()}")
+
+        up, down, left, right = neighbor_tables(self.n_outer, self.wrap_indices)
+        upper = self.tol * target
+        lower = (1 - self.tol) * target
+
+        self.refill_coins()
+        self.event_replicas = np.empty(EVENT_CHUNK, dtype=np.int8)
+        running = np.uint64(2**self.n_replicas - 1)
+        fixated_at = np.full(self.n_replicas, -1, dtype=np.int64)
+
+        i = 0
+        sites = None
+        chunk = None
+        while i < self.t:
+            if i // SITE_CHUNK != chunk:
+                chunk = i // SITE_CHUNK
+                sites = self.draw_sites(min(SITE_CHUNK, self.t - chunk * SITE_CHUNK))
+            stop = min(self.next_stop(i, verbose), (chunk + 1) * SITE_CHUNK)
+
+            was_running = running
+            i, status, self.coin_pos, running, n_events = kernel(
+                self.words, up, down, left, right, self.interior_mask, sites, chunk * SITE_CHUNK, self.coins,
+                self.coin_pos, i, stop, running, self.n_ones, lower, upper, self.event_steps,
+                self.event_replicas, self.event_signs, self.n_replicas)
+            # the compiled kernel hands the word back as a python int
+            running = np.uint64(running)
+
+            for replica, trace in enumerate(self.traces):
+                mine = self.event_replicas[:n_events] == replica
+                trace.extend(self.event_steps[:n_events][mine], self.event_signs[:n_events][mine])
+
+            # the replicas that reached fixation in this call did so with the last event they recorded
+            for replica in range(self.n_replicas):
+                if (was_running & ~running) & (np.uint64(1) << np.uint64(replica)):
+                    fixated_at[replica] = self.traces[replica].step_array()[-1]
+                    self.traces[replica].length = fixated_at[replica] + 1
+                    self.logger.info(f"Replica {replica}: fixation at iteration {fixated_at[replica]}. "
+                                     f"Share of 1 is {self.n_ones[replica] / target}.")
+
+            if status == STATUS_COINS:
+                self.refill_coins()
+                continue
+            elif status == STATUS_EVENTS:
+                continue
+            elif status == STATUS_DONE:
+                break
+
+            last = i - 1
+            if self.check_sum_every is not None and (last % self.check_sum_every == 0):
+                self.check_n_ones(last)
+
+            if self.save_bitmaps_every is not None and (last % self.save_bitmaps_every == 0):
+                for replica in range(self.n_replicas):
+                    if running & (np.uint64(1) << np.uint64(replica)):
+                        self.save_bitmap(replica, last)
+
+            if verbose and (last % LOGGING_STEP == 0):
+                self.logger.info(f"iteration: {last} shares of 1 are: {self.n_ones / target}")
+
+        fixation = (fixated_at >= 0) & (self.n_ones >= upper)
+        iterations = np.where(fixated_at >= 0, fixated_at, self.t)
+        return fixation, iterations
+
+
+class GlauberMultiSpinTorus(GlauberMultiSpin):
+
+    def __init__(self, *args, **kwargs) -> None:
+        kwargs["boundary"] = "random"
+        kwargs["padding"] = 0
+        super().__init__(*args, **kwargs)
+        self.wrap_indices = True
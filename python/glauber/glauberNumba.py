@@ -0,0 +1,685 @@
+import numpy as np
+import os
+import time
+from numba import njit
+
+from .glauberSim import LOGGING_STEP
+from .glauberFixIndices import GlauberSimulatorFixIndices
+from .glauberDynIndices import GlauberSimDynIndices
+from .glauberTorus import GlauberFixedIndexTorus, GlauberDynIndexTorus
+from .DataStructs.SparseSet import SparseSet, sparse_add, sparse_remove
+from .DataStructs.SiteStream import SiteStream
+
+
+# number of coins and uniforms drawn at once for the kernels
+COIN_CHUNK = 2**16
+UNIFORM_CHUNK = 2**16
+# number of changes of the count the kernels can record before they have to return
+EVENT_CHUNK = 2**16
+
+# reasons for a kernel to return to python
+STATUS_STOP = 0     # reached the end of the requested range of iterations
+STATUS_COINS = 1    # ran out of coins, needs a refill before continuing
+STATUS_PLUS = 2     # fixation at +1
+STATUS_MINUS = 3    # fixation at -1
+STATUS_UNIFORMS = 4 # ran out of uniforms to choose vertices, needs a refill before continuing
+STATUS_EMPTY = 5    # no more vertices that can flip
+STATUS_EVENTS = 6   # the event buffer is full, needs a flush before continuing
+
+# offsets of the neighbors, in the order in which add_dyn_neighbors_to_indices visits them
+NEIGHBOR_ROWS = (1, 0, -1, 0)
+NEIGHBOR_COLS = (0, 1, 0, -1)
+
+
+@njit(cache=True)
+def get_bit(buf, k):
+    """reads bit k of the packed (big endian) buffer of a bitarray"""
+    return (buf[k >> 3] >> (7 - (k & 7))) & 1
+
+
+@njit(cache=True)
+def set_bit(buf, k, value):
+    """sets bit k of the packed (big endian) buffer of a bitarray to value"""
+    mask = 0x80 >> (k & 7)
+    if value:
+        buf[k >> 3] = buf[k >> 3] | mask
+    else:
+        buf[k >> 3] = buf[k >> 3] & (0xFF ^ mask)
+
+
+@njit(cache=True)
+def neighbor_sum(buf, site, n_outer, wrap):
+    """sum of the four neighbors of the vertex with flat id site"""
+    r = site // n_outer
+    c = site - r * n_outer
+    if wrap:
+        up = ((r + n_outer - 1) % n_outer) * n_outer + c
+        down = ((r + 1) % n_outer) * n_outer + c
+        left = r * n_outer + (c + n_outer - 1) % n_outer
+        right = r * n_outer + (c + 1) % n_outer
+    else:
+        up = site - n_outer
+        down = site + n_outer
+        left = site - 1
+        right = site + 1
+    return get_bit(buf, up) + get_bit(buf, down) + get_bit(buf, left) + get_bit(buf, right)
+
+
+@njit(cache=True)
+def is_interior(site, n_outer, padding):
+    r = site // n_outer
+    c = site - r * n_outer
+    return padding <= r < n_outer - padding and padding <= c < n_outer - padding
+
+
+@njit(cache=True)
+def is_active(buf, site, n_outer, wrap):
+    """True if the vertex can still flip, i.e. it is tied or disagrees with the majority of its neighbors"""
+    nb_sum = neighbor_sum(buf, site, n_outer, wrap)
+    if nb_sum == 2:
+        return True
+    spin = get_bit(buf, site)
+    return (nb_sum > 2 and spin == 0) or (nb_sum < 2 and spin == 1)
+
+
+@njit(cache=True)
+def activate_neighbors(buf, site, n_outer, wrap, items, positions, length):
+    """adds the neighbors of site that can flip to the sparse set, returns its new length"""
+    r = site // n_outer
+    c = site - r * n_outer
+    for k in range(4):
+        x = r + NEIGHBOR_ROWS[k]
+        y = c + NEIGHBOR_COLS[k]
+        if wrap:
+            x = (x + n_outer) % n_outer
+            y = (y + n_outer) % n_outer
+        elif x <= 0 or x >= n_outer - 1 or y <= 0 or y >= n_outer - 1:
+            continue
+        neighbor = x * n_outer + y
+        if is_active(buf, neighbor, n_outer, wrap):
+            length = sparse_add(items, positions, length, neighbor)
+    return length
+
+
+@njit(cache=True)
+def fixed_index_kernel(buf, n_outer, wrap, padding, sites, offset, coins, coin_pos, start, stop,
+                       n_ones, lower, upper, event_steps, event_signs, updates):
+    """Runs the iterations start, ..., stop - 1 of the fixed index dynamics, where sites[i - offset] is the
+    flat id of the vertex updated in iteration i. The changes of n_ones are written to the event buffers.
+    updates[0] counts the updates and updates[1] those that left the spin as it was.
+    Returns (next iteration, status, n_ones, coin_pos, n_events)"""
+    n_events = 0
+    for i in range(start, stop):
+        if n_events == event_steps.shape[0]:
+            return i, STATUS_EVENTS, n_ones, coin_pos, n_events
+        site = np.int64(sites[i - offset])
+        nb_sum = neighbor_sum(buf, site, n_outer, wrap)
+
+        if nb_sum > 2:
+            value = 1
+        elif nb_sum < 2:
+            value = 0
+        else:
+            if coin_pos == coins.shape[0]:
+                return i, STATUS_COINS, n_ones, coin_pos, n_events
+            value = 1 if coins[coin_pos] else 0
+            coin_pos += 1
+
+        old_value = get_bit(buf, site)
+        updates[0] += 1
+        changed = value != old_value
+        if not changed:
+            # the neighbors can flip or not just as before
+            updates[1] += 1
+        else:
+            set_bit(buf, site, value)
+            if is_interior(site, n_outer, padding):
+                n_ones += value - old_value
+                event_steps[n_events] = i
+                event_signs[n_events] = value - old_value
+                n_events += 1
+
+        if n_ones >= upper:
+            return i + 1, STATUS_PLUS, n_ones, coin_pos, n_events
+        elif n_ones <= lower:
+            return i + 1, STATUS_MINUS, n_ones, coin_pos, n_events
+
+    return stop, STATUS_STOP, n_ones, coin_pos, n_events
+
+
+@njit(cache=True)
+def dynamic_index_kernel(buf, n_outer, wrap, padding, items, positions, length, uniforms, uniform_pos,
+                         coins, coin_pos, start, stop, n_ones, lower, upper, event_steps, event_signs, updates):
+    """Runs the iterations start, ..., stop - 1 of the dynamic index dynamics on the sparse set of vertices
+    that can flip. The changes of n_ones are written to the event buffers and the updates are counted as in
+    fixed_index_kernel.
+    Returns (next iteration, status, n_ones, length, uniform_pos, coin_pos, n_events)"""
+    n_events = 0
+    for i in range(start, stop):
+        if length == 0:
+            return i, STATUS_EMPTY, n_ones, length, uniform_pos, coin_pos, n_events
+        if uniform_pos == uniforms.shape[0]:
+            return i, STATUS_UNIFORMS, n_ones, length, uniform_pos, coin_pos, n_events
+        if coin_pos == coins.shape[0]:
+            return i, STATUS_COINS, n_ones, length, uniform_pos, coin_pos, n_events
+        if n_events == event_steps.shape[0]:
+            return i, STATUS_EVENTS, n_ones, length, uniform_pos, coin_pos, n_events
+
+        site = items[min(int(uniforms[uniform_pos] * length), length - 1)]
+        uniform_pos += 1
+        nb_sum = neighbor_sum(buf, site, n_outer, wrap)
+
+        if nb_sum > 2:
+            value = 1
+            length = sparse_remove(items, positions, length, site)
+        elif nb_sum < 2:
+            value = 0
+            length = sparse_remove(items, positions, length, site)
+        else:
+            value = 1 if coins[coin_pos] else 0
+            coin_pos += 1
+
+        old_value = get_bit(buf, site)
+        updates[0] += 1
+        changed = value != old_value
+        if not changed:
+            # the neighbors can flip or not just as before
+            updates[1] += 1
+        else:
+            set_bit(buf, site, value)
+            if is_interior(site, n_outer, padding):
+                n_ones += value - old_value
+                event_steps[n_events] = i
+                event_signs[n_events] = value - old_value
+                n_events += 1
+
+        if n_ones >= upper:
+            return i + 1, STATUS_PLUS, n_ones, length, uniform_pos, coin_pos, n_events
+        elif n_ones <= lower:
+            return i + 1, STATUS_MINUS, n_ones, length, uniform_pos, coin_pos, n_events
+
+        if changed:
+            length = activate_neighbors(buf, site, n_outer, wrap, items, positions, length)
+
+    return stop, STATUS_STOP, n_ones, length, uniform_pos, coin_pos, n_events
+
+
+@njit(cache=True)
+def geometric_index_kernel(buf, n_outer, wrap, padding, n_sites, items, positions, length, uniforms, uniform_pos,
+                           coins, coin_pos, start, stop, n_ones, lower, upper, event_steps, event_signs,
+                           updates):
+    """Runs the fixed index dynamics from iteration start to stop - 1, but only draws vertices from the sparse
+    set, which holds at least every vertex that can flip. A fixed index draw hits the set with probability
+    length / n_sites and does nothing otherwise, so the number of draws before the next hit is geometric and
+    is skipped at once. As the geometric distribution is memoryless, a skip past stop can simply end the call.
+    Returns (next iteration, status, n_ones, length, uniform_pos, coin_pos, n_events)"""
+    n_events = 0
+    i = start
+    while i < stop:
+        if length == 0:
+            # nothing can flip anymore, all remaining draws do nothing
+            return stop, STATUS_STOP, n_ones, length, uniform_pos, coin_pos, n_events
+        if uniform_pos + 2 > uniforms.shape[0]:
+            return i, STATUS_UNIFORMS, n_ones, length, uniform_pos, coin_pos, n_events
+        if coin_pos == coins.shape[0]:
+            return i, STATUS_COINS, n_ones, length, uniform_pos, coin_pos, n_events
+        if n_events == event_steps.shape[0]:
+            return i, STATUS_EVENTS, n_ones, length, uniform_pos, coin_pos, n_events
+
+        # number of draws that miss the set before the next one hits it
+        skip = 0
+        if length < n_sites:
+            skip = int(np.floor(np.log(1.0 - uniforms[uniform_pos]) / np.log1p(-length / n_sites)))
+        uniform_pos += 1
+        if skip >= stop - i:
+            return stop, STATUS_STOP, n_ones, length, uniform_pos, coin_pos, n_events
+        i += skip
+
+        site = items[min(int(uniforms[uniform_pos] * length), length - 1)]
+        uniform_pos += 1
+        nb_sum = neighbor_sum(buf, site, n_outer, wrap)
+
+        if nb_sum > 2:
+            value = 1
+            length = sparse_remove(items, positions, length, site)
+        elif nb_sum < 2:
+            value = 0
+            length = sparse_remove(items, positions, length, site)
+        else:
+            value = 1 if coins[coin_pos] else 0
+            coin_pos += 1
+
+        old_value = get_bit(buf, site)
+        updates[0] += 1
+        changed = value != old_value
+        if not changed:
+            # the neighbors can flip or not just as before
+            updates[1] += 1
+        else:
+            set_bit(buf, site, value)
+            if is_interior(site, n_outer, padding):
+                n_ones += value - old_value
+                event_steps[n_events] = i
+                event_signs[n_events] = value - old_value
+                n_events += 1
+
+        if n_ones >= upper:
+            return i + 1, STATUS_PLUS, n_ones, length, uniform_pos, coin_pos, n_events
+        elif n_ones <= lower:
+            return i + 1, STATUS_MINUS, n_ones, length, uniform_pos, coin_pos, n_events
+
+        if changed:
+            length = activate_neighbors(buf, site, n_outer, wrap, items, positions, length)
+        i += 1
+
+    return stop, STATUS_STOP, n_ones, length, uniform_pos, coin_pos, n_events
+
+
+class NumbaEngine:
+    """Python side of the compiled engines. The kernels work directly on the packed bits of the BitArrayMat
+    and only return to python at checkpoints, logging steps or to get new random numbers.
+    With compiled=False, the same kernels run as plain python, which is the reference the compiled
+    engines have to agree with bit by bit."""
+
+    # the kernels wrap around the torus themselves and need the plain layout of the bits
+    halo = False
+
+    def __init__(self, compiled=True, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.compiled = compiled
+        self.coins = None
+        self.coin_pos = 0
+        self.event_steps = np.empty(EVENT_CHUNK, dtype=np.int64)
+        self.event_signs = np.empty(EVENT_CHUNK, dtype=np.int8)
+        # n_updates and n_elided, counted by the kernels
+        self.updates = np.zeros(2, dtype=np.int64)
+
+    def kernel(self, kernel):
+        """returns the compiled kernel or its plain python reference"""
+        return kernel if self.compiled else kernel.py_func
+
+    def packed_matrix(self) -> np.ndarray:
+        """zero-copy view of the bits of the matrix as uint8"""
+        return self.matrix.packed_view()
+
+    def refill_coins(self) -> None:
+        self.coins = self.rng.integers(0, 2, size=COIN_CHUNK, dtype=np.uint8)
+        self.coin_pos = 0
+
+    def setup_neighbor_counts(self) -> None:
+        # the kernels read the neighbors from the packed bits, there is no field to keep up to date
+        if self.neighbor_counts:
+            self.logger.info("The compiled engines do not use the neighbor count field, ignoring neighbor_counts")
+        self.counts = None
+
+    def get_random_state(self) -> dict:
+        state = super().get_random_state()
+        state["coins"] = self.coins[self.coin_pos:].tolist() if self.coins is not None else None
+        return state
+
+    def set_random_state(self, state: dict) -> None:
+        super().set_random_state(state)
+        if state.get("coins") is not None:
+            self.coins = np.array(state["coins"], dtype=np.uint8)
+            self.coin_pos = 0
+
+    def export_state(self) -> dict:
+        self.n_updates, self.n_elided = self.updates.tolist()
+        return super().export_state()
+
+    def import_state(self, state: dict) -> int:
+        last_index = super().import_state(state)
+        self.updates[:] = (self.n_updates, self.n_elided)
+        return last_index
+
+    def extra_results(self) -> dict:
+        self.n_updates, self.n_elided = self.updates.tolist()
+        return super().extra_results()
+
+    def flush_events(self, n_events, i) -> None:
+        """moves the events the kernel recorded into the trace, which now covers the iterations up to i"""
+        self.trace.extend(self.event_steps[:n_events], self.event_signs[:n_events])
+        self.trace.length = i
+
+    def next_stop(self, i, verbose) -> int:
+        """the iteration after the next one at which the kernel has to return to python"""
+        stop = self.t
+        for every in (self.save_bitmaps_every, self.check_sum_every, self.stationary_check_every,
+                      LOGGING_STEP if verbose else None):
+            if every is not None:
+                stop = min(stop, i + (-i) % every + 1)
+        return stop
+
+    def kernel_returned(self, last, status, target, verbose) -> bool:
+        """Does the checkpointing and logging for the last iteration the kernel ran. Returns True if
+        the kernel stopped because of fixation or if the run is stuck in a stationary state"""
+        share = self.n_ones / target
+
+        if self.check_sum_every is not None and (last % self.check_sum_every == 0):
+            self.check_n_ones(last)
+
+        if self.save_bitmaps_every is not None and (last % self.save_bitmaps_every == 0):
+            self.save_bitmap(last)
+
+        if status == STATUS_PLUS:
+            self.logger.info(f"Fixation at +1 at iteration {last}. Share of 1 is {share}.")
+            return True
+        elif status == STATUS_MINUS:
+            self.logger.info(f"Fixation at -1 at iteration {last}. Share of 1 is {share}.")
+            return True
+
+        if self.stationary_check_every is not None and (last % self.stationary_check_every == 0):
+            self.outcome = self.stationary_outcome(target)
+            if self.outcome is not None:
+                self.logger.info(f"Stationary state ({self.outcome}) at iteration {last}, stopping early. "
+                                 f"Share of 1 is {share}.")
+                return True
+
+        if self.save_bitmaps_every is not None and (last % self.save_bitmaps_every == 0):
+            self.save_state_checkpoint(last)
+
+        if (last % LOGGING_STEP == 0) and verbose:
+            self.logger.info(f"iteration: {last} share of 1 is: {share}")
+            self.logger.info(f"Length of index list: {len(self.indices)}")
+        return False
+
+
+class GlauberFixIndicesNumba(NumbaEngine, GlauberSimulatorFixIndices):
+    """Runs the fixed index dynamics in a numba kernel"""
+
+    def call_fixed_kernel(self, kernel, buf, i, stop, lower, upper) -> tuple:
+        """Runs the kernel from iteration i on, for at most one chunk of the site stream and not past stop.
+        Refills the coins if the kernel ran out of them. Returns (next iteration, status)"""
+        chunk_size = self.indices.chunk_size
+        chunk = i // chunk_size
+        stop = min(stop, (chunk + 1) * chunk_size)
+        i, status, self.n_ones, self.coin_pos, n_events = kernel(
+            buf, self.n_outer, self.wrap_indices, self.padding, self.indices.get_chunk(chunk),
+            chunk * chunk_size, self.coins, self.coin_pos, i, stop, self.n_ones, lower, upper,
+            self.event_steps, self.event_signs, self.updates)
+        self.flush_events(n_events, i)
+
+        if status == STATUS_COINS:
+            self.refill_coins()
+        return i, status
+
+    def run_iterations(self, start: int, target: int, verbose: bool = False) -> tuple:
+        kernel = self.kernel(fixed_index_kernel)
+        self.logger.info(f"Running {'compiled' if self.compiled else 'reference'} kernel on PID {os.getpid()}")
+
+        buf = self.packed_matrix()
+        if self.coins is None:
+            self.refill_coins()
+
+        upper = self.tol * target
+        lower = (1 - self.tol) * target
+
+        i = start
+        while i < self.t:
+            i, status = self.call_fixed_kernel(kernel, buf, i, self.next_stop(i, verbose), lower, upper)
+
+            if status == STATUS_COINS or status == STATUS_EVENTS:
+                continue
+
+            if self.kernel_returned(i - 1, status, target, verbose):
+                return status == STATUS_PLUS, i - 1
+
+        return False, 0
+
+
+class GlauberFixedIndexTorusNumba(GlauberFixIndicesNumba, GlauberFixedIndexTorus):
+    """Compiled fixed index dynamics on the torus, the kernel wraps the neighbors around itself"""
+    pass
+
+
+class GlauberDynIndicesNumba(NumbaEngine, GlauberSimDynIndices):
+    """Runs the dynamic index dynamics in a numba kernel. The vertices that can flip are kept as flat ids
+    in a SparseSet instead of a ListDict of tuples and are chosen with pre-drawn uniforms"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.uniforms = None
+        self.uniform_pos = 0
+
+        if self.purge_interval is not None:
+            # checking the neighbors is cheap in the kernel, there is no lazy deletion
+            self.logger.info("The compiled engines always check the neighbors, ignoring purge_interval")
+            self.purge_interval = None
+
+    def refill_uniforms(self) -> None:
+        self.uniforms = self.rng.random(UNIFORM_CHUNK)
+        self.uniform_pos = 0
+
+    def get_random_state(self) -> dict:
+        state = super().get_random_state()
+        state["uniforms"] = self.uniforms[self.uniform_pos:].tolist() if self.uniforms is not None else None
+        return state
+
+    def set_random_state(self, state: dict) -> None:
+        super().set_random_state(state)
+        if state.get("uniforms") is not None:
+            self.uniforms = np.array(state["uniforms"])
+            self.uniform_pos = 0
+
+    def build_indices(self, sites: np.ndarray):
+        return SparseSet.from_items(self.n_outer**2, sites)
+
+    def index_items(self) -> np.ndarray:
+        return self.indices.items[:self.indices.length].copy()
+
+    def call_dynamic_kernel(self, kernel, buf, i, stop, lower, upper) -> tuple:
+        """Runs the kernel from iteration i on, not past stop. Refills the coins or uniforms if the kernel ran
+        out of them. Returns (next iteration, status)"""
+        i, status, self.n_ones, self.indices.length, self.uniform_pos, self.coin_pos, n_events = kernel(
+            buf, self.n_outer, self.wrap_indices, self.padding, self.indices.items, self.indices.positions,
+            self.indices.length, self.uniforms, self.uniform_pos, self.coins, self.coin_pos,
+            i, stop, self.n_ones, lower, upper, self.event_steps, self.event_signs, self.updates)
+        self.flush_events(n_events, i)
+
+        if status == STATUS_COINS:
+            self.refill_coins()
+        elif status == STATUS_UNIFORMS:
+            self.refill_uniforms()
+        return i, status
+
+    def run_iterations(self, start: int, target: int, verbose: bool = False) -> tuple:
+        kernel = self.kernel(dynamic_index_kernel)
+        self.logger.info(f"Running {'compiled' if self.compiled else 'reference'} kernel on PID {os.getpid()}")
+
+        buf = self.packed_matrix()
+        if self.coins is None:
+            self.refill_coins()
+        if self.uniforms is None:
+            self.refill_uniforms()
+
+        upper = self.tol * target
+        lower = (1 - self.tol) * target
+
+        i = start
+        while i < self.t:
+            i, status = self.call_dynamic_kernel(kernel, buf, i, self.next_stop(i, verbose), lower, upper)
+
+            if status == STATUS_COINS or status == STATUS_EVENTS or status == STATUS_UNIFORMS:
+                continue
+            elif status == STATUS_EMPTY:
+                self.logger.info("No more indices available, breaking")
+                return False, i
+
+            if self.kernel_returned(i - 1, status, target, verbose):
+                return status == STATUS_PLUS, i - 1
+
+        return False, 0
+
+
+class GlauberDynIndexTorusNumba(GlauberDynIndicesNumba, GlauberDynIndexTorus):
+    """Compiled dynamic index dynamics on the torus, every vertex is in the sparse set at most once"""
+    pass
+
+
+class GlauberGeometricIndices(GlauberDynIndicesNumba):
+    """Fixed index dynamics with the speed of dynamic indexing. Vertices are only drawn from the set of
+    vertices that can flip and the iteration counter jumps over the geometric number of draws that a fixed
+    index run would have spent on frozen vertices. Trajectories and iteration counts have exactly the
+    distribution of GlauberSimulatorFixIndices, but not the same random stream"""
+
+    def n_sites(self) -> int:
+        """number of vertices a fixed index run draws from, the boundary of the square is never drawn"""
+        return (self.n_outer - 2)**2
+
+    def run_iterations(self, start: int, target: int, verbose: bool = False) -> tuple:
+        kernel = self.kernel(geometric_index_kernel)
+        self.logger.info(f"Running {'compiled' if self.compiled else 'reference'} kernel on PID {os.getpid()}")
+
+        buf = self.packed_matrix()
+        if self.coins is None:
+            self.refill_coins()
+        if self.uniforms is None:
+            self.refill_uniforms()
+
+        upper = self.tol * target
+        lower = (1 - self.tol) * target
+
+        i = start
+        while i < self.t:
+            i, status, self.n_ones, self.indices.length, self.uniform_pos, self.coin_pos, n_events = kernel(
+                buf, self.n_outer, self.wrap_indices, self.padding, self.n_sites(), self.indices.items,
+                self.indices.positions, self.indices.length, self.uniforms, self.uniform_pos, self.coins,
+                self.coin_pos, i, self.next_stop(i, verbose), self.n_ones, lower, upper, self.event_steps,
+                self.event_signs, self.updates)
+            self.flush_events(n_events, i)
+
+            if status == STATUS_COINS:
+                self.refill_coins()
+                continue
+            elif status == STATUS_UNIFORMS:
+                self.refill_uniforms()
+                continue
+            elif status == STATUS_EVENTS:
+                continue
+
+            if self.kernel_returned(i - 1, status, target, verbose):
+                return status == STATUS_PLUS, i - 1
+
+        # like a fixed index run, the run always lasts until self.t without fixation
+        return False, self.t
+
+
+class GlauberGeometricTorus(GlauberGeometricIndices, GlauberDynIndexTorus):
+    """Geometric skipping on the torus, where every vertex is drawn"""
+
+    def n_sites(self) -> int:
+        return self.n_outer**2
+
+
+class GlauberAdaptiveIndices(GlauberFixIndicesNumba, GlauberDynIndicesNumba):
+    """Starts with fixed indexing and switches to dynamic indexing in the same run, once the share of
+    vertices that can flip drops below switch_fraction. The share is measured with active_mask() every
+    measure_every iterations, by default once per sweep over the lattice. Replaces running a fixed and then
+    a dynamic simulator with a hand picked number of fixed steps. The switch point and the duration of both
+    phases go into the result dict"""
+
+    def __init__(self, switch_fraction=0.1, measure_every=None, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.switch_fraction = switch_fraction
+        self.measure_every = measure_every if measure_every is not None else self.n_sites()
+        self.switch_iteration = None
+        # the iteration at which the share of vertices that can flip is measured next
+        self.next_measure = None
+        # seconds spent in the fixed and in the dynamic phase, zero if no updates are run
+        self.phase_seconds = [0.0, 0.0]
+
+    def n_sites(self) -> int:
+        """number of vertices the fixed index phase draws from, the boundary of the square is never drawn"""
+        return (self.n_outer - 2)**2
+
+    def setup_indices(self) -> None:
+        # the fixed index phase draws from a site stream, the sparse set is only built at the switch
+        self.indices = SiteStream(self.site_seed_sequence, self.n_outer, 1, self.n_outer - 1, self.t)
+
+    def switch_to_dynamic(self, active, i) -> None:
+        self.logger.info(f"Switching to dynamic indices at iteration {i}, {len(active)} of {self.n_sites()} "
+                         f"vertices can flip")
+        self.indices = self.build_indices(active)
+        self.switch_iteration = i
+
+    def index_items(self) -> np.ndarray:
+        # the fixed index phase has no set of indices, only the seed of its site stream
+        return super().index_items() if self.switch_iteration is not None else None
+
+    def checkpoint_state(self) -> dict:
+        state = super().checkpoint_state()
+        state["adaptive"] = [self.switch_iteration, self.next_measure]
+        return state
+
+    def restore_checkpoint_state(self, state: dict) -> int:
+        self.switch_iteration, self.next_measure = state["adaptive"]
+        return super().restore_checkpoint_state(state)
+
+    def run_iterations(self, start: int, target: int, verbose: bool = False) -> tuple:
+        fixed_kernel = self.kernel(fixed_index_kernel)
+        dynamic_kernel = self.kernel(dynamic_index_kernel)
+        self.logger.info(f"Running {'compiled' if self.compiled else 'reference'} kernels on PID {os.getpid()}")
+
+        buf = self.packed_matrix()
+        if self.coins is None:
+            self.refill_coins()
+        if self.uniforms is None:
+            self.refill_uniforms()
+
+        upper = self.tol * target
+        lower = (1 - self.tol) * target
+
+        self.phase_seconds = [0.0, 0.0]
+        phase_start = time.perf_counter()
+
+        i = start
+        if self.next_measure is None:
+            self.next_measure = start
+        fixation = False
+        iterations = 0
+        while i < self.t:
+            if self.switch_iteration is None and i >= self.next_measure:
+                active = np.flatnonzero(self.active_mask())
+                if len(active) < self.switch_fraction * self.n_sites():
+                    self.phase_seconds[0] = time.perf_counter() - phase_start
+                    phase_start = time.perf_counter()
+                    self.switch_to_dynamic(active, i)
+                else:
+                    self.next_measure = i + self.measure_every
+
+            stop = self.next_stop(i, verbose)
+            if self.switch_iteration is None:
+                i, status = self.call_fixed_kernel(fixed_kernel, buf, i, min(stop, self.next_measure), lower, upper)
+            else:
+                i, status = self.call_dynamic_kernel(dynamic_kernel, buf, i, stop, lower, upper)
+
+            if status == STATUS_COINS or status == STATUS_EVENTS or status == STATUS_UNIFORMS:
+                continue
+            elif status == STATUS_EMPTY:
+                self.logger.info("No more indices available, breaking")
+                iterations = i
+                break
+
+            if self.kernel_returned(i - 1, status, target, verbose):
+                fixation, iterations = status == STATUS_PLUS, i - 1
+                break
+
+        self.phase_seconds[0 if self.switch_iteration is None else 1] = time.perf_counter() - phase_start
+        return fixation, iterations
+
+    def extra_results(self) -> dict:
+        results = super().extra_results()
+        results.update({"switch_iteration": self.switch_iteration,
+                        "fixed_seconds": self.phase_seconds[0],
+                        "dynamic_seconds": self.phase_seconds[1]})
+        return results
+
+
+class GlauberAdaptiveTorus(GlauberAdaptiveIndices, GlauberDynIndexTorus):
+    """Adaptive switch on the torus, where every vertex is drawn in the fixed index phase"""
+
+    def n_sites(self) -> int:
+        return self.n_outer**2
+
+    def setup_indices(self) -> None:
+        self.indices = SiteStream(self.site_seed_sequence, self.n_outer, 0, self.n_outer, self.t)
@@ -0,0 +1,279 @@
+import numpy as np
+import os
+import json
+import logging
+
+from .glauberSim import LOGGING_STEP, TRACE_FILE, OUTCOME_PLUS, OUTCOME_MINUS, OUTCOME_TIMEOUT
+from .DataStructs.EventTrace import EventTrace
+
+
+DEBUG = False
+
+# number of iterations for which the sites and coins are drawn at once
+BLOCK_SIZE = 2**12
+
+
+def neighbor_tables(n_outer, wrap) -> tuple:
+    """flat ids of the up, down, left and right neighbor of every vertex. Without wrap, the tables are
+    only valid for vertices that are not on the boundary"""
+    rows, cols = np.divmod(np.arange(n_outer**2), n_outer)
+    if wrap:
+        return ((rows - 1) % n_outer * n_outer + cols, (rows + 1) % n_outer * n_outer + cols,
+                rows * n_outer + (cols - 1) % n_outer, rows * n_outer + (cols + 1) % n_outer)
+    flat = np.arange(n_outer**2)
+    return flat - n_outer, flat + n_outer, flat - 1, flat + 1
+
+
+class GlauberReplicas(object):
+    """Runs independent replicas of the fixed index dynamics in lockstep on one (n_replicas, n_outer**2) array.
+    In every iteration, one site per replica is drawn and all replicas are updated with one round of numpy
+    fancy indexing, so the python overhead of an iteration is shared by all replicas. Replicas that reached
+    fixation are no longer updated. Every replica writes its own results directory, with the same files as a
+    run of GlauberSimulatorFixIndices, so the plotting scripts can read them."""
+
+    def __init__(
+        self,
+        results_dirs: list,
+        n_interior: np.int64,
+        p: np.float64,
+        t: np.int64,
+        tol: np.float64,
+        boundary=1,
+        padding: np.int64 = None,
+        save_bitmaps_every=None,
+        random_seed=None,
+        check_sum_every=None
+    ) -> None:
+        """
+        Parameters
+        ----------
+        results_dirs : list of str
+            one results directory per replica, the number of replicas is len(results_dirs)
+        random_seed : int
+            seed of the generator that is shared by all replicas. If None, the PID is used
+
+        All other parameters are the same as for GlauberSim.
+        """
+        self.results_dirs = list(results_dirs)
+        self.n_replicas = len(self.results_dirs)
+        for results_dir in self.results_dirs:
+            os.makedirs(os.path.join(results_dir, "bitmap_results"), exist_ok=True)
+
+        pid = os.getpid()
+        self.logger = logging.getLogger(__name__ + '.' + str(pid))
+
+        if DEBUG:
+            self.logger.setLevel(logging.DEBUG)
+        else:
+            self.logger.setLevel(logging.INFO)
+
+        # the log of the whole block goes to the directory of the first replica
+        fh = logging.FileHandler(filename=f'{self.results_dirs[0]}/log-{pid}.log')
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        fh.setFormatter(formatter)
+        fh.setLevel(logging.INFO)
+        if not len(self.logger.handlers):
+            self.logger.addHandler(fh)
+
+        self.padding = padding
+        self.n_interior = n_interior
+        self.n_outer = n_interior + 2 * self.padding
+        self.p = p
+        self.t = t
+        self.tol = tol
+        self.boundary = boundary
+        self.save_bitmaps_every = save_bitmaps_every
+        self.check_sum_every = check_sum_every
+        # the replicas always run until fixation or t, see GlauberSim.stationary_outcome for single runs
+        self.stationary_check_every = None
+
+        for results_dir in self.results_dirs:
+            parameters = {
+                "n_interior": self.n_interior,
+                "p": self.p,
+                "t": self.t,
+                "tol": self.tol,
+                "padding": self.padding,
+                "save_bitmaps_every": self.save_bitmaps_every,
+                "results_dir": results_dir,
+                "n_replicas": self.n_replicas,
+            }
+            with open(f"{results_dir}/simulation-params.json", "w") as f:
+                json.dump(parameters, f)
+
+        if random_seed is None:
+            random_seed = pid
+        self.random_seed = random_seed
+        self.logger.warning("random seed set to " + str(random_seed))
+        self.rng = np.random.default_rng(np.random.SeedSequence(random_seed))
+
+        self.wrap_indices = False
+
+        self.spins = None
+        self.n_ones = None
+        self.traces = None
+
+    def site_range(self) -> tuple:
+        """rows and columns of the sites that are updated, the boundary never is on a square"""
+        if self.wrap_indices:
+            return 0, self.n_outer
+        return 1, self.n_outer - 1
+
+    def setup_spins(self) -> None:
+        spins = (self.rng.random((self.n_replicas, self.n_outer, self.n_outer)) < self.p).astype(np.uint8)
+
+        if self.boundary == 0 or self.boundary == 1:
+            spins[:, 0, :] = self.boundary
+            spins[:, -1, :] = self.boundary
+            spins[:, :, 0] = self.boundary
+            spins[:, :, -1] = self.boundary
+            self.logger.info(f"Set up boundary as {self.boundary}")
+        elif self.boundary == "random":
+            self.logger.info("Setting up random boundary")
+        else:
+            self.logger.error(f"Boundary {self.boundary} not recognized, leaving random")
+
+        self.spins = spins.reshape((self.n_replicas, self.n_outer**2))
+
+    def setup_interior_mask(self) -> None:
+        interior_mask = np.zeros((self.n_outer, self.n_outer), dtype=np.bool_)
+        interior_mask[self.padding:self.n_outer - self.padding, self.padding:self.n_outer - self.padding] = True
+        self.interior_mask = interior_mask.flatten()
+
+    def sum_ones(self) -> np.ndarray:
+        """number of ones in the interior of every replica"""
+        return self.spins[:, self.interior_mask].sum(axis=1, dtype=np.int64)
+
+    def check_n_ones(self, i) -> None:
+        """Compares the running counts of +1 vertices in the interior against a full recount"""
+        recount = self.sum_ones()
+        if not np.array_equal(recount, self.n_ones):
+            self.logger.error(f"Running counts {self.n_ones} differ from recount {recount} at iteration {i}")
+            raise RuntimeError(f"Running count of +1 vertices differs from recount at iteration {i}")
+
+    def save_bitmap(self, replica, iter: int) -> None:
+        """saves the replica in the same format as BitArrayMat.export_to_file"""
+        path = f"{self.results_dirs[replica]}/bitmap_results/iter-{iter}.bmp"
+        np.packbits(self.spins[replica]).tofile(path)
+
+    def draw_block(self, size) -> tuple:
+        """flat ids of the updated sites and the tie coins for the next size iterations, shape (size, n_replicas)"""
+        low, high = self.site_range()
+        width = high - low
+        rows, cols = np.divmod(self.rng.integers(0, width**2, size=(size, self.n_replicas)), width)
+        sites = (rows + low) * self.n_outer + cols + low
+        coins = self.rng.integers(0, 2, size=(size, self.n_replicas), dtype=np.uint8)
+        return sites, coins
+
+    def run_iterations(self, target: int, verbose: bool = False) -> tuple:
+        """Runs all replicas until they reach fixation or self.t. Returns the arrays (fixation, iterations)"""
+        up, down, left, right = neighbor_tables(self.n_outer, self.wrap_indices)
+        upper = self.tol * target
+        lower = (1 - self.tol) * target
+
+        fixation = np.zeros(self.n_replicas, dtype=np.bool_)
+        iterations = np.full(self.n_replicas, self.t, dtype=np.int64)
+        # replicas that have not reached fixation yet
+        running = np.arange(self.n_replicas)
+
+        for start in range(0, self.t, BLOCK_SIZE):
+            size = min(BLOCK_SIZE, self.t - start)
+            sites, coins = self.draw_block(size)
+            deltas = np.zeros((size, self.n_replicas), dtype=np.int8)
+
+            for j in range(size):
+                i = start + j
+                s = sites[j, running]
+                nb_sum = (self.spins[running, up[s]] + self.spins[running, down[s]]
+                          + self.spins[running, left[s]] + self.spins[running, right[s]])
+                value = np.where(nb_sum > 2, 1, np.where(nb_sum < 2, 0, coins[j, running])).astype(np.int8)
+
+                delta = (value - self.spins[running, s].astype(np.int8)) * self.interior_mask[s]
+                self.spins[running, s] = value
+                self.n_ones[running] += delta
+                deltas[j, running] = delta
+
+                if self.check_sum_every is not None and (i % self.check_sum_every == 0):
+                    self.check_n_ones(i)
+
+                if self.save_bitmaps_every is not None and (i % self.save_bitmaps_every == 0):
+                    for replica in running:
+                        self.save_bitmap(replica, i)
+
+                n_ones = self.n_ones[running]
+                done = (n_ones >= upper) | (n_ones <= lower)
+                if done.any():
+                    for replica in running[done]:
+                        fixation[replica] = self.n_ones[replica] >= upper
+                        iterations[replica] = i
+                        self.traces[replica].length = i + 1
+                        self.logger.info(f"Replica {replica}: fixation at {'+1' if fixation[replica] else '-1'} "
+                                         f"at iteration {i}. Share of 1 is {self.n_ones[replica] / target}.")
+                    running = running[~done]
+
+                if (i % LOGGING_STEP == 0) and verbose:
+                    self.logger.info(f"iteration: {i} shares of 1 are: {self.n_ones / target}")
+                    self.logger.info(f"Number of running replicas: {len(running)}")
+
+            for replica, trace in enumerate(self.traces):
+                changed = np.flatnonzero(deltas[:, replica])
+                trace.extend(changed + start, deltas[changed, replica])
+
+            if len(running) == 0:
+                break
+
+        return fixation, iterations
+
+    def run_replicas(self, verbose: bool = False) -> list:
+        """Runs the dynamics on all replicas and returns their result dicts"""
+        self.logger.info(f"Running {self.n_replicas} replicas in lockstep on PID {os.getpid()}")
+
+        self.setup_spins()
+        self.setup_interior_mask()
+
+        target = self.n_interior**2
+        self.n_ones = self.sum_ones()
+        self.traces = [EventTrace(target, int(n)) for n in self.n_ones]
+        for trace in self.traces:
+            trace.length = self.t
+
+        fixation, iterations = self.run_iterations(target, verbose)
+
+        results = []
+        for replica, results_dir in enumerate(self.results_dirs):
+            if fixation[replica]:
+                outcome = OUTCOME_PLUS
+            elif iterations[replica] < self.t:
+                outcome = OUTCOME_MINUS
+            else:
+                outcome = OUTCOME_TIMEOUT
+
+            # same convention as GlauberSim.run_single_glauber, only fixation at +1 ends the run early
+            if not fixation[replica]:
+                iterations[replica] = self.t
+
+            self.save_bitmap(replica, iterations[replica])
+            self.traces[replica].save(f"{results_dir}/{TRACE_FILE}")
+
+            result = {"fixation": bool(fixation[replica]),
+                      "iterations": int(iterations[replica]),
+                      "trace_file": TRACE_FILE,
+                      "outcome": outcome}
+            with open(f"{results_dir}/result-dict.json", "w") as f:
+                json.dump(result, f)
+            results.append(result)
+
+        self.logger.info(f"Results: {results}")
+        self.spins = None
+        self.n_ones = None
+        self.traces = None
+        return results
+
+
+class GlauberReplicasTorus(GlauberReplicas):
+
+    def __init__(self, *args, **kwargs) -> None:
+        kwargs["boundary"] = "random"
+        kwargs["padding"] = 0
+        super().__init__(*args, **kwargs)
+        self.wrap_indices = True
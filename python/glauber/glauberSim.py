@@ -4,14 +4,50 @@ import os
 import datetime
 import json
 import logging
-import random
 from copy import copy
+from contextlib import contextmanager
 import sys 
 
 import itertools
 
+from .DataStructs.EventTrace import EventTrace
+from .DataStructs.RandomBuffer import RandomBuffer
+from .checkpointWriter import CheckpointWriter
+
 DEBUG = False
 LOGGING_STEP = 100_000
+TRACE_FILE = "trace.npz"
+# full state of a run in the bitmap dir, see save_state_checkpoint
+STATE_FILE = "state-{}.npz"
+
+# how a run ended, the "outcome" of the result dict
+OUTCOME_PLUS = "plus"           # fixation at +1
+OUTCOME_MINUS = "minus"         # fixation at -1
+OUTCOME_TIMEOUT = "timeout"     # ran all t iterations
+OUTCOME_FROZEN = "frozen"       # no vertex can flip anymore, like in a stripe
+OUTCOME_CONFINED = "confined"   # the vertices that can still flip are too few to ever reach the tolerance
+
+
+def is_state_checkpoint(path) -> bool:
+    """True if path is a state checkpoint and not the bitmap of a checkpoint"""
+    return path is not None and str(path).endswith(".npz")
+
+
+@contextmanager
+def atomic_open(path, mode="wb"):
+    """Opens a temporary file next to path, which replaces path only once it is written completely. A run that
+    is killed while writing leaves the previous file behind instead of a truncated one"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
 class GlauberSim(ABC):
@@ -27,7 +63,11 @@ class GlauberSim(ABC):
         results_dir=None,
         random_seed=None,
         checkpoint_file=None,
-        cp_result_file=None
+        cp_result_file=None,
+        check_sum_every=None,
+        initial_state=None,
+        stationary_check_every=None,
+        checkpoint_queue=None
     ) -> None:
         """Runs a simulation of the Glauber dynamics on a d-dimensional lattice of size n
         with probability p of initializing a vertex to 1
@@ -51,15 +91,31 @@ class GlauberSim(ABC):
         random_seed : int
             random seed to use for numpy
         checkpoint_file : str
-            path to a checkpoint file to start from. If None, starts from random initialization
+            path to a checkpoint file to start from. If None, starts from random initialization. Either the
+            bitmap of a checkpoint or a SnapshotArchive (from its latest snapshot), which need cp_result_file,
+            or a state checkpoint (state-<iteration>.npz), which continues the run exactly as if it had not
+            stopped, see save_state_checkpoint
         cp_result_file : str
             path to the result-dictionary json file of the run to recover from.
         boundary: int or str
             If int, boundary will be set to that value else pass string "random" to set random boundary
+        check_sum_every : int
+            debug option - number of iterations after which the running count of +1 vertices in the interior
+            is compared against a full recount with sum_ones(). If None, the count is never checked
+        initial_state : dict
+            final_state of another simulator in the same process to continue from, instead of a checkpoint
+            on disk. Holds the lattice, the trace and the state of the random number generators, which are
+            taken over and not copied
+        stationary_check_every : int
+            number of iterations after which it is checked whether the run can still reach fixation, see
+            stationary_outcome(). If it can not, the run stops early. If None, the run is never checked
+        checkpoint_queue : int
+            if set, checkpoints are written by a background thread and at most this many of them wait to be
+            written, see CheckpointWriter. If None, they are written in the update loop
         """
         self.results_dir = copy(results_dir)
         
-        if checkpoint_file is not None:
+        if checkpoint_file is not None and not is_state_checkpoint(checkpoint_file):
             if  cp_result_file is  None:
                 raise ValueError("Cannot specify only one of cp_result_file and checkpoint_file")
 
@@ -107,6 +163,21 @@ class GlauberSim(ABC):
         self.checkpoint_file = checkpoint_file
         self.cp_result_file = cp_result_file
         self.boundary = boundary
+        self.check_sum_every = check_sum_every
+        self.initial_state = initial_state
+        self.stationary_check_every = stationary_check_every
+        # one of the OUTCOME_* constants once the run has ended
+        self.outcome = None
+        # state at the end of run_single_glauber, to hand over to another simulator with initial_state
+        self.final_state = None
+        # number of updates and of those that left the spin as it was, which skip the bookkeeping
+        self.n_updates = 0
+        self.n_elided = 0
+        # the latest state checkpoint, older ones are removed once a new one is written
+        self.state_file = None
+        self.writer = CheckpointWriter(checkpoint_queue)
+        # metrics of the writer at the end of the run, see CheckpointWriter.metrics
+        self.checkpoint_metrics = None
 
         parameters = {
             "n_interior": self.n_interior,
@@ -120,19 +191,27 @@ class GlauberSim(ABC):
         with open(f"{self.results_dir}/simulation-params.json", "w") as f:
             json.dump(parameters, f)
 
-        if random_seed is not None:
-            np.random.seed(random_seed)
-            random.seed(random_seed)
-            self.logger.warning("random seed set to " + str(random_seed))
-        else:
-            np.random.seed(os.getpid())
-            random.seed(os.getpid())
-            self.logger.warning("random seed set to " + str(os.getpid()))
+        if random_seed is None:
+            random_seed = os.getpid()
+        self.logger.warning("random seed set to " + str(random_seed))
+
+        self.random_seed = random_seed
+        # the run has its own random streams, spawned from its seed: one for the vertices of the fixed
+        # indices, see SiteStream, and one for everything else, i.e. the lattice, the coins and the choices
+        # of the dynamic indices. Nothing uses the global state of numpy or random
+        self.seed_sequence = np.random.SeedSequence(random_seed)
+        self.site_seed_sequence, rng_seed_sequence = self.seed_sequence.spawn(2)
+        self.rng = np.random.default_rng(rng_seed_sequence)
+        self.draws = RandomBuffer(self.rng)
 
         self.matrix = None
         self.indices = None
         self.interior_mask = None
 
+        # running count of +1 vertices in the interior, only changed when a spin in the interior flips
+        self.n_ones = None
+        self.trace = None
+
         self.wrap_indices = False
 
 
@@ -145,8 +224,10 @@ class GlauberSim(ABC):
     def teardown_sim(self):
         """teardown_sim is called after each simulation run to reset the state of the simulator"""
         self.matrix = None
-        self.indice = None
+        self.indices = None
         self.interior_mask = None
+        self.n_ones = None
+        self.trace = None
     
     @abstractmethod
     def load_checkpoint_index(self) -> np.ndarray:
@@ -154,12 +235,23 @@ class GlauberSim(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def load_checkpoint_vector(self, last_index):
+    def load_checkpoint_trace(self, last_index):
+        """loads the trace of the run to recover from, up to and including iteration last_index"""
         raise NotImplementedError()
     
     @abstractmethod
     def load_checkpoint_matrix(self):
         raise NotImplementedError()
+
+    @abstractmethod
+    def save_state_checkpoint(self, i) -> None:
+        """writes checkpoint_state() after iteration i to the bitmap dir"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def load_state_checkpoint(self, path) -> int:
+        """restores the state written by save_state_checkpoint, returns the last iteration it ran"""
+        raise NotImplementedError()
     
     @abstractmethod    
     def setup_matrix(self) -> None:
@@ -177,6 +269,11 @@ class GlauberSim(ABC):
         """sum_ones returns the number of ones in the interior of the matrix"""
         raise NotImplementedError()
 
+    @abstractmethod
+    def is_interior(self, index: tuple) -> bool:
+        """is_interior returns True if the vertex at index counts towards sum_ones()"""
+        raise NotImplementedError()
+
     @abstractmethod
     def setup_indices(self) -> None:
         """setup_indices initializes the indices to be used in the simulation. Needs to be indexable by [i] and return a tuple"""
@@ -185,7 +282,7 @@ class GlauberSim(ABC):
     
     @abstractmethod
     def get_index(self, i) -> tuple:
-        """get_index returns the index at position for the ith update"""
+        """get_index returns the index at position for the ith update, or None if there is none left"""
         raise NotImplementedError()
 
     @abstractmethod
@@ -211,74 +308,100 @@ class GlauberSim(ABC):
         )
 
         return nb_sum
-    
-    def run_single_glauber(
-        self,
-        verbose: bool = False,
-        *args, **kwargs
-    ) -> dict:
-        """Runs a simulation of the Glauber dynamics on a d-dimensional lattice of size n
-        with probability p of initializing a vertex to 1
-        
-        Parameters
-        ----------
-        verbose : bool
-            if print statements should be performed
-        """
-        
-        self.logger.info(f"Simulation Running on proccess with PID {os.getpid()}")
-
-        self.setup_matrix()
-
-        # this is the padding between inner and outer lattice - 
-        # has nothing to do with the boundary condition
-        self.logger.debug(f"buffer: {self.padding}")
-
-        self.setup_interior_mask()
-
-        # this is the case if all interior vertices were one, disregarding the 
-        # possibility of setting some tolerance
-        target = self.n_interior**2
-        self.logger.debug(f"Target: {target}")
-
-        vector = np.ones(self.t) * np.int64(-1)
 
+    def stationary_outcome(self, target: int):
+        """OUTCOME_FROZEN or OUTCOME_CONFINED if the run can never reach fixation from the current state, otherwise
+        None. Without a way to tell, a run is never stationary"""
+        return None
+
+    def setup_neighbor_counts(self) -> None:
+        """Builds whatever the engine keeps about the matrix besides the spins, once the matrix is set up or
+        loaded. Does nothing by default"""
+        pass
+
+    def set_vertex(self, index: tuple, value: int) -> bool:
+        """Sets the spin of the vertex at index to value and keeps the running count of +1 vertices
+        in the interior up to date. Returns False if the spin already was value"""
+        old_value = self.matrix[index[0], index[1]]
+        if value != old_value:
+            self.matrix[index[0], index[1]] = value
+            if self.is_interior(index):
+                self.n_ones += int(value) - old_value
+            return True
+        return False
+
+    def get_random_state(self) -> dict:
+        """json serializable state of the random numbers of the run, i.e. of its generator and the draws
+        that were buffered but not used yet. Engines with their own buffers add them to it"""
+        return {"draws": self.draws.get_state()}
+
+    def set_random_state(self, state: dict) -> None:
+        """continues the random numbers from get_random_state()"""
+        self.draws.set_state(state["draws"])
+
+    def export_state(self) -> dict:
+        """The state that another simulator needs to continue this run in memory"""
+        return {"matrix": self.matrix,
+                "trace": self.trace,
+                "random_state": self.get_random_state(),
+                "updates": (self.n_updates, self.n_elided)}
+
+    def import_state(self, state: dict) -> int:
+        """Continues from the export_state() of another simulator, returns the last iteration it ran"""
+        self.matrix = state["matrix"]
+        self.matrix.set_wraparound(self.wrap_indices)
+        self.trace = state["trace"]
+        self.set_random_state(state["random_state"])
+        self.n_updates, self.n_elided = state["updates"]
+        return len(self.trace) - 1
+
+    def checkpoint_state(self) -> dict:
+        """export_state() and what another process needs besides it to continue the run exactly: the running count
+        and the seed of the site stream. Engines with more state, like the indices, add it"""
+        state = self.export_state()
+        state.update({"n_ones": self.n_ones,
+                      "site_seed": {"entropy": self.site_seed_sequence.entropy,
+                                    "spawn_key": list(self.site_seed_sequence.spawn_key)}})
+        return state
+
+    def restore_checkpoint_state(self, state: dict) -> int:
+        """Continues from checkpoint_state(), returns the last iteration it ran"""
+        self.n_ones = state["n_ones"]
+        self.site_seed_sequence = np.random.SeedSequence(state["site_seed"]["entropy"],
+                                                         spawn_key=tuple(state["site_seed"]["spawn_key"]))
+        return self.import_state(state)
+
+    def extra_results(self) -> dict:
+        """Further entries for the result dict, like statistics of the engine. Subclasses add to it"""
+        return {"elided_fraction": self.n_elided / self.n_updates if self.n_updates else 0.0}
+
+    def check_n_ones(self, i) -> None:
+        """Compares the running count of +1 vertices in the interior against a full recount"""
+        recount = self.sum_ones()
+        if recount != self.n_ones:
+            self.logger.error(f"Running count {self.n_ones} differs from recount {recount} at iteration {i}")
+            raise RuntimeError(f"Running count of +1 vertices ({self.n_ones}) differs from "
+                               f"recount ({recount}) at iteration {i}")
+    
+    def run_iterations(self, start: int, target: int, verbose: bool = False) -> tuple:
+        """Runs the updates from iteration start on until fixation, until no more indices are available
+        or until self.t is reached. Records every change of the count in self.trace and returns the tuple
+        (fixation, iterations)"""
         iterations = 0
         fixation = False
+        self.trace.length = self.t
 
-        # Do the warmstarting here
-
-        if self.checkpoint_available:
-            self.logger.info("Checkpoint available, trying to load matrix and index")
-            try:
-                self.matrix = self.load_checkpoint_matrix()
-                last_index = self.load_checkpoint_index()
-                if last_index >= self.t:
-                    logging.info("Checkpoint file is already past the number of iterations, breaking")
-                    self.teardown_sim()
-                    return json.load(open(self.cp_result_file, "r"))
-                vector = self.load_checkpoint_vector(last_index)
-            except FileNotFoundError as e:
-                self.logger.error("Checkpoint file not found, starting from scratch")
-                last_index = -1
-                pass
-            
-        else:
-            last_index = -1
-
-        self.setup_indices()
-
-        self.logger.info("Starting Glauber Simulation at index " + str(last_index + 1))
+        summed_array = self.n_ones
 
         # the index is (row, column)
-        for i in itertools.islice(range(0, self.t), last_index + 1, None):
+        for i in itertools.islice(range(0, self.t), start, None):
             """Updates the vertex at index in the matrix""" 
 
-            if len(self.indices) > 0:
-                index = self.get_index(i)
-            else:
+            index = self.get_index(i) if len(self.indices) > 0 else None
+            if index is None:
                 self.logger.info("No more indices available, breaking")
                 iterations = i
+                self.trace.length = i
                 break
 
             nb_sum = self.compute_neighbor_sum(index)
@@ -289,7 +412,7 @@ class GlauberSim(ABC):
                     self.logger.debug(f"Sum of neighbors for index {index}: {nb_sum}")
                     self.logger.debug(f"setting vertex at index {index} to 1")
 
-                self.matrix[index[0], index[1]] = 1
+                changed = self.set_vertex(index, 1)
                 # more than 2 neighbors are 1, so it is fixated
                 self.remove_vertex_from_indices(index)
                 
@@ -300,25 +423,32 @@ class GlauberSim(ABC):
                     self.logger.debug(f"Sum of neighbors for index {index}: {nb_sum}")
                     self.logger.debug(f"setting vertex at index {index} to 0")
 
-                self.matrix[index[0], index[1]] = 0
+                changed = self.set_vertex(index, 0)
                 # more than 2 neighbors are 0, so it is fixated
                 self.remove_vertex_from_indices(index)
                     
 
             if nb_sum == 2:
                 # flip coin
-                z = np.random.binomial(n=1, p=np.float64(0.5))
+                z = self.draws.coin()
                 if DEBUG:
                     self.logger.debug(f"Matrix before update at index {index}: \n" + self.matrix.debug_string(index))
                     self.logger.debug(f"Sum of neighbors for index {index}: {nb_sum}")
                     self.logger.debug(f"flipping coin for vertex at index {index}, result is {z}")
                 
-                self.matrix[index[0], index[1]] = z
+                changed = self.set_vertex(index, z)
                 # do not remove vertex from the list of those that can flip because its neighbors are still tied
 
-            summed_array = self.sum_ones()
+            self.n_updates += 1
+            if not changed:
+                # nothing to record and the neighbors can flip or not just as before
+                self.n_elided += 1
+            elif self.n_ones != summed_array:
+                self.trace.record(i, self.n_ones - summed_array)
+                summed_array = self.n_ones
 
-            vector[i] = summed_array / target
+            if self.check_sum_every is not None and (i % self.check_sum_every == 0):
+                self.check_n_ones(i)
 
             if self.save_bitmaps_every is not None and (i % self.save_bitmaps_every == 0):
                 self.save_bitmap(i)
@@ -328,6 +458,7 @@ class GlauberSim(ABC):
                 self.logger.debug(f"String Representation of Matrix: \n {str(self.matrix)}")
                 fixation = True
                 iterations = i
+                self.trace.length = i + 1
                 break
             elif summed_array <= (1 - self.tol) * target: # only hit may once
                 self.logger.info(f"Fixation at -1 at iteration {i}. Share of 1 is {summed_array / target}.")
@@ -335,40 +466,160 @@ class GlauberSim(ABC):
                               f"String Representation of Matrix: \n {str(self.matrix)}")
                 fixation = False
                 iterations = i
+                self.trace.length = i + 1
                 break
 
+            if self.stationary_check_every is not None and (i % self.stationary_check_every == 0):
+                self.outcome = self.stationary_outcome(target)
+                if self.outcome is not None:
+                    self.logger.info(f"Stationary state ({self.outcome}) at iteration {i}, stopping early. "
+                                     f"Share of 1 is {summed_array / target}.")
+                    iterations = i
+                    self.trace.length = i + 1
+                    break
+
             if (i % LOGGING_STEP == 0) and verbose:
                 self.logger.info(f"iteration: {i} share of 1 is: {summed_array / target}")
                 self.logger.info(f"Length of index list: {len(self.indices)}")
 
-            self.add_dyn_neighbors_to_indices(index)
+            if changed:
+                self.add_dyn_neighbors_to_indices(index)
+
+            if self.save_bitmaps_every is not None and (i % self.save_bitmaps_every == 0):
+                self.save_state_checkpoint(i)
 
             if DEBUG:
                 self.logger.debug(f"Number of vertices available for update: {len(self.indices)}")
 
-        # end glauber for loop
+        return fixation, iterations
 
-        if not fixation and len(self.indices) > 0 and last_index <= self.t:
-            # ran through all iterations, but did not reach fixation
-            iterations = self.t
+    def run_single_glauber(
+        self,
+        verbose: bool = False,
+        *args, **kwargs
+    ) -> dict:
+        """Runs a simulation of the Glauber dynamics on a d-dimensional lattice of size n
+        with probability p of initializing a vertex to 1
         
-        if last_index > self.t:
-            # loaded checkpoint that was already past the number of iterations
-            iterations = last_index
+        Parameters
+        ----------
+        verbose : bool
+            if print statements should be performed
+        """
+        
+        self.logger.info(f"Simulation Running on proccess with PID {os.getpid()}")
+
+        self.setup_matrix()
+
+        # this is the padding between inner and outer lattice - 
+        # has nothing to do with the boundary condition
+        self.logger.debug(f"buffer: {self.padding}")
+
+        self.setup_interior_mask()
+
+        # this is the case if all interior vertices were one, disregarding the 
+        # possibility of setting some tolerance
+        target = self.n_interior**2
+        self.logger.debug(f"Target: {target}")
+
+        # Do the warmstarting here
+
+        if self.initial_state is not None:
+            self.logger.info("Continuing from the state of another simulator")
+            last_index = self.import_state(self.initial_state)
+            self.initial_state = None
 
-        # for good measure, always save last bitmap
-        self.save_bitmap(iterations)
+        elif is_state_checkpoint(self.checkpoint_file):
+            self.logger.info(f"Continuing from the state checkpoint {self.checkpoint_file}")
+            last_index = self.load_state_checkpoint(self.checkpoint_file)
+
+        elif self.checkpoint_available:
+            self.logger.info("Checkpoint available, trying to load matrix and index")
+            try:
+                self.matrix = self.load_checkpoint_matrix()
+                last_index = self.load_checkpoint_index()
+                if last_index >= self.t:
+                    logging.info("Checkpoint file is already past the number of iterations, breaking")
+                    self.teardown_sim()
+                    return json.load(open(self.cp_result_file, "r"))
+                self.trace = self.load_checkpoint_trace(last_index)
+            except FileNotFoundError as e:
+                self.logger.error("Checkpoint file not found, starting from scratch")
+                last_index = -1
+                pass
+            
+        else:
+            last_index = -1
+
+        # a state checkpoint already has the indices and the count
+        if self.indices is None:
+            self.setup_indices()
+        self.setup_neighbor_counts()
+
+        # the only full count of the run, afterwards it is updated with every flip
+        if self.n_ones is None:
+            self.n_ones = self.sum_ones()
+
+        if last_index == -1:
+            self.trace = EventTrace(target, self.n_ones)
+
+        self.logger.info("Starting Glauber Simulation at index " + str(last_index + 1))
+
+        self.outcome = None
+        try:
+            if last_index >= self.t:
+                # a state from another simulator or a state checkpoint that is already past the number of
+                # iterations is handed on as it is, running the loop would cut the trace back to self.t
+                self.logger.info("State is already past the number of iterations, not running any updates")
+                fixation, iterations = self.n_ones >= self.tol * target, last_index
+            else:
+                fixation, iterations = self.run_iterations(last_index + 1, target, verbose)
+
+            # end glauber for loop
+
+            # the outcome is already set if the run stopped early in a stationary state
+            if self.outcome is None:
+                if fixation:
+                    self.outcome = OUTCOME_PLUS
+                elif self.n_ones <= (1 - self.tol) * target:
+                    self.outcome = OUTCOME_MINUS
+                elif len(self.indices) == 0:
+                    self.outcome = OUTCOME_FROZEN
+                else:
+                    self.outcome = OUTCOME_TIMEOUT
+
+            if self.outcome in (OUTCOME_MINUS, OUTCOME_TIMEOUT) and len(self.indices) > 0 and last_index <= self.t:
+                # ran through all iterations, but did not reach fixation
+                iterations = self.t
+        
+            if last_index > self.t:
+                # loaded checkpoint that was already past the number of iterations
+                iterations = last_index
+
+            # for good measure, always save last bitmap
+            self.save_bitmap(iterations)
+        finally:
+            # all checkpoints are on disk before the result, also those of a run that failed
+            self.writer.close()
+        self.checkpoint_metrics = self.writer.metrics()
+        self.logger.info(f"Checkpoint writer: {self.checkpoint_metrics}")
         
         result =  {}
 
+        # the trace is stored next to the result dict, see EventTrace.load
+        self.trace.save(f"{self.results_dir}/{TRACE_FILE}")
+
         result.update({"fixation": fixation,
                         "iterations":iterations, 
-                        "vector": vector.tolist()})
+                        "trace_file": TRACE_FILE,
+                        "outcome": self.outcome})
+        result.update(self.extra_results())
         self.logger.info(f"Result: fixation: {fixation}, iterations: {iterations}")
 
-        with open(f"{self.results_dir}/result-dict.json", "w") as f:
+        with atomic_open(f"{self.results_dir}/result-dict.json", "w") as f:
             json.dump(result, f)
 
+        self.final_state = self.export_state()
         self.teardown_sim()
 
         return result
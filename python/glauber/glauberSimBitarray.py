@@ -1,7 +1,11 @@
-from glauber.glauberSim import GlauberSim
+from glauber.glauberSim import GlauberSim, OUTCOME_FROZEN, OUTCOME_CONFINED, STATE_FILE, atomic_open
 import json
 from abc import ABC, abstractmethod
-from .DataStructs.BitArrayMat import BitArrayMat
+from .DataStructs.BitArrayMat import BitArrayMat, HaloBitArrayMat, pack_bits, neighbor_sum_field, neighbor_masks, \
+    unpack_words
+from .DataStructs.EventTrace import EventTrace
+from .DataStructs.SnapshotArchive import SnapshotArchive, SnapshotReader, ARCHIVE_FILE, is_archive
+from .DataStructs.SnapshotCube import SnapshotCube, CubeReader, CUBE_FILE, is_cube
 from bitarray import bitarray as ba
 import numpy as np
 import os
@@ -9,35 +13,77 @@ import os
 
 DEBUG = False
 
+# the initial spins are drawn in blocks of rows with about this many vertices, see setup_matrix
+INIT_CHUNK = 2**20
+
+# an entry of the neighbor count field has the sum of the neighbors in the low three bits and the spin of
+# the vertex itself in bit SPIN_BIT
+SPIN_BIT = 3
+# CAN_FLIP[entry] is 1 if the vertex is tied or disagrees with the majority of its neighbors
+CAN_FLIP = bytes(int(nb_sum == 2 or (nb_sum > 2 and spin == 0) or (nb_sum < 2 and spin == 1))
+                 if nb_sum <= 4 else 0
+                 for spin in (0, 1) for nb_sum in range(1 << SPIN_BIT))
+
 
 class GlauberSimBitArray(GlauberSim, ABC):
 
-    def __init__(self, *args, **kwargs) -> None:
+    # if set, a torus is stored with ghost cells, see HaloBitArrayMat
+    halo = False
+
+    def __init__(self, *args, neighbor_counts=False, bitmap_archive=False, bitmap_cube=False, **kwargs) -> None:
+        """If neighbor_counts is set, the sum of the neighbors of every vertex is kept in a field that is
+        updated when a vertex flips, instead of reading the four neighbors from the matrix for every update.
+        If bitmap_archive is set, the bitmaps go into one SnapshotArchive in the bitmap dir instead of one
+        iter-<i>.bmp file each. If bitmap_cube is set, they go into a SnapshotCube for analysis, next to the
+        archive if both are set"""
         super().__init__(*args, **kwargs)
+        self.neighbor_counts = neighbor_counts
+        self.counts = None
+        self.bitmap_archive = bitmap_archive
+        self.archive = None
+        self.bitmap_cube = bitmap_cube
+        self.cube = None
 
         with open(f"{self.bitmap_dir}/params.json", "w") as f:
             params = kwargs.copy()
-            params.update({"n_outer": self.n_outer})
+            # the state of another simulator lives in memory only
+            params.pop("initial_state", None)
+            params.update({"n_outer": self.n_outer, "neighbor_counts": self.neighbor_counts,
+                           "bitmap_archive": self.bitmap_archive, "bitmap_cube": self.bitmap_cube})
             json.dump(params, f)
 
     def setup_matrix(self) -> None:
-        self.matrix = np.random.binomial(n=1, p=self.p, size=self.n_outer**2).astype(np.bool_)
-        self.matrix = self.matrix.reshape((self.n_outer, self.n_outer))
-        
-
-        if self.boundary == 0 or self.boundary == 1:
-            self.matrix[0, :] = self.boundary
-            self.matrix[-1, :] = self.boundary
-            self.matrix[:, 0] = self.boundary
-            self.matrix[:, -1] = self.boundary
+        """Draws the initial spins block of rows by block of rows straight into packed bits, so only a block is
+        ever unpacked. The blocks take the same draws from the generator as drawing all spins at once"""
+        fixed_boundary = self.boundary == 0 or self.boundary == 1
+        if fixed_boundary:
             self.logger.info(f"Set up boundary as {self.boundary}")
         elif self.boundary == "random":
             self.logger.info("Setting up random boundary")
         else:
-            self.error(f"Boundary {self.boundary} not recognized, leaving random")
+            self.logger.error(f"Boundary {self.boundary} not recognized, leaving random")
 
-        self.matrix = BitArrayMat(self.n_outer, self.n_outer, self.matrix.flatten().tolist(), 
-                                  wraparound_indices=self.wrap_indices)
+        n = self.n_outer
+        rows_per_chunk = max(1, INIT_CHUNK // n)
+        bits = ba(endian="big")
+        for start in range(0, n, rows_per_chunk):
+            stop = min(start + rows_per_chunk, n)
+            spins = self.rng.binomial(n=1, p=self.p, size=(stop - start, n)).astype(np.uint8)
+            if fixed_boundary:
+                spins[:, 0] = self.boundary
+                spins[:, -1] = self.boundary
+                if start == 0:
+                    spins[0, :] = self.boundary
+                if stop == n:
+                    spins[-1, :] = self.boundary
+            bits += pack_bits(spins)
+
+        self.matrix = self.matrix_class().from_bits(n, n, bits, wraparound_indices=self.wrap_indices)
+
+    def matrix_class(self) -> type:
+        if self.wrap_indices and self.halo:
+            return HaloBitArrayMat
+        return BitArrayMat
 
     def setup_interior_mask(self) -> None:
         # make a bitarray for the mask for the inner lattice
@@ -50,12 +96,142 @@ class GlauberSimBitArray(GlauberSim, ABC):
             interior_mask = np.ones((self.n_outer, self.n_outer), dtype=np.bool_)
 
         # make a bitarray
-        self.interior_mask =  ba(interior_mask.flatten().tolist())
+        self.interior_mask = pack_bits(interior_mask)
         if DEBUG:
             self.logger.debug(f"Interior Mask: \n {self.interior_mask.to01()}")
 
+    def neighbor_sum_array(self, spins: np.ndarray) -> np.ndarray:
+        """sum of the four neighbors of every vertex of the (n_outer, n_outer) array spins, built from shifted
+        views of the whole lattice. On a square, the vertices outside of it count as 0"""
+        return neighbor_sum_field(spins, self.wrap_indices)
+
+    def can_ever_flip(self) -> np.ndarray:
+        """Boolean (n_outer, n_outer) array that is False on the boundary of a square, which never flips"""
+        mask = np.ones((self.n_outer, self.n_outer), dtype=np.bool_)
+        if not self.wrap_indices:
+            mask[0, :] = False
+            mask[-1, :] = False
+            mask[:, 0] = False
+            mask[:, -1] = False
+        return mask
+
+    def active_mask(self) -> np.ndarray:
+        """Boolean (n_outer, n_outer) array that is True for every vertex that can flip, i.e. that is tied or
+        disagrees with the majority of its neighbors. Uses shifted views of the whole lattice instead of
+        looking at the vertices one by one. On a square, the boundary never flips.
+
+        The rule is applied to the rows as words of 64 vertices, with the neighbor counts as bit planes, see
+        neighbor_masks, and only the result is unpacked"""
+        words = self.matrix.row_words()
+        at_least_3, at_most_1, exactly_2 = neighbor_masks(words, self.n_outer, self.wrap_indices)
+        mask = unpack_words(exactly_2 | (at_least_3 & ~words) | (at_most_1 & words), self.n_outer)
+        return mask & self.can_ever_flip()
+
+    def active_sites(self, sites: np.ndarray) -> np.ndarray:
+        """active_mask() at the flat ids sites only, with one batch of reads from the matrix instead of unpacking
+        the whole lattice"""
+        spins = self.matrix.gather(sites)
+        nb_sum = self.matrix.neighbor_sum(sites)
+        mask = (nb_sum == 2) | ((nb_sum > 2) & (spins == 0)) | ((nb_sum < 2) & (spins == 1))
+        if not self.wrap_indices:
+            rows, cols = np.divmod(sites, self.n_outer)
+            mask &= (rows > 0) & (rows < self.n_outer - 1) & (cols > 0) & (cols < self.n_outer - 1)
+        return mask
+
+    def stationary_outcome(self, target: int):
+        """Checks the whole lattice for states from which the run can never reach fixation. OUTCOME_FROZEN if no
+        vertex can flip, like in a stripe. Otherwise, the vertices that may ever flip again are found by starting
+        from those that can flip now and adding every vertex with at most two neighbors of its own spin that are
+        not in the set yet, until no vertex is added. All other vertices keep their spin forever, so the count of
+        +1 vertices can only move by the number of vertices in the set. OUTCOME_CONFINED if that is not enough
+        to reach the tolerance, e.g. for ties that flip back and forth in a striped state"""
+        may_flip = self.active_mask()
+        if not may_flip.any():
+            return OUTCOME_FROZEN
+
+        spins = self.matrix.to_numpy()
+        candidates = self.can_ever_flip()
+        interior = np.frombuffer(self.interior_mask.unpack(), dtype=np.bool_).reshape(spins.shape)
+        while True:
+            # the count is smallest if all vertices that may flip end up 0 and largest if they end up 1
+            fixed_ones = int((~may_flip & interior & (spins == 1)).sum())
+            if (fixed_ones + (may_flip & interior).sum() >= self.tol * target
+                    or fixed_ones <= (1 - self.tol) * target):
+                return None
+
+            agree = np.where(spins == 1,
+                             self.neighbor_sum_array((~may_flip & (spins == 1)).astype(spins.dtype)),
+                             self.neighbor_sum_array((~may_flip & (spins == 0)).astype(spins.dtype)))
+            added = (agree <= 2) & candidates & ~may_flip
+            if not added.any():
+                return OUTCOME_CONFINED
+            may_flip |= added
+
+    def count_field(self) -> np.ndarray:
+        """flat uint8 array of the entries of the neighbor count field, computed from the matrix"""
+        spins = self.matrix.to_numpy()
+        return (self.matrix.neighbor_sum_field() | (spins << SPIN_BIT)).astype(np.uint8).ravel()
+
+    def setup_neighbor_counts(self) -> None:
+        if not self.neighbor_counts:
+            self.counts = None
+            return
+        # a bytearray, because single entries of it are much faster to read and write from python than
+        # those of a numpy array
+        self.counts = bytearray(self.count_field().tobytes())
+
+    def compute_neighbor_sum(self, index: tuple) -> int:
+        if self.counts is not None:
+            # from the neighbor count field
+            return self.counts[self.site_id(index)] & 7
+        return super().compute_neighbor_sum(index)
+
+    def neighbor_ids(self, site: int) -> tuple:
+        """flat ids of the four neighbors of the vertex with flat id site, wrapped around onto the lattice. On a
+        square, only valid for the vertices that can flip"""
+        n = self.n_outer
+        r, c = divmod(site, n)
+        return (r - 1) % n * n + c, (r + 1) % n * n + c, r * n + (c - 1) % n, r * n + (c + 1) % n
+
+    def can_flip(self, site: int) -> bool:
+        """True if the vertex with flat id site can flip, from the neighbor count field"""
+        return CAN_FLIP[self.counts[site]]
+
+    def site_id(self, index: tuple) -> int:
+        """flat id of the vertex at index in row-major order, on a torus wrapped around once"""
+        if self.wrap_indices:
+            return (index[0] % self.n_outer) * self.n_outer + index[1] % self.n_outer
+        return index[0] * self.n_outer + index[1]
+
+    def set_vertex(self, index: tuple, value: int) -> bool:
+        if self.counts is None:
+            return super().set_vertex(index, value)
+
+        site = self.site_id(index)
+        entry = self.counts[site]
+        if (entry >> SPIN_BIT) == value:
+            return False
+        super().set_vertex(index, value)
+        self.counts[site] = entry ^ (1 << SPIN_BIT)
+        step = 1 if value else -1
+        counts = self.counts
+        for neighbor in self.neighbor_ids(site):
+            counts[neighbor] += step
+        return True
+
+    def check_n_ones(self, i) -> None:
+        super().check_n_ones(i)
+        if self.counts is not None and not np.array_equal(np.frombuffer(self.counts, dtype=np.uint8),
+                                                          self.count_field()):
+            self.logger.error(f"Neighbor count field differs from the matrix at iteration {i}")
+            raise RuntimeError(f"Neighbor count field differs from the matrix at iteration {i}")
+
     def load_checkpoint_index(self) -> np.ndarray:
         self.logger.info("Loading checkpoint index")
+        reader = self.checkpoint_store()
+        if reader is not None:
+            # the latest snapshot in the archive or cube
+            return reader.iterations()[-1]
         last_index = self.checkpoint_file.split("-")[-1].split(".")[0]
         last_index = int(last_index)
         self.logger.info(f"Last index: {last_index}")
@@ -63,33 +239,118 @@ class GlauberSimBitArray(GlauberSim, ABC):
 
     def save_bitmap(self, iter: int) -> None:
         self.logger.debug(f"saving bitmap for iteration {iter}")
-        self.matrix.export_to_file(self.bitmap_dir + f"/iter-{iter}.bmp")
+        # the same bytes as BitArrayMat.export_to_file, copied so the writer does not see later updates
+        data = self.matrix.bits().tobytes()
+
+        stores = []
+        if self.bitmap_archive:
+            if self.archive is None:
+                self.archive = SnapshotArchive(os.path.join(self.bitmap_dir, ARCHIVE_FILE), self.n_outer, self.n_outer)
+            stores.append(self.archive)
+        if self.bitmap_cube:
+            if self.cube is None:
+                self.cube = SnapshotCube(os.path.join(self.bitmap_dir, CUBE_FILE), self.n_outer, self.n_outer)
+            stores.append(self.cube)
+
+        if len(stores) > 0:
+            def write():
+                for store in stores:
+                    store.append(iter, data)
+        else:
+            path = self.bitmap_dir + f"/iter-{iter}.bmp"
+
+            def write():
+                with atomic_open(path) as f:
+                    f.write(data)
+
+        self.writer.submit(write)
+
+    def save_state_checkpoint(self, i) -> None:
+        """Writes checkpoint_state() after iteration i to state-<i>.npz: the arrays (the packed matrix, the trace and
+        the indices) as they are and everything else as json. The file replaces the previous state checkpoint
+        atomically, so there is always one complete checkpoint to continue from. All arrays are copies, the
+        writer may only get to them after the next updates"""
+        state = self.checkpoint_state()
+        matrix = state.pop("matrix")
+        trace = state.pop("trace")
+
+        arrays = {"matrix": np.frombuffer(matrix.bits().tobytes(), dtype=np.uint8)}
+        arrays.update({"trace_" + key: value.copy() for key, value in trace.to_arrays(i + 1).items()})
+        arrays.update({key: state.pop(key) for key in list(state) if isinstance(state[key], np.ndarray)})
+        arrays["meta"] = np.array(json.dumps(state))
+
+        path = os.path.join(self.bitmap_dir, STATE_FILE.format(i))
+        previous = self.state_file
+        self.state_file = path
+        self.logger.debug(f"saving state checkpoint for iteration {i}")
+
+        def write():
+            with atomic_open(path) as f:
+                np.savez(f, **arrays)
+            if previous is not None and previous != path and os.path.exists(previous):
+                os.remove(previous)
+
+        self.writer.submit(write)
+
+    def load_state_checkpoint(self, path) -> int:
+        self.logger.info(f"Loading state checkpoint from {path}")
+        with np.load(path) as data:
+            state = json.loads(str(data["meta"]))
+            state.update({key: data[key] for key in data.files if key != "meta"})
+
+        n_bits = self.n_outer**2
+        spins = np.unpackbits(state.pop("matrix"), count=n_bits).reshape((self.n_outer, self.n_outer))
+        state["matrix"] = self.matrix_class()(self.n_outer, self.n_outer, wraparound_indices=self.wrap_indices)
+        state["matrix"].set_bits(spins)
+        state["trace"] = EventTrace.from_arrays(state.pop("trace_steps"), state.pop("trace_signs"),
+                                                state.pop("trace_header"))
+        return self.restore_checkpoint_state(state)
+
+    def checkpoint_store(self):
+        """reader of the checkpoint file if it is a SnapshotArchive or a SnapshotCube, otherwise None"""
+        if is_archive(self.checkpoint_file):
+            return SnapshotReader(self.checkpoint_file)
+        if is_cube(self.checkpoint_file):
+            return CubeReader(self.checkpoint_file)
+        return None
 
     def load_checkpoint_matrix(self) -> BitArrayMat:
         self.logger.info(f"Loading checkpoint matrix from {self.checkpoint_file}")
-        matrix = BitArrayMat(self.n_outer, self.n_outer, 
-                             wraparound_indices=self.wrap_indices)
+        matrix = self.matrix_class()(self.n_outer, self.n_outer, 
+                                     wraparound_indices=self.wrap_indices)
         try:
-            matrix.load_from_file(self.checkpoint_file)
+            reader = self.checkpoint_store()
+            if reader is not None:
+                matrix.load_bytes(reader.get(reader.iterations()[-1]).bits().tobytes())
+            else:
+                matrix.load_from_file(self.checkpoint_file)
         except FileNotFoundError:
             self.logger.error("Checkpoint file not found")
             raise FileNotFoundError
         return matrix
     
-    def load_checkpoint_vector(self, last_index):
-        self.logger.info(f"Loading checkpoint vector from {self.cp_result_file}")
-        vector = np.ones(self.t) * np.int64(-1)
+    def load_checkpoint_trace(self, last_index) -> EventTrace:
+        self.logger.info(f"Loading checkpoint trace from {self.cp_result_file}")
         
         try:
             with open(self.cp_result_file, "r") as f:
                 cp_result = json.load(f)
-            cp_vector = np.array(cp_result["vector"])
         except FileNotFoundError:
             self.logger.error("Checkpoint file not found")
             raise FileNotFoundError
 
-        vector[0:last_index] = cp_vector[0:last_index]
-        return vector
+        if "trace_file" in cp_result:
+            trace = EventTrace.load(os.path.join(os.path.dirname(self.cp_result_file), cp_result["trace_file"]))
+        else:
+            # result of a run from before the traces were event encoded
+            trace = EventTrace.from_dense(cp_result["vector"], self.n_interior**2)
+
+        # the checkpoint matrix already has the update of iteration last_index
+        trace.truncate(last_index + 1)
+        return trace
     
     def sum_ones(self) -> int:
-        return self.matrix.arr[self.interior_mask].count(1)
\ No newline at end of file
+        return self.matrix.bits()[self.interior_mask].count(1)
+
+    def is_interior(self, index: tuple) -> bool:
+        return self.interior_mask[self.matrix.flat(index[0], index[1])]
\ No newline at end of file
@@ -3,11 +3,14 @@ from .glauberDynIndices import GlauberSimDynIndices
 from .glauberFixIndices import GlauberSimulatorFixIndices
 from .glauberSim import GlauberSim
 from .DataStructs.ListDict import ListDict
+from .DataStructs.SiteStream import SiteStream
 import numpy as np
 
 
 class GlauberFixedIndexTorus(GlauberSimulatorFixIndices):
 
+    halo = True
+
     def __init__(self, *args, **kwargs) -> None:
         kwargs["boundary"] = "random"
         kwargs["padding"] = 0
@@ -15,52 +18,46 @@ class GlauberFixedIndexTorus(GlauberSimulatorFixIndices):
         self.wrap_indices = True
 
     def setup_indices(self) -> None:
-        # list of indices we want to look at -> all except boundary points
-        # remember that self.t is the number of iterations
-        # Hence may not have index zero or the last elements
-        self.indices = np.random.randint(0, self.n_outer , size=2 * self.t).reshape((self.t, 2))
-        
-    def setup_indices(self) -> None:
-        # list of indices we want to look at -> all except boundary points
-        # remember that self.t is the number of iterations
-        # Hence may not have index zero or the last elements
-        self.indices = np.random.randint(0, self.n_outer, size=2 * self.t).reshape((self.t, 2))
+        # stream of the indices we want to look at -> all points, there is no boundary
+        self.indices = SiteStream(self.site_seed_sequence, self.n_outer, 0, self.n_outer, self.t)
+
+    def compute_neighbor_sum(self, index: tuple) -> int:
+        if self.halo and self.counts is None:
+            return self.matrix.neighbor_sum_at(index[0], index[1])
+        return super().compute_neighbor_sum(index)
 
     
 class GlauberDynIndexTorus(GlauberSimDynIndices):
 
+    halo = True
+
     def __init__(self, *args, **kwargs) -> None:
         kwargs["boundary"] = "random"
         kwargs["padding"] = 0
         super().__init__(*args, **kwargs)
         self.wrap_indices = True
 
-    def setup_indices(self) -> None:
-        self.indices = ListDict(self.n_outer, self.n_outer)
-
-        for i in range(0, self.n_outer):
-            for j in range(0, self.n_outer):
-                nb_sum = (
-                    self.matrix[i - 1, j]
-                    + self.matrix[i + 1, j]
-                    + self.matrix[i, j - 1]
-                    + self.matrix[i, j + 1]
-                )
-
-                # if more than half of neighbors are different, can flip
-                if nb_sum > 2 and self.matrix[i, j] == 0:
-                    self.indices.add((i, j))
-                elif nb_sum < 2 and self.matrix[i, j] == 1:
-                    self.indices.add((i, j))
-
-                # if there is a tie, can also flip.
-                elif nb_sum == 2:
-                    self.indices.add((i, j))   
+    def compute_neighbor_sum(self, index: tuple) -> int:
+        if self.halo and self.counts is None:
+            return self.matrix.neighbor_sum_at(index[0], index[1])
+        return super().compute_neighbor_sum(index)
+
+    def neighbor_sites(self, index: tuple) -> list:
+        """flat ids of all four neighbors, wrapped around onto the lattice"""
+        return [self.site_id((index[0] + 1, index[1])), self.site_id((index[0], index[1] + 1)),
+                self.site_id((index[0] - 1, index[1])), self.site_id((index[0], index[1] - 1))]
 
     def add_dyn_neighbors_to_indices(self, index: tuple) -> None:
         """adds the dynamic (i.e., not fixated) neighbors of the given index to the indices to be updated
-        TODO: An alternative idea would be to always add all neighbors, but to periodically remove fixated ones, purge after a certain number has been requested, etc.
         """
+        if self.purge_interval is not None:
+            # lazy deletion, see GlauberSimDynIndices.get_index
+            self.indices.extend(self.neighbor_sites(index))
+            return
+        if self.counts is not None:
+            self.add_counted_neighbors(index)
+            return
+
         neighbors = (
                         (index[0] + 1, index[1]),
                         (index[0], index[1] + 1),
@@ -70,26 +67,24 @@ class GlauberDynIndexTorus(GlauberSimDynIndices):
         
         for neighbor in neighbors:
             
-            # allow neighbors one unit wrapped around to be added
-            if -1 <= neighbor[0] <= self.n_outer  and -1 <= neighbor[1] <= self.n_outer:
-            
-                x = neighbor[0]
-                y = neighbor[1]
-                nb_sum = (
-                    self.matrix[x - 1, y]
-                    + self.matrix[x + 1, y]
-                    + self.matrix[x , y - 1]
-                    + self.matrix[x , y + 1]
-                )
-
-                # if more than half of neighbors are different, can flip
-                if nb_sum > 2 and self.matrix[x, y] == 0:
-                    self.indices.add(neighbor)
-                elif nb_sum < 2 and self.matrix[x, y] == 1:
-                    self.indices.add(neighbor)
-                # if there is a tie, can also flip.
-                elif nb_sum == 2:
-                    self.indices.add(neighbor)  
+            # neighbors one unit outside the lattice are wrapped around onto it, so they get one id
+            x = neighbor[0] % self.n_outer
+            y = neighbor[1] % self.n_outer
+            nb_sum = (
+                self.matrix[x - 1, y]
+                + self.matrix[x + 1, y]
+                + self.matrix[x , y - 1]
+                + self.matrix[x , y + 1]
+            )
+
+            # if more than half of neighbors are different, can flip
+            if nb_sum > 2 and self.matrix[x, y] == 0:
+                self.indices.add(x * self.n_outer + y)
+            elif nb_sum < 2 and self.matrix[x, y] == 1:
+                self.indices.add(x * self.n_outer + y)
+            # if there is a tie, can also flip.
+            elif nb_sum == 2:
+                self.indices.add(x * self.n_outer + y)  
 
 
     
\ No newline at end of file
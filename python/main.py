@@ -15,6 +15,15 @@ from glauber.glauberFixIndices import GlauberSimulatorFixIndices
 from glauber.glauberDynIndices import GlauberSimDynIndices
 from glauber.glauberTorus import GlauberFixedIndexTorus
 from glauber.glauberTorus import GlauberDynIndexTorus
+from glauber.glauberNumba import GlauberFixIndicesNumba, GlauberDynIndicesNumba
+from glauber.glauberNumba import GlauberFixedIndexTorusNumba, GlauberDynIndexTorusNumba
+from glauber.glauberNumba import GlauberGeometricIndices, GlauberGeometricTorus
+from glauber.glauberNumba import GlauberAdaptiveIndices, GlauberAdaptiveTorus
+from glauber.glauberReplicas import GlauberReplicas, GlauberReplicasTorus
+from glauber.glauberMultiSpin import GlauberMultiSpin, GlauberMultiSpinTorus, MAX_REPLICAS
+from glauber.glauberSim import is_state_checkpoint
+from glauber.DataStructs.SnapshotArchive import ARCHIVE_FILE
+from glauber.DataStructs.SnapshotCube import CUBE_FILE
 
 RESULT_DIR = "./results/"
 
@@ -32,14 +41,68 @@ parser.add_argument("--tol", help="Tolerance to determine fixation")
 parser.add_argument("--dynamic", help="if true, use dynamic indices", action="store_true")
 parser.add_argument("--mixed", help="if true, use first fixed and then dynamci indices", action="store_true")
 parser.add_argument("--fixed_steps", help="if mixed, how many steps to run fixed indices for")
+parser.add_argument("--purge_interval", help="if set, dynamic indices use lazy deletion and are purged every this many steps")
+parser.add_argument("--adaptive", help="if true, switch from fixed to dynamic indices when few vertices can flip",
+                    action="store_true")
+parser.add_argument("--switch_fraction", help="if adaptive, share of vertices that can flip below which to switch")
 parser.add_argument("--random_boundary", help="if set, will set boundary to random values", action="store_true")
 parser.add_argument("--torus", help="if set, use a torus and not a square", action="store_true")
+parser.add_argument("--numba", help="if set, run the compiled numba engines", action="store_true")
+parser.add_argument("--geometric", help="if set, run fixed index time but skip the draws of frozen vertices",
+                    action="store_true")
+parser.add_argument("--replicas", help="if set, run this many repetitions in lockstep in one process (fixed indices only)")
+parser.add_argument("--multispin", help="if set, pack up to 64 repetitions into the bits of one lattice (fixed indices only)",
+                    action="store_true")
+parser.add_argument("--stationary_check", help="if set, check every this many steps whether a run is stuck in a state "
+                    "without fixation (frozen or only blinking ties) and stop it early")
+parser.add_argument("--neighbor_counts", help="if set, keep the sum of the neighbors of every vertex instead of reading them "
+                    "(python engines only)", action="store_true")
+parser.add_argument("--bitmap_archive", help="if set, store the bitmaps of a repetition as keyframes and deltas in one "
+                    "compressed archive instead of one file each", action="store_true")
+parser.add_argument("--bitmap_cube", help="if set, store the bitmaps of a repetition in one file at a fixed stride, "
+                    "to memory map it for analysis", action="store_true")
+parser.add_argument("--checkpoint_queue", help="if set, write checkpoints in a background thread and let at most this "
+                    "many wait to be written")
+
+
+# the geometric skipping and the adaptive switch only exist as compiled engines
+classes_square = {"fix": GlauberSimulatorFixIndices, "dyn": GlauberSimDynIndices, "geo": GlauberGeometricIndices,
+                  "adaptive": GlauberAdaptiveIndices}
+classes_torus = {"fix": GlauberFixedIndexTorus, "dyn": GlauberDynIndexTorus, "geo": GlauberGeometricTorus,
+                 "adaptive": GlauberAdaptiveTorus}
 
+classes = {"square": classes_square, "torus": classes_torus}
 
-classes_square = {"fix": GlauberSimulatorFixIndices, "dyn": GlauberSimDynIndices}
-classes_torus = {"fix": GlauberFixedIndexTorus, "dyn": GlauberDynIndexTorus}
+numba_classes_square = {"fix": GlauberFixIndicesNumba, "dyn": GlauberDynIndicesNumba, "geo": GlauberGeometricIndices,
+                        "adaptive": GlauberAdaptiveIndices}
+numba_classes_torus = {"fix": GlauberFixedIndexTorusNumba, "dyn": GlauberDynIndexTorusNumba,
+                       "geo": GlauberGeometricTorus, "adaptive": GlauberAdaptiveTorus}
 
-classes = {"square": classes_square, "torus": classes_torus}
+numba_classes = {"square": numba_classes_square, "torus": numba_classes_torus}
+
+replica_classes = {"square": GlauberReplicas, "torus": GlauberReplicasTorus}
+multispin_classes = {"square": GlauberMultiSpin, "torus": GlauberMultiSpinTorus}
+
+
+def last_bitmap(files):
+    """the file with the latest bitmap among the files of a bitmap dir, the iter-<i>.bmp with the largest i or
+    the archive or cube of the bitmaps"""
+    bitmaps = [(int(x.split('-')[1].split('.')[0]), x) for x in files if x.endswith('.bmp')]
+    if len(bitmaps) == 0:
+        for store in (ARCHIVE_FILE, CUBE_FILE):
+            if store in files:
+                return store
+    return max(bitmaps)[1]
+
+
+def state_iteration(file):
+    """the iteration i of a state-<i>.npz"""
+    return int(os.path.basename(file).split('-')[1].split('.')[0])
+
+
+def last_state(states):
+    """the state-<i>.npz with the largest i among the state checkpoints of a bitmap dir"""
+    return max(states, key=state_iteration)
 
 
 class Main:
@@ -48,6 +111,16 @@ class Main:
         
         self.args = parser.parse_args(arguments )
 
+        if self.args.numba:
+            self.classes = numba_classes
+        else:
+            self.classes = classes
+
+        if self.args.multispin:
+            self.replica_classes = multispin_classes
+        else:
+            self.replica_classes = replica_classes
+
         overwrite_result_dir = kwargs.get("result_dir", None)
 
         self.now = datetime.datetime.now()
@@ -90,30 +163,63 @@ class Main:
             json.dump(self.args.__dict__, f)
             
     def create_and_submit(self, structure, indexing, *args, **kwargs):
-        sim = classes[structure][indexing](*args, **kwargs)
+        sim = self.classes[structure][indexing](*args, **kwargs)
         self.logger.info("created simulator")
         result = sim.run_single_glauber(verbose=True)
         self.logger.info("simulator has finished")
         return result
 
+    def create_and_run_replicas(self, structure, *args, **kwargs):
+        sim = self.replica_classes[structure](*args, **kwargs)
+        self.logger.info(f"created simulator for {sim.n_replicas} replicas")
+        results = sim.run_replicas(verbose=True)
+        self.logger.info("replicas have finished")
+        return results
+
     def create_fixed_and_then_dynamic(self, structure, fixed_steps, *args, **kwargs):
+        checkpoint_file = kwargs.get("checkpoint_file")
+        if is_state_checkpoint(checkpoint_file) and state_iteration(checkpoint_file) >= fixed_steps:
+            # the state checkpoint is from the dynamic simulator, it continues from it on its own
+            self.logger.info("state checkpoint is past the fixed steps, skipping the fixed simulator")
+            sim = self.classes[structure]["dyn"](*args, **kwargs)
+            result = sim.run_single_glauber(verbose=True)
+            self.logger.info("second simulator has finished")
+            return result
+
         fixed_args = kwargs.copy()
         fixed_args["t"] = fixed_steps
-        sim1 = classes[structure]["fix"](*args, **fixed_args)
+        fixed_args.pop("purge_interval", None)
+        sim1 = self.classes[structure]["fix"](*args, **fixed_args)
         self.logger.info("created fixed simulator for first steps")
         result1 = sim1.run_single_glauber(verbose=True)
         self.logger.info("first simulator has finished")
         
-        checkpoint_file = os.path.join(sim1.results_dir, "bitmap_results", f"iter-{result1['iterations']}.bmp")
-        result_file = os.path.join(sim1.results_dir, "result-dict.json")
-        kwargs["checkpoint_file"] = checkpoint_file
-        kwargs["cp_result_file"] = result_file
-        sim2  = classes[structure]["dyn"](*args, **kwargs)
+        if sim1.final_state is not None:
+            # hand the lattice, trace and random state over in memory
+            kwargs["initial_state"] = sim1.final_state
+            kwargs["checkpoint_file"] = None
+            kwargs["cp_result_file"] = None
+        else:
+            # the first simulator only loaded a checkpoint that was already done, continue from that
+            checkpoint_file = os.path.join(sim1.results_dir, "bitmap_results", f"iter-{result1['iterations']}.bmp")
+            result_file = os.path.join(sim1.results_dir, "result-dict.json")
+            kwargs["checkpoint_file"] = checkpoint_file
+            kwargs["cp_result_file"] = result_file
+        sim2  = self.classes[structure]["dyn"](*args, **kwargs)
+        # the second simulator replaces the state checkpoint of the first one, so only the latest is kept
+        sim2.state_file = sim1.state_file
         self.logger.info("created second simulator for dynamic steps")
         result = sim2.run_single_glauber(verbose=True)
         self.logger.info("second simulator has finished")
         return result
 
+    def replica_ignored_flags(self) -> list:
+        """the flags that are set but have no effect on a run of replicas in lockstep"""
+        flags = {"--stationary_check": self.args.stationary_check, "--checkpoint_queue": self.args.checkpoint_queue,
+                 "--bitmap_archive": self.args.bitmap_archive, "--bitmap_cube": self.args.bitmap_cube,
+                 "--neighbor_counts": self.args.neighbor_counts}
+        return [flag for flag, value in flags.items() if value is not None and value is not False]
+
     def find_last_run(self):
         format = "%m%d_%H-%M-%S"
 
@@ -183,6 +289,10 @@ class Main:
             indexing = "dyn"
         elif self.args.mixed:
             indexing = "mixed"
+        elif self.args.geometric:
+            indexing = "geo"
+        elif self.args.adaptive:
+            indexing = "adaptive"
         else:
             indexing = "fix"
 
@@ -191,10 +301,49 @@ class Main:
         else:
             structure = "square"
 
+        replicas = 1 if self.args.replicas is None else int(self.args.replicas)
+        if self.args.multispin:
+            replicas = MAX_REPLICAS if self.args.replicas is None else min(replicas, MAX_REPLICAS)
+        if replicas > 1 and indexing != "fix":
+            self.logger.info("replicas are only implemented for fixed indices, running one process per repetition")
+            replicas = 1
+        if replicas > 1 and any(w is not None for w in warmstarts):
+            self.logger.info("replicas can not start from checkpoints, running one process per repetition")
+            replicas = 1
+
+        if replicas > 1 and len(self.replica_ignored_flags()) > 0:
+            self.logger.warning("the replica engines do not support " + ", ".join(self.replica_ignored_flags()) +
+                                ", ignoring them")
+
+        if replicas > 1:
+            replica_blocks = [range(i, min(i + replicas, iterations)) for i in range(0, iterations, replicas)]
+            single_runs = []
+        else:
+            replica_blocks = []
+            single_runs = range(iterations)
+
         futures = []
         with fts.ProcessPoolExecutor(max_workers=mp.cpu_count()) as executor:
 
-            for i in range(iterations):
+            for block in replica_blocks:
+                rds = [self.result_dir + 'rep-' + str(k) for k in block]
+                run_args = {"padding" : padding,
+                        "n_interior" : n_interior,
+                        "p" : p,
+                        "t" : t,
+                        "tol" : tol,
+                        "results_dirs" : rds,
+                        "save_bitmaps_every" : checkpoint_int,
+                        "random_seed" : block.start,
+                        }
+                if random_boundary:
+                    run_args["boundary"] = "random"
+
+                future = executor.submit(self.create_and_run_replicas, structure, **run_args)
+                self.logger.info(f"submitted replica run for repetitions {block.start} to {block.stop - 1}")
+                futures.append(future)
+
+            for i in single_runs:
                 rd = self.result_dir + 'rep-' + str(i)
                 os.makedirs(rd, exist_ok=True)
                 run_args =  {"padding" : padding,
@@ -211,6 +360,27 @@ class Main:
                 if random_boundary:
                     run_args["boundary"] = "random"
                     
+                if indexing in ("dyn", "mixed") and self.args.purge_interval is not None:
+                    run_args["purge_interval"] = int(self.args.purge_interval)
+
+                if self.args.neighbor_counts:
+                    run_args["neighbor_counts"] = True
+
+                if self.args.stationary_check is not None:
+                    run_args["stationary_check_every"] = int(self.args.stationary_check)
+
+                if self.args.bitmap_archive:
+                    run_args["bitmap_archive"] = True
+
+                if self.args.bitmap_cube:
+                    run_args["bitmap_cube"] = True
+
+                if self.args.checkpoint_queue is not None:
+                    run_args["checkpoint_queue"] = int(self.args.checkpoint_queue)
+
+                if indexing == "adaptive" and self.args.switch_fraction is not None:
+                    run_args["switch_fraction"] = float(self.args.switch_fraction)
+
                 if indexing == "mixed":
                     run_args["fixed_steps"] = int(self.args.fixed_steps)
                     future = executor.submit(self.create_fixed_and_then_dynamic, structure, **run_args)
@@ -297,11 +467,7 @@ class Main:
                 self.logger.info("checkpoint does not have same number of runs, starting all from the same")
                 # first, the bitmaps for warmstart
                 dir = os.path.join(checkpoint_runs[0], 'bitmap_results')
-                bitmaps = os.listdir(dir)
-                bitmaps = [x for x in bitmaps if x.endswith('.bmp')]
-                bitmaps.sort()
-                last_bitmap = bitmaps[-1]
-                bm_warmstarts = [os.path.join(dir, last_bitmap)] * ITERATIONS
+                bm_warmstarts = [os.path.join(dir, last_bitmap(os.listdir(dir)))] * ITERATIONS
                 
                 # now the result dict for warmstart
                 file = os.path.join(checkpoint_runs[0], 'result-dict.json')
@@ -313,14 +479,12 @@ class Main:
                 vec_warmstarts = []
                 for run in checkpoint_runs:
                     
-                    # first the bitmaps
+                    # first the bitmaps, or the state checkpoint, which continues the run exactly
                     dir = os.path.join(run ,'bitmap_results')
                     files = os.listdir(dir)
-                    bitmaps = [x for x in files if x.endswith('.bmp')]
-                    bitmaps = [(int(x.split('-')[1].split('.')[0]), x) for x in bitmaps]
-                    bitmaps.sort()
-                    last_bitmap = bitmaps[-1][1]
-                    bm_warmstarts.append(os.path.join(dir, last_bitmap))
+                    states = [x for x in files if is_state_checkpoint(x)]
+                    last = last_state(states) if len(states) > 0 else last_bitmap(files)
+                    bm_warmstarts.append(os.path.join(dir, last))
                     
                     # now the vector
                     file = os.path.join(run, 'result-dict.json')
@@ -0,0 +1,306 @@
+"""You can not run these test from the terminal through python. Need to run pytest directly"""""
+
+from glauber.DataStructs.SiteStream import SiteStream
+from glauber.DataStructs.EventTrace import EventTrace
+import numpy as np
+import pytest
+import os
+
+
+def test_site_stream_reproducible():
+    stream_1 = SiteStream(np.random.SeedSequence(7), 50, 1, 49, 100_000, chunk_size=1000)
+    stream_2 = SiteStream(np.random.SeedSequence(7), 50, 1, 49, 100_000, chunk_size=1000)
+
+    # random access gives the same as going through the stream in order
+    backwards = [stream_2[i] for i in range(99_999, -1, -1)][::-1]
+    forwards = [stream_1[i] for i in range(100_000)]
+    assert forwards == backwards
+
+    other_seed = SiteStream(np.random.SeedSequence(8), 50, 1, 49, 100_000, chunk_size=1000)
+    assert not np.array_equal(other_seed.get_chunk(0), stream_1.get_chunk(0))
+
+
+def test_site_stream_range():
+    stream = SiteStream(np.random.SeedSequence(0), 20, 1, 19, 5000, chunk_size=1024)
+    sites = np.concatenate([stream.get_chunk(k) for k in range(5)])
+
+    assert len(stream) == 5000 and sites.shape == (5000,)
+    assert stream.get_chunk(0).dtype == np.uint32
+
+    rows, cols = np.divmod(sites, 20)
+    assert rows.min() == 1 and rows.max() == 18
+    assert cols.min() == 1 and cols.max() == 18
+
+
+def test_event_trace_dense():
+    trace = EventTrace(target=10, initial=5)
+    for i, sign in ((0, 1), (3, -1), (4, -1), (8, 1)):
+        trace.record(i, sign)
+    trace.length = 9
+
+    dense = trace.dense(12)
+    np.testing.assert_array_equal(dense[:9], np.array([6, 6, 6, 5, 4, 4, 4, 4, 5]) / 10)
+    np.testing.assert_array_equal(dense[9:], [-1, -1, -1])
+    np.testing.assert_array_equal(trace.window(3, 6), dense[3:6])
+    np.testing.assert_array_equal(trace.window(7, 11), dense[7:11])
+
+    trace.truncate(4)
+    assert trace.n_events == 2 and len(trace) == 4
+    np.testing.assert_array_equal(trace.dense(), [0.6, 0.6, 0.6, 0.5])
+
+
+def test_event_trace_save_load(tmpdir):
+    trace = EventTrace(target=100, initial=40)
+    trace.extend(np.array([2, 7, 9]), np.array([1, 1, -1]))
+    trace.length = 50
+    trace.save(str(tmpdir) + "/trace.npz")
+
+    loaded = EventTrace.load(str(tmpdir) + "/trace.npz")
+    assert (loaded.target, loaded.initial, len(loaded)) == (100, 40, 50)
+    np.testing.assert_array_equal(loaded.dense(60), trace.dense(60))
+
+    # the old dense vectors convert without loss, resumed runs have single -1 gaps
+    vector = trace.dense(60)
+    vector[20] = -1
+    converted = EventTrace.from_dense(vector, 100)
+    assert converted.initial == 40 and len(converted) == 50
+    np.testing.assert_array_equal(converted.dense(60), trace.dense(60))
+
+
+def test_halo_matches_wraparound():
+    from glauber.DataStructs.BitArrayMat import BitArrayMat, HaloBitArrayMat
+    rng = np.random.default_rng(3)
+    spins = rng.integers(0, 2, 36).tolist()
+    plain = BitArrayMat(6, 6, spins, wraparound_indices=True)
+    halo = HaloBitArrayMat(6, 6, spins)
+
+    # writes on edges and corners have to reach the ghost cells
+    for r, c in ((0, 0), (5, 3), (-1, -1), (2, 6), (0, 5)):
+        plain[r, c] = 1 - plain[r, c]
+        halo[r, c] = plain[r, c]
+
+    np.testing.assert_array_equal(halo.to_numpy(), plain.to_numpy())
+    for r in range(-1, 7):
+        for c in range(-1, 7):
+            assert halo[r, c] == plain[r, c]
+    for r in range(6):
+        for c in range(6):
+            expected = plain[r - 1, c] + plain[r + 1, c] + plain[r, c - 1] + plain[r, c + 1]
+            assert halo.neighbor_sum_at(r, c) == expected
+
+
+def test_random_buffer_state():
+    import json
+    from glauber.DataStructs.RandomBuffer import RandomBuffer
+    buffer = RandomBuffer(np.random.default_rng(np.random.SeedSequence(11)), chunk_size=64)
+    for _ in range(100):
+        buffer.coin()
+        buffer.uniform()
+
+    # the state goes through json and continues the same draws in a new generator
+    state = json.loads(json.dumps(buffer.get_state()))
+    restored = RandomBuffer(np.random.default_rng(0), chunk_size=64)
+    restored.set_state(state)
+    assert [buffer.coin() for _ in range(200)] == [restored.coin() for _ in range(200)]
+    assert [buffer.uniform() for _ in range(200)] == [restored.uniform() for _ in range(200)]
+
+
+def snapshot_series(n, length, seed):
+    """lattices that differ in a few vertices from one to the next, like the late snapshots of a run"""
+    rng = np.random.default_rng(seed)
+    spins = rng.integers(0, 2, size=(n, n), dtype=np.uint8)
+    series = []
+    for _ in range(length):
+        flips = rng.integers(0, n, size=(3, 2))
+        spins[flips[:, 0], flips[:, 1]] ^= 1
+        series.append(spins.copy())
+    return series
+
+
+def test_snapshot_archive(tmpdir):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat
+    from glauber.DataStructs.SnapshotArchive import SnapshotArchive, SnapshotReader
+    path = str(tmpdir) + "/snapshots.arc"
+    series = snapshot_series(37, 20, 5)
+
+    archive = SnapshotArchive(path, 37, 37, keyframe_every=8)
+    for k, spins in enumerate(series):
+        matrix = BitArrayMat(37, 37)
+        matrix.set_bits(spins)
+        archive.append_matrix(100 * k, matrix)
+
+    reader = SnapshotReader(path)
+    assert reader.iterations() == [100 * k for k in range(20)]
+    # random access and going through in order agree with what was written
+    for k in (19, 0, 8, 7, 13):
+        np.testing.assert_array_equal(reader.get(100 * k).to_numpy(), series[k])
+    for (iteration, matrix), spins in zip(reader, series):
+        np.testing.assert_array_equal(matrix.to_numpy(), spins)
+
+    # the deltas take less space than the raw bitmaps
+    assert os.path.getsize(path) < 20 * len(BitArrayMat(37, 37).bits().tobytes())
+
+
+def test_snapshot_archive_cut_off(tmpdir):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat
+    from glauber.DataStructs.SnapshotArchive import SnapshotArchive, SnapshotReader
+    path = str(tmpdir) + "/snapshots.arc"
+    series = snapshot_series(20, 6, 6)
+
+    archive = SnapshotArchive(path, 20, 20)
+    for k, spins in enumerate(series[:4]):
+        matrix = BitArrayMat(20, 20)
+        matrix.set_bits(spins)
+        archive.append_matrix(k, matrix)
+
+    # a kill in the middle of the last record
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+    assert SnapshotReader(path).iterations() == [0, 1, 2]
+
+    # appending again drops the broken record and starts with a keyframe
+    archive = SnapshotArchive(path, 20, 20)
+    for k, spins in enumerate(series[3:], start=3):
+        matrix = BitArrayMat(20, 20)
+        matrix.set_bits(spins)
+        archive.append_matrix(k, matrix)
+    reader = SnapshotReader(path)
+    assert reader.iterations() == list(range(6))
+    for k, spins in enumerate(series):
+        np.testing.assert_array_equal(reader.get(k).to_numpy(), spins)
+
+    with pytest.raises(ValueError):
+        SnapshotArchive(path, 21, 21)
+
+
+def test_snapshot_cube(tmpdir):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat
+    from glauber.DataStructs.SnapshotCube import SnapshotCube, CubeReader, HEADER_SIZE
+    path = str(tmpdir) + "/snapshots.cube"
+    series = snapshot_series(13, 10, 7)
+
+    cube = SnapshotCube(path, 13, 13)
+    assert cube.stride % 8 == 0
+    for k, spins in enumerate(series):
+        matrix = BitArrayMat(13, 13)
+        matrix.set_bits(spins)
+        cube.append_matrix(10 * k, matrix)
+
+    reader = CubeReader(path)
+    assert reader.iterations() == [10 * k for k in range(10)]
+    np.testing.assert_array_equal(reader.spins(), np.array(series))
+    np.testing.assert_array_equal(reader.spins(30, 60), np.array(series[3:6]))
+
+    # views into the map, not copies
+    assert np.shares_memory(reader.stack(20, 50), reader.map)
+    matrix = reader.get(40)
+    assert matrix.arr.readonly
+    np.testing.assert_array_equal(matrix.to_numpy(), series[4])
+    assert matrix[3, 5] == series[4][3, 5]
+
+    # a slot that was cut off is not read and dropped when the cube is opened again
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert CubeReader(path).iterations() == [10 * k for k in range(9)]
+    SnapshotCube(path, 13, 13)
+    assert (os.path.getsize(path) - HEADER_SIZE) % cube.stride == 0
+
+    # an iteration stored twice, like the final bitmap of a run, is in the ranges once, from its last slot
+    cube.append_matrix(80, BitArrayMat.from_numpy(series[0]))
+    reader = CubeReader(path)
+    assert len(reader.spins()) == len(reader) == 9
+    np.testing.assert_array_equal(reader.spins(70), np.array([series[7], series[0]]))
+    assert np.shares_memory(reader.stack(20, 50), reader.map)
+
+
+@pytest.mark.parametrize("shape", ((13, 13), (8, 16), (5, 7)))
+def test_bitarraymat_numpy(shape):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat, HaloBitArrayMat
+    spins = np.random.default_rng(3).integers(0, 2, size=shape, dtype=np.uint8)
+
+    for cls in (BitArrayMat, HaloBitArrayMat):
+        matrix = cls.from_numpy(spins)
+        np.testing.assert_array_equal(matrix.to_numpy(), spins)
+        assert cls.from_bits(shape[0], shape[1], matrix.bits()).bits() == matrix.bits()
+        # the same as going through a list of one python object per bit
+        assert matrix.bits() == cls(shape[0], shape[1], spins.flatten().tolist()).bits()
+
+    # the packed view shares the buffer of the matrix
+    matrix = BitArrayMat.from_numpy(spins)
+    view = matrix.packed_view()
+    view[0] ^= 0x80
+    assert matrix[0, 0] == 1 - spins[0, 0]
+    np.testing.assert_array_equal(np.unpackbits(view, count=spins.size).reshape(shape), matrix.to_numpy())
+
+
+@pytest.mark.parametrize("layout", ("square", "wraparound", "halo"))
+@pytest.mark.parametrize("shape", ((6, 6), (5, 9)))
+def test_bitarraymat_batch(layout, shape):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat, HaloBitArrayMat
+    rng = np.random.default_rng(4)
+    spins = rng.integers(0, 2, size=shape, dtype=np.uint8)
+    if layout == "halo":
+        matrix = HaloBitArrayMat.from_numpy(spins)
+    else:
+        matrix = BitArrayMat.from_numpy(spins, wraparound_indices=layout == "wraparound")
+    nrow, ncol = shape
+
+    def expected_sum(r, c):
+        if layout == "square":
+            return sum(spins[r + dr, c + dc] for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1))
+                       if 0 <= r + dr < nrow and 0 <= c + dc < ncol)
+        return matrix[r - 1, c] + matrix[r + 1, c] + matrix[r, c - 1] + matrix[r, c + 1]
+
+    sites = np.arange(nrow * ncol)
+    np.testing.assert_array_equal(matrix.gather(sites), spins.ravel())
+    field = np.array([[expected_sum(r, c) for c in range(ncol)] for r in range(nrow)])
+    np.testing.assert_array_equal(matrix.neighbor_sum(sites), field.ravel())
+    np.testing.assert_array_equal(matrix.neighbor_sum_field(), field)
+
+    # writes on edges and corners, several in the same byte
+    changed = np.array([0, 1, 2, ncol - 1, ncol + 2, nrow * ncol - 1])
+    spins.ravel()[changed] ^= 1
+    matrix.scatter(changed, spins.ravel()[changed])
+    np.testing.assert_array_equal(matrix.to_numpy(), spins)
+    for r in range(nrow):
+        for c in range(ncol):
+            assert matrix.neighbor_sum(r * ncol + c) == expected_sum(r, c)
+
+
+@pytest.mark.parametrize("wrap", (False, True))
+@pytest.mark.parametrize("shape", ((6, 6), (5, 64), (7, 65), (3, 130)))
+def test_bit_sliced_masks(wrap, shape):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat, HaloBitArrayMat, AlignedBitArrayMat, neighbor_sum_field
+    spins = np.random.default_rng(5).integers(0, 2, size=shape, dtype=np.uint8)
+    nb_sum = neighbor_sum_field(spins, wrap)
+
+    matrices = [BitArrayMat.from_numpy(spins, wraparound_indices=wrap),
+                AlignedBitArrayMat.from_numpy(spins, wraparound_indices=wrap)]
+    if wrap:
+        matrices.append(HaloBitArrayMat.from_numpy(spins))
+    for matrix in matrices:
+        at_least_3, at_most_1, exactly_2 = matrix.neighbor_masks()
+        assert at_least_3.shape == (shape[0], (shape[1] + 63) // 64)
+        for words, expected in ((at_least_3, nb_sum >= 3), (at_most_1, nb_sum <= 1), (exactly_2, nb_sum == 2)):
+            np.testing.assert_array_equal(np.unpackbits(words.astype(">u8").view(np.uint8), axis=1)[:, :shape[1]],
+                                          expected)
+            # the padding stays 0
+            assert np.unpackbits(words.astype(">u8").view(np.uint8), axis=1)[:, shape[1]:].sum() == 0
+
+
+@pytest.mark.parametrize("wrap", (False, True))
+def test_aligned_bitarraymat(wrap):
+    from glauber.DataStructs.BitArrayMat import BitArrayMat, AlignedBitArrayMat
+    spins = np.random.default_rng(6).integers(0, 2, size=(5, 70), dtype=np.uint8)
+    plain = BitArrayMat.from_numpy(spins, wraparound_indices=wrap)
+    aligned = AlignedBitArrayMat(5, 70, spins.flatten().tolist(), wraparound_indices=wrap)
+    assert aligned.bits() == plain.bits()
+    np.testing.assert_array_equal(aligned.row_words(), plain.row_words())
+
+    for r, c in ((0, 0), (4, 69), (2, 63), (2, 64)):
+        plain[r, c] = 1 - plain[r, c]
+        aligned[r, c] = plain[r, c]
+    sites = np.arange(5 * 70)
+    np.testing.assert_array_equal(aligned.to_numpy(), plain.to_numpy())
+    np.testing.assert_array_equal(aligned.neighbor_sum(sites), plain.neighbor_sum(sites))
+    np.testing.assert_array_equal(aligned.row_words(), plain.row_words())
@@ -3,7 +3,19 @@
 from glauber.glauberFixIndices import GlauberSimulatorFixIndices
 from glauber.glauberDynIndices import GlauberSimDynIndices
 from glauber.glauberTorus import GlauberFixedIndexTorus, GlauberDynIndexTorus
-from glauber.glauberSim import GlauberSim
+from glauber.glauberSim import GlauberSim, TRACE_FILE, OUTCOME_FROZEN, OUTCOME_CONFINED, OUTCOME_TIMEOUT
+from glauber.glauberSim import atomic_open
+from glauber.checkpointWriter import CheckpointWriter
+from glauber.glauberNumba import GlauberFixIndicesNumba, GlauberFixedIndexTorusNumba
+from glauber.glauberNumba import GlauberDynIndicesNumba, GlauberDynIndexTorusNumba
+from glauber.glauberNumba import GlauberGeometricIndices, GlauberGeometricTorus
+from glauber.glauberNumba import GlauberAdaptiveIndices, GlauberAdaptiveTorus
+from glauber.glauberReplicas import GlauberReplicas, GlauberReplicasTorus
+from glauber.glauberMultiSpin import GlauberMultiSpin, GlauberMultiSpinTorus, majority_words
+from glauber.DataStructs.EventTrace import EventTrace
+from glauber.DataStructs.BitArrayMat import BitArrayMat
+from glauber.DataStructs.SnapshotArchive import SnapshotReader, ARCHIVE_FILE
+from glauber.DataStructs.SnapshotCube import CubeReader, CUBE_FILE
 import numpy as np
 import logging
 import timeit
@@ -11,6 +23,13 @@ import pytest
 import sys
 import os
 import shutil
+import threading
+import time
+
+
+def load_vector(sim, result):
+    """the dense trace of a run, one share of +1 per iteration and -1 after the last one"""
+    return EventTrace.load(os.path.join(sim.results_dir, result["trace_file"])).dense(sim.t)
 
 
 @pytest.mark.parametrize(
@@ -106,6 +125,22 @@ class TestSingleGlauber:
         result = sim.run_single_glauber(False)
         assert result["fixation"] == False and result["iterations"] == 2000
 
+    def test_running_count(self, class_to_test: type[GlauberSim], tmpdir):
+        tmpdir = str(tmpdir)
+        sim = class_to_test(
+            n_interior=30,
+            padding=3,
+            p=0.6,
+            t=5000,
+            tol=0.99,
+            random_seed=3,
+            results_dir=tmpdir,
+            boundary="random",
+            check_sum_every=1,
+        )
+        # raises if the running count ever differs from a full recount
+        sim.run_single_glauber(False)
+
     @pytest.mark.slow
     def test_large_long(self, class_to_test: type[GlauberSim], tmpdir):
         tmpdir = str(tmpdir)
@@ -135,11 +170,11 @@ class TestSingleGlauber:
             t=200000,
             tol=0.9,
             results_dir=tmpdir,
-            random_seed=0,
+            random_seed=3,
         )
         result = sim.run_single_glauber(verbose=True)
         assert result["fixation"] == True
-        assert pytest.approx(result["iterations"], 200) == 196555
+        assert pytest.approx(result["iterations"], 200) == 177145
 
 
 @pytest.mark.parametrize("class_to_test", (GlauberSimulatorFixIndices,))
@@ -157,28 +192,41 @@ class TestFixedIndices:
         )
         result = sim.run_single_glauber(True)
         np.testing.assert_array_equal(
-            result["vector"],
+            load_vector(sim, result),
             np.array(
                 [
+                    0.64,
+                    0.64,
                     0.68,
                     0.68,
                     0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.72,
-                    0.68,
                     0.72,
                     0.76,
                     0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
+                    0.8,
                     0.84,
                     0.84,
-                    0.84,
+                    0.88,
                     0.88,
                     0.92,
                     0.92,
                     0.92,
+                    0.92,
+                    0.92,
+                    0.92,
+                    0.92,
+                    0.92,
+                    0.96,
                     0.96,
                     0.96,
                     0.96,
@@ -347,19 +395,6 @@ class TestFixedIndices:
                     -1.0,
                     -1.0,
                     -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
                 ]
             ),
         )
@@ -395,25 +430,26 @@ class TestDynamicIndices:
         )
         result = sim.run_single_glauber(True)
         np.testing.assert_array_equal(
-            result["vector"],
+            load_vector(sim, result),
             np.array(
                 [
+                    0.64,
                     0.68,
+                    0.68,
+                    0.72,
                     0.72,
                     0.76,
                     0.8,
                     0.76,
+                    0.76,
+                    0.76,
+                    0.76,
+                    0.76,
                     0.8,
                     0.84,
-                    0.84,
-                    0.88,
                     0.88,
                     0.92,
                     0.92,
-                    0.92,
-                    0.88,
-                    0.92,
-                    0.96,
                     0.96,
                     1.0,
                     -1.0,
@@ -597,7 +633,6 @@ class TestDynamicIndices:
                     -1.0,
                     -1.0,
                     -1.0,
-                    -1.0,
                 ]
             ),
         )
@@ -615,7 +650,7 @@ class TestDynamicIndices:
             results_dir=tmpdir,
         )
         result = sim.run_single_glauber(False)
-        assert result["fixation"] == True and result["iterations"] == 109
+        assert result["fixation"] == True and result["iterations"] == 154
 
 
 @pytest.mark.parametrize(
@@ -716,6 +751,22 @@ class TestTorus:
         result = sim.run_single_glauber(False)
         assert result["fixation"] == False and result["iterations"] == 2000
 
+    def test_running_count(self, class_to_test: type[GlauberSim], tmpdir):
+        tmpdir = str(tmpdir)
+        sim = class_to_test(
+            n_interior=30,
+            padding=3,
+            p=0.6,
+            t=5000,
+            tol=0.99,
+            random_seed=3,
+            results_dir=tmpdir,
+            boundary="random",
+            check_sum_every=1,
+        )
+        # raises if the running count ever differs from a full recount
+        sim.run_single_glauber(False)
+
     @pytest.mark.slow
     def test_large_long(self, class_to_test: type[GlauberSim], tmpdir):
         tmpdir = str(tmpdir)
@@ -768,9 +819,270 @@ class TestFixedTorus:
         )
         result = sim.run_single_glauber(True)
         np.testing.assert_array_equal(
-            result["vector"],
+            load_vector(sim, result),
+            np.array(
+                [
+                    0.6,
+                    0.56,
+                    0.56,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.56,
+                    0.56,
+                    0.52,
+                    0.52,
+                    0.52,
+                    0.48,
+                    0.48,
+                    0.48,
+                    0.48,
+                    0.44,
+                    0.44,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.44,
+                    0.44,
+                    0.44,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.4,
+                    0.36,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.28,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.28,
+                    0.28,
+                    0.32,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.36,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.28,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.32,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.28,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.24,
+                    0.2,
+                    0.16,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.12,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                    0.08,
+                ]
+            ),
+        )
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberDynIndexTorus,))
+class TestDynTorus:
+    def test_small_1(self, class_to_test: type[GlauberSim], tmpdir):
+        tmpdir = str(tmpdir)
+        sim = class_to_test(
+            padding=0,
+            n_interior=5,
+            p=0.7,
+            t=200,
+            tol=0.98,
+            random_seed=0,
+            results_dir=tmpdir,
+            boundary="random",
+        )
+        result = sim.run_single_glauber(True)
+        np.testing.assert_array_equal(
+            load_vector(sim, result),
             np.array(
                 [
+                    0.64,
+                    0.64,
+                    0.64,
+                    0.6,
+                    0.6,
+                    0.64,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.56,
+                    0.56,
+                    0.56,
+                    0.56,
+                    0.52,
+                    0.56,
+                    0.56,
+                    0.56,
+                    0.56,
+                    0.52,
+                    0.48,
+                    0.52,
+                    0.52,
+                    0.56,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.6,
+                    0.56,
+                    0.56,
+                    0.56,
+                    0.56,
+                    0.6,
+                    0.6,
+                    0.56,
                     0.6,
                     0.6,
                     0.6,
@@ -778,75 +1090,34 @@ class TestFixedTorus:
                     0.68,
                     0.68,
                     0.68,
+                    0.68,
+                    0.68,
+                    0.68,
+                    0.72,
+                    0.72,
+                    0.72,
+                    0.72,
+                    0.72,
+                    0.72,
+                    0.72,
                     0.72,
-                    0.76,
-                    0.76,
-                    0.76,
-                    0.76,
-                    0.76,
-                    0.8,
-                    0.8,
-                    0.76,
                     0.76,
                     0.8,
                     0.8,
                     0.8,
                     0.8,
                     0.8,
-                    0.8,
-                    0.8,
                     0.84,
                     0.84,
                     0.88,
                     0.88,
                     0.84,
                     0.84,
-                    0.84,
-                    0.84,
-                    0.84,
-                    0.84,
-                    0.84,
-                    0.84,
-                    0.84,
-                    0.88,
                     0.88,
                     0.92,
                     0.92,
                     0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
-                    0.92,
+                    0.96,
                     0.96,
                     1.0,
                     -1.0,
@@ -971,231 +1242,650 @@ class TestFixedTorus:
                     -1.0,
                     -1.0,
                     -1.0,
+                    -1.0,
+                    -1.0,
+                    -1.0,
+                    -1.0,
                 ]
             ),
         )
 
 
-@pytest.mark.parametrize("class_to_test", (GlauberDynIndexTorus,))
-class TestDynTorus:
-    def test_small_1(self, class_to_test: type[GlauberSim], tmpdir):
-        tmpdir = str(tmpdir)
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimDynIndices, GlauberDynIndexTorus))
+class TestLazyDeletion:
+    params = dict(n_interior=30, padding=3, p=0.55, t=50000, tol=0.99, random_seed=2)
+
+    def test_reject_rate(self, class_to_test, tmpdir):
+        sim = class_to_test(results_dir=str(tmpdir), purge_interval=10000, check_sum_every=100, **self.params)
+        result = sim.run_single_glauber(False)
+        assert result["fixation"] == True
+        assert 0 < result["reject_rate"] < 1
+        assert sim.n_rejects > 0
+
+    def test_purge_every_iteration(self, class_to_test, tmpdir):
+        # after a purge, every vertex in the indices can flip, so nothing is rejected
+        sim = class_to_test(results_dir=str(tmpdir), purge_interval=1, **self.params)
+        result = sim.run_single_glauber(False)
+        assert result["reject_rate"] == 0
+
+    def test_eager_has_no_reject_rate(self, class_to_test, tmpdir):
+        result = class_to_test(results_dir=str(tmpdir), **self.params).run_single_glauber(False)
+        assert "reject_rate" not in result
+
+    def test_neighbor_counts(self, class_to_test, tmpdir):
+        results = [class_to_test(results_dir=str(tmpdir) + f"/{counted}", purge_interval=500, neighbor_counts=counted,
+                                 **self.params).run_single_glauber(False) for counted in (True, False)]
+        assert results[0] == results[1]
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimulatorFixIndices, GlauberFixedIndexTorus,
+                                           GlauberSimDynIndices, GlauberDynIndexTorus))
+class TestNeighborCounts:
+    params = dict(n_interior=30, padding=2, p=0.55, t=20000, tol=0.99, random_seed=4)
+
+    def run(self, class_to_test, results_dir, **kwargs):
+        sim = class_to_test(results_dir=results_dir, **self.params, **kwargs)
+        result = sim.run_single_glauber(False)
+        return sim, result
+
+    def test_same_trajectory(self, class_to_test, tmpdir):
+        # check_sum_every also compares the field against the matrix
+        sim_1, result_1 = self.run(class_to_test, str(tmpdir) + "/counted", neighbor_counts=True, check_sum_every=97)
+        sim_2, result_2 = self.run(class_to_test, str(tmpdir) + "/plain")
+        assert result_1 == result_2
+        # the engine reads the field through compute_neighbor_sum, nothing is bound on the instance
+        assert "compute_neighbor_sum" not in vars(sim_1)
+        np.testing.assert_array_equal(load_vector(sim_1, result_1), load_vector(sim_2, result_2))
+
+
+@pytest.mark.parametrize(
+    "class_to_test, python_class",
+    (
+        (GlauberFixIndicesNumba, GlauberSimulatorFixIndices),
+        (GlauberFixedIndexTorusNumba, GlauberFixedIndexTorus),
+    ),
+)
+class TestNumbaEngine:
+    def run(self, class_to_test, tmpdir, **kwargs):
         sim = class_to_test(
-            padding=0,
-            n_interior=5,
-            p=0.7,
-            t=200,
-            tol=0.98,
-            random_seed=0,
+            n_interior=30,
+            padding=3,
+            p=0.6,
+            t=20000,
+            tol=0.99,
+            random_seed=3,
             results_dir=tmpdir,
-            boundary="random",
+            save_bitmaps_every=1000,
+            **kwargs,
         )
-        result = sim.run_single_glauber(True)
-        np.testing.assert_array_equal(
-            result["vector"],
-            np.array(
-                [
-                    0.56,
-                    0.6,
-                    0.64,
-                    0.6,
-                    0.64,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.72,
-                    0.72,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.64,
-                    0.64,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.68,
-                    0.72,
-                    0.72,
-                    0.72,
-                    0.72,
-                    0.76,
-                    0.76,
-                    0.76,
-                    0.8,
-                    0.8,
-                    0.84,
-                    0.88,
-                    0.92,
-                    0.92,
-                    0.96,
-                    0.96,
-                    1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                    -1.0,
-                ]
-            ),
+        result = sim.run_single_glauber(False)
+        result["vector"] = load_vector(sim, result)
+        return result
+
+    def test_reference(self, class_to_test, python_class, tmpdir):
+        tmpdir = str(tmpdir)
+        compiled = self.run(class_to_test, tmpdir + "/compiled", compiled=True)
+        reference = self.run(class_to_test, tmpdir + "/reference", compiled=False)
+        assert compiled["iterations"] == reference["iterations"]
+        np.testing.assert_array_equal(compiled["vector"], reference["vector"])
+        last = compiled["iterations"]
+        with open(tmpdir + f"/compiled/bitmap_results/iter-{last}.bmp", "rb") as f1, \
+             open(tmpdir + f"/reference/bitmap_results/iter-{last}.bmp", "rb") as f2:
+            assert f1.read() == f2.read()
+
+    def test_same_as_python(self, class_to_test, python_class, tmpdir):
+        tmpdir = str(tmpdir)
+        compiled = self.run(class_to_test, tmpdir + "/compiled")
+        python = self.run(python_class, tmpdir + "/python")
+        np.testing.assert_array_equal(compiled["vector"], python["vector"])
+        # both skip the same updates that leave the spin as it was
+        assert compiled["elided_fraction"] == python["elided_fraction"]
+        assert 0 < python["elided_fraction"] < 1
+
+    def test_running_count(self, class_to_test, python_class, tmpdir):
+        self.run(class_to_test, str(tmpdir), check_sum_every=100)
+
+    def test_fixation(self, class_to_test, python_class, tmpdir):
+        tmpdir = str(tmpdir)
+        kwargs = dict(n_interior=20, padding=2, p=0.9, t=20000, tol=0.97, random_seed=1,
+                      save_bitmaps_every=10)
+        # the global seed is set when the simulator is created, so create each one right before its run
+        sim_compiled = class_to_test(results_dir=tmpdir + "/compiled", **kwargs)
+        compiled = sim_compiled.run_single_glauber(False)
+        sim_python = python_class(results_dir=tmpdir + "/python", **kwargs)
+        python = sim_python.run_single_glauber(False)
+        assert compiled["fixation"] == python["fixation"] == True
+        assert compiled["iterations"] == python["iterations"]
+        np.testing.assert_array_equal(load_vector(sim_compiled, compiled), load_vector(sim_python, python))
+
+
+@pytest.mark.parametrize(
+    "class_to_test", (GlauberDynIndicesNumba, GlauberDynIndexTorusNumba)
+)
+class TestNumbaDynamic:
+    def run(self, class_to_test, tmpdir, **kwargs):
+        params = dict(
+            n_interior=30,
+            padding=3,
+            p=0.6,
+            t=20000,
+            tol=0.99,
+            random_seed=3,
+            results_dir=tmpdir,
+            save_bitmaps_every=1000,
+        )
+        params.update(kwargs)
+        sim = class_to_test(**params)
+        result = sim.run_single_glauber(False)
+        result["vector"] = load_vector(sim, result)
+        return result
+
+    def test_reference(self, class_to_test, tmpdir):
+        tmpdir = str(tmpdir)
+        compiled = self.run(class_to_test, tmpdir + "/compiled", compiled=True)
+        reference = self.run(class_to_test, tmpdir + "/reference", compiled=False)
+        assert compiled["fixation"] == reference["fixation"]
+        assert compiled["iterations"] == reference["iterations"]
+        np.testing.assert_array_equal(compiled["vector"], reference["vector"])
+
+    def test_running_count(self, class_to_test, tmpdir):
+        self.run(class_to_test, str(tmpdir), check_sum_every=10)
+
+    def test_small_checkpoints(self, class_to_test, tmpdir):
+        tmpdir = str(tmpdir)
+        result_1 = self.run(class_to_test, tmpdir, p=0.5, tol=1, boundary="random")
+        assert result_1["iterations"] >= 1000
+
+        sim_2 = class_to_test(
+            n_interior=30,
+            padding=3,
+            p=0.5,
+            t=30000,
+            tol=1,
+            boundary="random",
+            checkpoint_file=f"{tmpdir}/bitmap_results/iter-1000.bmp",
+            cp_result_file=f"{tmpdir}/result-dict.json",
+            results_dir=tmpdir + "/continuation",
+            random_seed=1,
+        )
+        result_2 = sim_2.run_single_glauber(False)
+        np.testing.assert_array_equal(load_vector(sim_2, result_2)[:1001], result_1["vector"][:1001])
+
+
+@pytest.mark.parametrize(
+    "class_to_test, fixed_class",
+    (
+        (GlauberGeometricIndices, GlauberFixIndicesNumba),
+        (GlauberGeometricTorus, GlauberFixedIndexTorusNumba),
+    ),
+)
+class TestGeometric:
+    def test_reference(self, class_to_test, fixed_class, tmpdir):
+        tmpdir = str(tmpdir)
+        params = dict(n_interior=30, padding=3, p=0.6, t=200000, tol=0.99, random_seed=3, save_bitmaps_every=1000)
+        sim_compiled = class_to_test(results_dir=tmpdir + "/compiled", compiled=True, **params)
+        compiled = sim_compiled.run_single_glauber(False)
+        sim_reference = class_to_test(results_dir=tmpdir + "/reference", compiled=False, **params)
+        reference = sim_reference.run_single_glauber(False)
+        assert compiled == reference
+        np.testing.assert_array_equal(load_vector(sim_compiled, compiled), load_vector(sim_reference, reference))
+
+    def test_running_count(self, class_to_test, fixed_class, tmpdir):
+        sim = class_to_test(n_interior=30, padding=3, p=0.6, t=200000, tol=0.99, random_seed=3,
+                            results_dir=str(tmpdir), check_sum_every=100)
+        sim.run_single_glauber(False)
+
+    def test_same_distribution(self, class_to_test, fixed_class, tmpdir):
+        # time to fixation on a small lattice, the skipping must not change its distribution
+        params = dict(n_interior=6, padding=1, p=0.6, t=200000, tol=1)
+        iterations = {}
+        for cls in (class_to_test, fixed_class):
+            iterations[cls] = np.array([
+                cls(results_dir=f"{tmpdir}/{cls.__name__}/{seed}", random_seed=seed, **params)
+                .run_single_glauber(False)["iterations"] for seed in range(200)])
+        geometric, fixed = iterations[class_to_test], iterations[fixed_class]
+        std_error = np.sqrt(geometric.var() / len(geometric) + fixed.var() / len(fixed))
+        assert abs(geometric.mean() - fixed.mean()) < 4 * std_error
+
+
+@pytest.mark.parametrize(
+    "class_to_test, fixed_class, dynamic_class",
+    (
+        (GlauberAdaptiveIndices, GlauberFixIndicesNumba, GlauberDynIndicesNumba),
+        (GlauberAdaptiveTorus, GlauberFixedIndexTorusNumba, GlauberDynIndexTorusNumba),
+    ),
+)
+class TestAdaptive:
+    params = dict(n_interior=40, padding=2, p=0.55, t=200000, tol=0.99, random_seed=2, save_bitmaps_every=1000)
+
+    def run(self, cls, results_dir, **kwargs):
+        sim = cls(results_dir=results_dir, **self.params, **kwargs)
+        result = sim.run_single_glauber(False)
+        return result, load_vector(sim, result)
+
+    def test_reference(self, class_to_test, fixed_class, dynamic_class, tmpdir):
+        tmpdir = str(tmpdir)
+        compiled, compiled_vector = self.run(class_to_test, tmpdir + "/compiled", check_sum_every=100)
+        reference, reference_vector = self.run(class_to_test, tmpdir + "/reference", compiled=False)
+        assert 0 < compiled["switch_iteration"] < compiled["iterations"]
+        assert compiled["switch_iteration"] == reference["switch_iteration"]
+        assert compiled["iterations"] == reference["iterations"]
+        assert compiled["fixed_seconds"] > 0 and compiled["dynamic_seconds"] > 0
+        np.testing.assert_array_equal(compiled_vector, reference_vector)
+
+    def test_phases(self, class_to_test, fixed_class, dynamic_class, tmpdir):
+        tmpdir = str(tmpdir)
+        # never switching is the fixed index engine, switching right away the dynamic one
+        never, never_vector = self.run(class_to_test, tmpdir + "/never", switch_fraction=0)
+        fixed, fixed_vector = self.run(fixed_class, tmpdir + "/fixed")
+        assert never["switch_iteration"] is None
+        np.testing.assert_array_equal(never_vector, fixed_vector)
+
+        always, always_vector = self.run(class_to_test, tmpdir + "/always", switch_fraction=1.1)
+        dynamic, dynamic_vector = self.run(dynamic_class, tmpdir + "/dynamic")
+        assert always["switch_iteration"] == 0
+        assert always["iterations"] == dynamic["iterations"]
+        np.testing.assert_array_equal(always_vector, dynamic_vector)
+
+
+@pytest.mark.parametrize(
+    "fixed_class, dynamic_class",
+    (
+        (GlauberSimulatorFixIndices, GlauberSimDynIndices),
+        (GlauberFixedIndexTorus, GlauberDynIndexTorus),
+        (GlauberFixIndicesNumba, GlauberDynIndicesNumba),
+    ),
+)
+class TestHandoff:
+    params = dict(n_interior=30, padding=3, p=0.6, tol=0.99, random_seed=3)
+
+    def test_continues_exactly(self, fixed_class, dynamic_class, tmpdir):
+        tmpdir = str(tmpdir)
+        # a fixed run handed over to another fixed simulator is the same as one run without the handoff
+        sim_1 = fixed_class(t=500, results_dir=tmpdir + "/first", **self.params)
+        sim_1.run_single_glauber(False)
+        sim_2 = fixed_class(t=5000, results_dir=tmpdir + "/second", initial_state=sim_1.final_state,
+                            check_sum_every=100, **self.params)
+        result_2 = sim_2.run_single_glauber(False)
+
+        sim = fixed_class(t=5000, results_dir=tmpdir + "/whole", **self.params)
+        result = sim.run_single_glauber(False)
+        assert result == result_2
+        np.testing.assert_array_equal(load_vector(sim_2, result_2), load_vector(sim, result))
+
+    def test_fixed_then_dynamic(self, fixed_class, dynamic_class, tmpdir):
+        tmpdir = str(tmpdir)
+        sim_1 = fixed_class(t=500, results_dir=tmpdir + "/fixed", **self.params)
+        result_1 = sim_1.run_single_glauber(False)
+        sim_2 = dynamic_class(t=5000, results_dir=tmpdir + "/dynamic", initial_state=sim_1.final_state,
+                              check_sum_every=100, **self.params)
+        result_2 = sim_2.run_single_glauber(False)
+
+        vector_1 = load_vector(sim_1, result_1)
+        vector_2 = load_vector(sim_2, result_2)
+        # the dynamic phase starts right after the last fixed iteration, without a gap
+        np.testing.assert_array_equal(vector_2[:500], vector_1)
+        assert np.all(vector_2[:max(result_2["iterations"], 501)] != -1)
+
+
+@pytest.mark.parametrize(
+    "class_to_test, kwargs",
+    (
+        (GlauberSimulatorFixIndices, {}),
+        (GlauberSimDynIndices, {}),
+        (GlauberSimDynIndices, {"purge_interval": 50}),
+        (GlauberSimDynIndices, {"neighbor_counts": True}),
+        (GlauberDynIndexTorus, {}),
+        (GlauberFixIndicesNumba, {}),
+        (GlauberDynIndicesNumba, {}),
+        (GlauberAdaptiveIndices, {"switch_fraction": 0.5}),
+    ),
+)
+class TestStateCheckpoint:
+    params = dict(n_interior=30, padding=2, p=0.5, t=20000, tol=0.99, random_seed=7, save_bitmaps_every=3000)
+
+    def test_resume_exactly(self, class_to_test, kwargs, tmpdir):
+        tmpdir = str(tmpdir)
+        sim = class_to_test(results_dir=tmpdir + "/whole", **self.params, **kwargs)
+        result = sim.run_single_glauber(False)
+
+        # only the latest state checkpoint is kept
+        states = [f for f in os.listdir(sim.bitmap_dir) if f.startswith("state-")]
+        assert len(states) == 1
+
+        # a run killed after its last checkpoint continues from it as if it had not stopped
+        # the random numbers come from the checkpoint, not from the seed
+        sim_2 = class_to_test(results_dir=tmpdir + "/resumed", checkpoint_file=os.path.join(sim.bitmap_dir, states[0]),
+                              **{**self.params, **kwargs, "random_seed": 1})
+        result_2 = sim_2.run_single_glauber(False)
+
+        for key in ("fixed_seconds", "dynamic_seconds"):
+            result.pop(key, None)
+            result_2.pop(key, None)
+        assert result == result_2
+        np.testing.assert_array_equal(load_vector(sim_2, result_2), load_vector(sim, result))
+        np.testing.assert_array_equal(sim_2.final_state["matrix"].to_numpy(), sim.final_state["matrix"].to_numpy())
+
+    def test_past_t(self, class_to_test, kwargs, tmpdir):
+        # a state checkpoint past the number of iterations is handed on without running or cutting the trace
+        tmpdir = str(tmpdir)
+        sim = class_to_test(results_dir=tmpdir + "/whole", **{**self.params, **kwargs, "t": 7000})
+        sim.run_single_glauber(False)
+        state = [f for f in os.listdir(sim.bitmap_dir) if f.startswith("state-")][0]
+        last_index = int(state.split("-")[1].split(".")[0])
+
+        sim_2 = class_to_test(results_dir=tmpdir + "/short", checkpoint_file=os.path.join(sim.bitmap_dir, state),
+                              **{**self.params, **kwargs, "t": 1000})
+        result = sim_2.run_single_glauber(False)
+        assert result["iterations"] == last_index
+        assert len(sim_2.final_state["trace"]) == last_index + 1
+
+
+def test_checkpoint_writer():
+    # a slow disk: the second job waits in the queue and the third one has to wait for room
+    written = []
+    release = threading.Event()
+
+    def job(k):
+        def write():
+            release.wait()
+            written.append(k)
+        return write
+
+    writer = CheckpointWriter(max_pending=1)
+    writer.submit(job(0))
+    while writer.queue.qsize() > 0:
+        time.sleep(0.001)
+    writer.submit(job(1))
+    threading.Timer(0.05, release.set).start()
+    writer.submit(job(2))
+    writer.close()
+    assert written == [0, 1, 2]
+    metrics = writer.metrics()
+    assert metrics["jobs"] == 3 and metrics["blocked"] == 1 and metrics["peak_pending"] == 1
+
+    # an error in the background thread comes up in the loop
+    def fail():
+        raise OSError("disk full")
+    writer.submit(fail)
+    with pytest.raises(OSError):
+        writer.close()
+
+    # a queue of size 0 would have no bound
+    with pytest.raises(ValueError):
+        CheckpointWriter(max_pending=0)
+
+
+def test_checkpoints_written_on_error(tmpdir):
+    # a run that fails still writes the checkpoints it has queued before the error comes up
+    params = dict(n_interior=30, padding=2, p=0.5, t=5000, tol=0.99, random_seed=7, save_bitmaps_every=500)
+    sim = GlauberSimDynIndices(results_dir=str(tmpdir), checkpoint_queue=2, **params)
+    run_iterations = sim.run_iterations
+
+    def fail(*args):
+        run_iterations(*args)
+        raise RuntimeError("killed")
+
+    sim.run_iterations = fail
+    with pytest.raises(RuntimeError):
+        sim.run_single_glauber(False)
+    assert sim.writer.thread is None
+    assert sim.writer.metrics()["jobs"] > 1
+    assert "iter-500.bmp" in os.listdir(sim.bitmap_dir)
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimDynIndices, GlauberDynIndicesNumba))
+def test_background_checkpoints(class_to_test, tmpdir):
+    # the background writer writes the same files as writing them in the loop
+    params = dict(n_interior=30, padding=2, p=0.5, t=5000, tol=0.99, random_seed=7, save_bitmaps_every=500)
+    sim = class_to_test(results_dir=str(tmpdir) + "/loop", **params)
+    sim.run_single_glauber(False)
+    sim_2 = class_to_test(results_dir=str(tmpdir) + "/background", checkpoint_queue=2, **params)
+    sim_2.run_single_glauber(False)
+
+    files = sorted(f for f in os.listdir(sim.bitmap_dir) if f != "params.json")
+    assert files == sorted(f for f in os.listdir(sim_2.bitmap_dir) if f != "params.json")
+    for file in files:
+        with open(os.path.join(sim.bitmap_dir, file), "rb") as f, open(os.path.join(sim_2.bitmap_dir, file), "rb") as f_2:
+            assert f.read() == f_2.read()
+    assert sim_2.checkpoint_metrics["jobs"] == sim.checkpoint_metrics["jobs"] > 1
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimDynIndices, GlauberFixedIndexTorus, GlauberFixIndicesNumba))
+def test_bitmap_archive(class_to_test, tmpdir):
+    tmpdir = str(tmpdir)
+    params = dict(n_interior=30, padding=0 if class_to_test is GlauberFixedIndexTorus else 2, p=0.6, t=4000,
+                  tol=0.99, random_seed=3, save_bitmaps_every=250)
+    sim = class_to_test(results_dir=tmpdir + "/files", **params)
+    result = sim.run_single_glauber(False)
+    sim_2 = class_to_test(results_dir=tmpdir + "/archive", bitmap_archive=True, bitmap_cube=True, checkpoint_queue=2,
+                          **params)
+    sim_2.run_single_glauber(False)
+
+    # the archive and the cube hold the same bitmaps as the files
+    reader = SnapshotReader(os.path.join(sim_2.bitmap_dir, ARCHIVE_FILE))
+    cube = CubeReader(os.path.join(sim_2.bitmap_dir, CUBE_FILE))
+    assert cube.iterations() == reader.iterations()
+    bitmaps = [f for f in os.listdir(sim.bitmap_dir) if f.endswith(".bmp")]
+    assert not any(f.endswith(".bmp") for f in os.listdir(sim_2.bitmap_dir))
+    assert sorted(reader.iterations()) == sorted(int(f.split("-")[1].split(".")[0]) for f in bitmaps)
+    for f in bitmaps:
+        matrix = BitArrayMat(sim.n_outer, sim.n_outer)
+        matrix.load_from_file(os.path.join(sim.bitmap_dir, f))
+        assert reader.get(int(f.split("-")[1].split(".")[0])).bits() == matrix.bits()
+        np.testing.assert_array_equal(cube.get(int(f.split("-")[1].split(".")[0])).to_numpy(), matrix.to_numpy())
+
+    # and a run continues from its latest snapshot
+    sim_3 = class_to_test(results_dir=tmpdir + "/continued", checkpoint_file=os.path.join(sim_2.bitmap_dir, ARCHIVE_FILE),
+                          cp_result_file=os.path.join(sim_2.results_dir, "result-dict.json"),
+                          **{**params, "t": 8000})
+    result_3 = sim_3.run_single_glauber(False)
+    vector = load_vector(sim, result)
+    np.testing.assert_array_equal(load_vector(sim_3, result_3)[:len(vector)], vector)
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimulatorFixIndices, GlauberFixedIndexTorus))
+def test_chunked_setup_matrix(class_to_test, tmpdir, monkeypatch):
+    import glauber.glauberSimBitarray
+    params = dict(n_interior=45, padding=0 if class_to_test is GlauberFixedIndexTorus else 3, p=0.4, t=10,
+                  tol=0.99, random_seed=5)
+    sim = class_to_test(results_dir=str(tmpdir) + "/whole", **params)
+    sim.setup_matrix()
+
+    # blocks of a few rows draw the same spins as one block for the whole lattice
+    monkeypatch.setattr(glauber.glauberSimBitarray, "INIT_CHUNK", 150)
+    sim_2 = class_to_test(results_dir=str(tmpdir) + "/chunks", **params)
+    sim_2.setup_matrix()
+    np.testing.assert_array_equal(sim_2.matrix.to_numpy(), sim.matrix.to_numpy())
+
+    # and the same as drawing all spins at once like before
+    rng = np.random.default_rng(np.random.SeedSequence(5).spawn(2)[1])
+    expected = rng.binomial(n=1, p=0.4, size=sim.n_outer**2).reshape((sim.n_outer, sim.n_outer))
+    if class_to_test is GlauberSimulatorFixIndices:
+        expected[0, :] = expected[-1, :] = expected[:, 0] = expected[:, -1] = 1
+    np.testing.assert_array_equal(sim.matrix.to_numpy(), expected)
+
+
+def test_atomic_open(tmpdir):
+    path = str(tmpdir) + "/file.json"
+    with atomic_open(path, "w") as f:
+        f.write("old")
+
+    # a write that fails half way leaves the old file and no temporary file
+    with pytest.raises(RuntimeError):
+        with atomic_open(path, "w") as f:
+            f.write("ne")
+            raise RuntimeError("killed")
+    assert open(path).read() == "old"
+    assert os.listdir(str(tmpdir)) == ["file.json"]
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberFixedIndexTorus, GlauberDynIndexTorus,
+                                           GlauberFixedIndexTorusNumba, GlauberDynIndexTorusNumba))
+class TestStationary:
+    def run(self, class_to_test, results_dir, seed, **kwargs):
+        sim = class_to_test(n_interior=12, p=0.5, t=30000, tol=0.99, random_seed=seed, results_dir=results_dir,
+                            **kwargs)
+        result = sim.run_single_glauber(False)
+        return result, load_vector(sim, result)
+
+    def test_stops_early(self, class_to_test, tmpdir):
+        stopped = 0
+        for seed in range(8):
+            checked, vector_checked = self.run(class_to_test, str(tmpdir) + f"/checked-{seed}", seed,
+                                               stationary_check_every=100)
+            plain, vector_plain = self.run(class_to_test, str(tmpdir) + f"/plain-{seed}", seed)
+
+            if checked["outcome"] in (OUTCOME_FROZEN, OUTCOME_CONFINED) and checked["iterations"] < plain["iterations"]:
+                stopped += 1
+                # a run that is stopped early never reaches fixation
+                assert plain["outcome"] in (OUTCOME_FROZEN, OUTCOME_TIMEOUT)
+                last = checked["iterations"]
+                np.testing.assert_array_equal(vector_checked[:last + 1], vector_plain[:last + 1])
+                assert np.all(vector_checked[last + 1:] == -1)
+            else:
+                assert checked["outcome"] == plain["outcome"] and checked["iterations"] == plain["iterations"]
+        assert stopped > 0
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimDynIndices, GlauberDynIndexTorus))
+def test_stationary_outcome(class_to_test, tmpdir):
+    # on the square, the boundary never flips and counts towards the interior here
+    sim = class_to_test(n_interior=20, padding=0, p=0.5, t=10, tol=0.8, random_seed=0, results_dir=str(tmpdir))
+    sim.setup_interior_mask()
+    n = sim.n_outer
+
+    def outcome(spins):
+        sim.matrix = sim.matrix_class()(n, n, spins.flatten().tolist(), wraparound_indices=sim.wrap_indices)
+        sim.n_ones = sim.sum_ones()
+        return sim.stationary_outcome(sim.n_interior**2)
+
+    stripe = np.zeros((n, n), dtype=np.uint8)
+    stripe[:n // 2] = 1
+    assert outcome(stripe) == OUTCOME_FROZEN
+
+    # a bump on the interface flips back, only the interface row may ever flip
+    stripe[n // 2, 5] = 1
+    assert outcome(stripe) == OUTCOME_CONFINED
+
+    random_spins = np.random.default_rng(0).integers(0, 2, (n, n), dtype=np.uint8)
+    assert outcome(random_spins) is None
+
+
+def test_numba_no_more_indices(tmpdir):
+    # everything is +1, so no vertex can ever flip
+    sim = GlauberDynIndicesNumba(
+        n_interior=10, padding=1, p=1, t=100, tol=1.1, random_seed=0, results_dir=str(tmpdir)
+    )
+    result = sim.run_single_glauber(False)
+    assert result["fixation"] == False and result["iterations"] == 0
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberSimDynIndices, GlauberDynIndexTorus))
+def test_active_mask(class_to_test, tmpdir):
+    sim = class_to_test(
+        n_interior=40, padding=2, p=0.5, t=10, tol=1, random_seed=5, results_dir=str(tmpdir), boundary="random"
+    )
+    sim.setup_matrix()
+    sim.setup_indices()
+
+    # the vertices that can flip, looked at one by one
+    low, high = (0, sim.n_outer) if sim.wrap_indices else (1, sim.n_outer - 1)
+    expected = []
+    for i in range(low, high):
+        for j in range(low, high):
+            nb_sum = sim.matrix[i - 1, j] + sim.matrix[i + 1, j] + sim.matrix[i, j - 1] + sim.matrix[i, j + 1]
+            if nb_sum == 2 or (nb_sum > 2 and sim.matrix[i, j] == 0) or (nb_sum < 2 and sim.matrix[i, j] == 1):
+                expected.append(i * sim.n_outer + j)
+
+    assert list(sim.indices) == expected
+
+
+@pytest.mark.parametrize("purge_interval", (None, 50))
+def test_torus_indices_canonical(purge_interval, tmpdir):
+    sim = GlauberDynIndexTorus(
+        n_interior=12, p=0.5, t=2000, tol=1, random_seed=3, results_dir=str(tmpdir), purge_interval=purge_interval
+    )
+    sim.setup_matrix()
+    sim.setup_interior_mask()
+    sim.setup_indices()
+    sim.n_ones = sim.sum_ones()
+    sim.trace = EventTrace(sim.n_interior**2, sim.n_ones)
+    sim.run_iterations(0, sim.n_interior**2)
+
+    # one entry per vertex, and every vertex that can flip is in there
+    items = list(sim.indices)
+    assert len(set(items)) == len(items)
+    assert all(0 <= site < sim.n_outer**2 for site in items)
+    assert set(np.flatnonzero(sim.active_mask())) <= set(items)
+
+
+@pytest.mark.parametrize("class_to_test", (GlauberReplicas, GlauberReplicasTorus,
+                                           GlauberMultiSpin, GlauberMultiSpinTorus))
+class TestReplicas:
+    def run(self, class_to_test, tmpdir, n_replicas=8, **kwargs):
+        params = dict(
+            n_interior=20,
+            padding=2,
+            p=0.6,
+            t=20000,
+            tol=0.99,
+            random_seed=3,
+            save_bitmaps_every=1000,
         )
+        params.update(kwargs)
+        results_dirs = [f"{tmpdir}/rep-{k}" for k in range(n_replicas)]
+        sim = class_to_test(results_dirs=results_dirs, **params)
+        return sim, sim.run_replicas(False)
+
+    def test_running_count(self, class_to_test, tmpdir):
+        sim, results = self.run(class_to_test, str(tmpdir), check_sum_every=100)
+        for k, result in enumerate(results):
+            trace = EventTrace.load(f"{sim.results_dirs[k]}/{result['trace_file']}")
+            bits = np.fromfile(f"{sim.results_dirs[k]}/bitmap_results/iter-{result['iterations']}.bmp", dtype=np.uint8)
+            spins = np.unpackbits(bits, count=sim.n_outer**2).reshape((sim.n_outer, sim.n_outer))
+            interior = spins[sim.padding:sim.n_outer - sim.padding, sim.padding:sim.n_outer - sim.padding]
+            assert trace.counts()[-1] == interior.sum()
+
+    def test_fixation(self, class_to_test, tmpdir):
+        sim, results = self.run(class_to_test, str(tmpdir), p=0.9, tol=0.97)
+        assert all(result["fixation"] for result in results)
+        assert all(result["iterations"] < sim.t for result in results)
+        # the replicas are independent
+        assert len(set(result["iterations"] for result in results)) > 1
+
+    def test_reproducible(self, class_to_test, tmpdir):
+        tmpdir = str(tmpdir)
+        sim_1, results_1 = self.run(class_to_test, tmpdir + "/first", n_replicas=3)
+        sim_2, results_2 = self.run(class_to_test, tmpdir + "/second", n_replicas=3)
+        assert results_1 == results_2
+        for dir_1, dir_2 in zip(sim_1.results_dirs, sim_2.results_dirs):
+            np.testing.assert_array_equal(EventTrace.load(f"{dir_1}/{TRACE_FILE}").dense(),
+                                          EventTrace.load(f"{dir_2}/{TRACE_FILE}").dense())
+
+
+def test_majority_words():
+    # every combination of the four neighbors and the coin in its own bit
+    combos = np.array([[(k >> j) & 1 for j in range(5)] for k in range(32)], dtype=np.uint64)
+    shifts = np.arange(32, dtype=np.uint64)
+    a, b, c, d, coins = (np.bitwise_or.reduce(combos[:, j] << shifts) for j in range(5))
+    new, tied = majority_words(a, b, c, d, coins)
+
+    nb_sum = combos[:, :4].sum(axis=1)
+    expected = np.where(nb_sum > 2, 1, np.where(nb_sum < 2, 0, combos[:, 4]))
+    np.testing.assert_array_equal((np.uint64(new) >> shifts) & np.uint64(1), expected)
+    np.testing.assert_array_equal((np.uint64(tied) >> shifts) & np.uint64(1), nb_sum == 2)
+
 
+@pytest.mark.parametrize("class_to_test", (GlauberMultiSpin, GlauberMultiSpinTorus))
+def test_multispin_reference(class_to_test, tmpdir):
+    tmpdir = str(tmpdir)
+    params = dict(n_interior=20, padding=2, p=0.6, t=5000, tol=0.99, random_seed=3, save_bitmaps_every=1000)
+    compiled = class_to_test(results_dirs=[f"{tmpdir}/compiled/rep-{k}" for k in range(64)], **params)
+    reference = class_to_test(results_dirs=[f"{tmpdir}/reference/rep-{k}" for k in range(64)],
+                              compiled=False, **params)
+    assert compiled.run_replicas(False) == reference.run_replicas(False)
+    for k in range(64):
+        np.testing.assert_array_equal(EventTrace.load(f"{tmpdir}/compiled/rep-{k}/{TRACE_FILE}").dense(),
+                                      EventTrace.load(f"{tmpdir}/reference/rep-{k}/{TRACE_FILE}").dense())
@@ -6,6 +6,7 @@ import sys
 import numpy as np
 import json
 import os
+from glauber.DataStructs.EventTrace import EventTrace
 
 def test_main_1(tmpdir):
 
@@ -134,6 +135,243 @@ def test_main_6(tmpdir):
     main_instance  = Main(result_dir=tmpdir, arguments = options.split())
     assert main_instance.main() == 0
 
+def test_main_numba(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    t = 2000
+    n = 4
+    checkpoint = 1000
+    n_int = 200
+    padding = 1
+    p = 0.505
+
+    options = f"--t={t} --n={n} --checkpoint={checkpoint} " + \
+        f"--n_int={n_int} --padding={padding} --p={p} --force_new --mixed --fixed_steps=500 --numba"
+    
+    
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+
+def test_main_replicas(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    t = 2000
+    n = 5
+    checkpoint = 1000
+    n_int = 20
+    padding = 1
+    p = 0.6
+
+    options = f"--t={t} --n={n} --checkpoint={checkpoint} " + \
+        f"--n_int={n_int} --padding={padding} --p={p} --force_new --replicas=2"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+
+    # 5 repetitions in blocks of 2, 2 and 1, every one with its own results
+    for i in range(n):
+        result = json.load(open(os.path.join(main_instance.result_dir, f"rep-{i}", "result-dict.json"), "r"))
+        trace = EventTrace.load(os.path.join(main_instance.result_dir, f"rep-{i}", result["trace_file"]))
+        assert len(trace) == t or result["fixation"]
+
+    # the options of the single runs are logged as ignored, not passed on
+    options += " --neighbor_counts --checkpoint_queue=2"
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.replica_ignored_flags() == ["--checkpoint_queue", "--neighbor_counts"]
+    assert main_instance.main() == 0
+
+def test_main_multispin(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    t = 2000
+    n = 70
+    checkpoint = 1000
+    n_int = 10
+    padding = 1
+    p = 0.6
+
+    options = f"--t={t} --n={n} --checkpoint={checkpoint} " + \
+        f"--n_int={n_int} --padding={padding} --p={p} --force_new --multispin --torus"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    assert len([x for x in os.listdir(main_instance.result_dir) if x.startswith("rep-")]) == n
+
+def test_main_geometric(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    t = 200000
+    n = 2
+    checkpoint = 50000
+    n_int = 50
+    padding = 1
+    p = 0.6
+
+    options = f"--t={t} --n={n} --checkpoint={checkpoint} " + \
+        f"--n_int={n_int} --padding={padding} --p={p} --force_new --geometric"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+
+def test_main_adaptive(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    t = 200000
+    n = 2
+    checkpoint = 50000
+    n_int = 50
+    padding = 1
+    p = 0.6
+
+    options = f"--t={t} --n={n} --checkpoint={checkpoint} " + \
+        f"--n_int={n_int} --padding={padding} --p={p} --force_new --adaptive --switch_fraction=0.2"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    result = json.load(open(os.path.join(main_instance.result_dir, "rep-0", "result-dict.json"), "r"))
+    assert "switch_iteration" in result
+
+def test_main_purge_interval(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    t = 2000
+    n = 2
+    checkpoint = 1000
+    n_int = 50
+    padding = 1
+    p = 0.505
+
+    options = f"--t={t} --n={n} --checkpoint={checkpoint} " + \
+        f"--n_int={n_int} --padding={padding} --p={p} --force_new --mixed --fixed_steps=500 --purge_interval=200"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    result = json.load(open(os.path.join(main_instance.result_dir, "rep-0", "result-dict.json"), "r"))
+    assert "reject_rate" in result
+
+def test_main_neighbor_counts(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    options = "--t=2000 --n=2 --checkpoint=1000 --n_int=50 --padding=1 --p=0.505 --force_new --dynamic --neighbor_counts"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    params = json.load(open(os.path.join(main_instance.result_dir, "rep-0", "bitmap_results", "params.json"), "r"))
+    assert params["neighbor_counts"] == True
+
+def test_main_stationary_check(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    options = "--t=20000 --n=2 --checkpoint=1000 --n_int=12 --padding=0 --p=0.5 --force_new --torus " + \
+        "--random_boundary --stationary_check=100"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    result = json.load(open(os.path.join(main_instance.result_dir, "rep-0", "result-dict.json"), "r"))
+    assert result["outcome"] in ("plus", "minus", "timeout", "frozen", "confined")
+
+def test_main_checkpoint_queue(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    options = "--t=2000 --n=2 --checkpoint=100 --n_int=20 --padding=1 --p=0.5 --force_new --dynamic " + \
+        "--checkpoint_queue=2"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    bitmaps = os.listdir(os.path.join(main_instance.result_dir, "rep-0", "bitmap_results"))
+    assert "iter-100.bmp" in bitmaps
+
+def test_main_mixed_state(tmpdir):
+
+    tmpdir = str(tmpdir) + "/"
+
+    options = "--t=3000 --n=2 --checkpoint=200 --n_int=20 --padding=1 --p=0.5 --force_new --mixed " + \
+        "--fixed_steps=500"
+
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+    for rep in ("rep-0", "rep-1"):
+        files = os.listdir(os.path.join(main_instance.result_dir, rep, "bitmap_results"))
+        # the dynamic simulator removes the state checkpoint of the fixed one
+        assert len([f for f in files if f.startswith("state-")]) == 1
+    assert main.last_state(["state-400.npz", "state-2800.npz", "state-1000.npz"]) == "state-2800.npz"
+
+def test_mixed_resume_past_fixed_steps(tmpdir):
+    import time
+
+    tmp = main.RESULT_DIR
+    options = "--n=1 --mixed --fixed_steps=500 --checkpoint=200 --n_int=20 --padding=1 --p=0.5 --tol=0.999"
+
+    main.RESULT_DIR = str(tmpdir) + "/whole/"
+    os.makedirs(main.RESULT_DIR)
+    whole = Main(arguments=f"--t=6000 {options} --force_new".split())
+    assert whole.main() == 0
+
+    # the first run stops after its state checkpoint of the dynamic simulator, the second one continues from it
+    main.RESULT_DIR = str(tmpdir) + "/resumed/"
+    os.makedirs(main.RESULT_DIR)
+    first = Main(arguments=f"--t=3000 {options} --force_new".split())
+    assert first.main() == 0
+    assert "state-2800.npz" in os.listdir(os.path.join(first.result_dir, "rep-0", "bitmap_results"))
+    # the result dirs are named by the second
+    time.sleep(1.1)
+    resumed = Main(arguments=f"--t=6000 {options}".split())
+    assert resumed.main() == 0
+    main.RESULT_DIR = tmp
+
+    results = []
+    for run in (whole, resumed):
+        dir = os.path.join(run.result_dir, "rep-0")
+        with open(os.path.join(dir, "result-dict.json"), "r") as f:
+            result = json.load(f)
+        results.append((result, EventTrace.load(os.path.join(dir, result["trace_file"])).dense(6000)))
+    assert results[0][0] == results[1][0]
+    np.testing.assert_array_equal(results[0][1], results[1][1])
+    bitmaps = [f for f in os.listdir(os.path.join(resumed.result_dir, "rep-0", "bitmap_results")) if f.endswith(".bmp")]
+    assert min(int(f.split("-")[1].split(".")[0]) for f in bitmaps) > 2800
+
+def test_convert_bitmaps(tmpdir):
+    import convert_bitmaps
+    from glauber.DataStructs.BitArrayMat import BitArrayMat
+    from glauber.DataStructs.SnapshotArchive import SnapshotReader, ARCHIVE_FILE
+    from glauber.DataStructs.SnapshotCube import CubeReader, CUBE_FILE
+
+    tmpdir = str(tmpdir) + "/"
+    options = "--t=2000 --n=2 --checkpoint=100 --n_int=20 --padding=1 --p=0.5 --force_new --dynamic"
+    main_instance  = Main(result_dir=tmpdir, arguments = options.split())
+    assert main_instance.main() == 0
+
+    dir = os.path.join(main_instance.result_dir, "rep-1", "bitmap_results")
+    bitmaps = {}
+    for f in os.listdir(dir):
+        if f.endswith(".bmp"):
+            matrix = BitArrayMat(22, 22)
+            matrix.load_from_file(os.path.join(dir, f))
+            bitmaps[int(f.split("-")[1].split(".")[0])] = matrix.bits()
+
+    assert convert_bitmaps.main_fn(["--stem", tmpdir, "--delete"]) == 0
+    assert not any(f.endswith(".bmp") for f in os.listdir(dir))
+    reader = SnapshotReader(os.path.join(dir, ARCHIVE_FILE))
+    assert reader.iterations() == sorted(bitmaps)
+    for iteration, matrix in reader:
+        assert matrix.bits() == bitmaps[iteration]
+
+    # the cube is laid out from the archive once the bitmaps are gone
+    assert convert_bitmaps.main_fn(["--stem", tmpdir, "--cube"]) == 0
+    cube = CubeReader(os.path.join(dir, CUBE_FILE))
+    assert cube.iterations() == sorted(bitmaps)
+    for iteration in bitmaps:
+        np.testing.assert_array_equal(cube.get(iteration).to_numpy(), reader.get(iteration).to_numpy())
+
 def test_checkpoint_discovery(tmpdir):
 
     tmp = main.RESULT_DIR
@@ -208,29 +446,43 @@ def test_main_2(tmpdir):
     assert main_instance.main() == 0
   
     result = json.load(open(os.path.join(main_instance.result_dir, "rep-0", "result-dict.json"), "r"))
+    trace = EventTrace.load(os.path.join(main_instance.result_dir, "rep-0", result["trace_file"]))
     np.testing.assert_array_equal(
-        result["vector"],
+        trace.dense(t),
         np.array(
             [
-                0.68,
-                0.68,
-                0.68,
-                0.68,
+                0.64,
+                0.64,
                 0.68,
                 0.68,
                 0.68,
                 0.72,
-                0.68,
-                0.72,
                 0.76,
                 0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
+                0.8,
                 0.84,
                 0.84,
-                0.84,
+                0.88,
                 0.88,
                 0.92,
                 0.92,
                 0.92,
+                0.92,
+                0.92,
+                0.92,
+                0.92,
+                0.92,
+                0.96,
                 0.96,
                 0.96,
                 0.96,
@@ -399,19 +651,6 @@ def test_main_2(tmpdir):
                 -1.0,
                 -1.0,
                 -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
-                -1.0,
             ]
         ),
     )